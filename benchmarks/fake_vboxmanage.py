@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Fake VBoxManage executable, see webos_emulator.fakevbox."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webos_emulator.fakevbox import main
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
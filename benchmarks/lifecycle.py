@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Lifecycle benchmark of webos-emulator.
+
+Each run creates a vd, starts it, optionally waits until it is ready,
+stops and deletes it, and times every phase. The percentiles and the
+number of VBoxManage calls of the phases are reported as json and
+compared with a baseline report.
+
+    # CI, with the fake VBoxManage
+    python benchmarks/lifecycle.py --fake --runs 20 --output report.json
+    # overhead of webos-emulator itself, without process spawns
+    python benchmarks/lifecycle.py --fake --in-process --runs 200
+    # lab host, with VirtualBox and a webOS image
+    python benchmarks/lifecycle.py -i webos-image.vmdk --ready --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+PHASES = ["create", "start", "ready", "stop", "delete"]
+PERCENTILES = [50, 90, 99]
+
+def setup_fake(workdir, latency=0.0, in_process=False):
+    """Use the fake VBoxManage and isolate the VirtualBox and cache directories
+
+    Args:
+        workdir (str): directory for the fake state, caches and image
+        latency (float): seconds added to every VBoxManage call
+        in_process (bool): run the fake in process instead of on PATH,
+            which leaves only the overhead of webos-emulator itself
+
+    Returns:
+        path of an empty image file
+    """
+    os.environ["VBOX_USER_HOME"] = os.path.join(workdir, "vbox")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(workdir, "cache")
+    image = os.path.join(workdir, "image.vmdk")
+    open(image, "w").close()
+    if in_process:
+        from webos_emulator import runner
+        from webos_emulator.fakevbox import FakeBackend, FakeVBoxManage
+        runner.set_backend(FakeBackend(FakeVBoxManage(latency=latency)))
+        return image
+
+    bindir = os.path.join(workdir, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    script = os.path.join(bindir, "VBoxManage")
+    with open(script, "w") as f:
+        f.write("#!%s\nimport sys\nsys.path.insert(0, %r)\nfrom fake_vboxmanage import main\n"
+                "sys.exit(main(sys.argv[1:]))\n" % (sys.executable, HERE))
+    os.chmod(script, 0o755)
+    os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_VBOXMANAGE_STATE"] = os.path.join(workdir, "state.json")
+    os.environ["FAKE_VBOXMANAGE_LATENCY"] = str(latency)
+    return image
+
+def percentile(values, p):
+    """Get the p-th percentile with linear interpolation between the closest ranks"""
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summarize(samples):
+    """Get the statistics of the samples of a phase in seconds"""
+    stats = {"n": len(samples), "min": min(samples), "max": max(samples),
+             "mean": sum(samples) / len(samples)}
+    for p in PERCENTILES:
+        stats["p%d" % p] = percentile(samples, p)
+    return {k: round(v, 6) if isinstance(v, float) else v for k, v in stats.items()}
+
+def run_once(name, image, ready=False, ready_timeout=180):
+    """Run the lifecycle of a vd once
+
+    Returns:
+        tuple of {phase: seconds, phase.calls: VBoxManage calls} and the failed phase or None
+    """
+    from webos_emulator import WebosEmulator, runner
+    from webos_emulator.check import is_vd_exists
+    from webos_emulator.ready import wait_ready
+    from webos_emulator.webos_emulator import create_vd, delete_vd, start_vd, stop_vd
+
+    vd = WebosEmulator(name, name)
+    vd.image = image
+    times = {}
+
+    def phase(key, func):
+        runner.clear_records()
+        started = time.perf_counter()
+        ok = func()
+        times[key] = time.perf_counter() - started
+        times[key + ".calls"] = len(runner.get_records())
+        return ok
+
+    if not phase("create", lambda: create_vd(vd)):
+        return times, "create"
+    started = time.monotonic()
+    if not phase("start", lambda: start_vd(vd)):
+        delete_vd(vd)
+        return times, "start"
+    if ready and not phase("ready", lambda: wait_ready(vd.hostssh, ready_timeout, started=started) is not None):
+        stop_vd(vd)
+        delete_vd(vd)
+        return times, "ready"
+    if not phase("stop", lambda: stop_vd(vd)):
+        delete_vd(vd)
+        return times, "stop"
+    if not phase("delete", lambda: (delete_vd(vd), not is_vd_exists(vd.name))[1]):
+        return times, "delete"
+    return times, None
+
+def run_benchmark(runs, image, ready=False, ready_timeout=180, prefix="bench"):
+    """Run the lifecycle benchmark
+
+    Args:
+        runs (int): number of lifecycles
+        image (str): vmdk image attached to the vds
+        ready (bool): wait until the vds are ready after start
+        ready_timeout (float): seconds to wait for ready
+        prefix (str): prefix of the vd names
+
+    Returns:
+        report dict
+    """
+    from webos_emulator.check import get_vbox_version
+
+    samples = {}
+    calls = {}
+    failures = {}
+    for i in range(runs):
+        times, failed = run_once("%s-%d-%d" % (prefix, os.getpid(), i), image, ready, ready_timeout)
+        for key in PHASES:
+            if key in times and key != failed:
+                samples.setdefault(key, []).append(times[key])
+                calls.setdefault(key, []).append(times[key + ".calls"])
+        if failed:
+            failures[failed] = failures.get(failed, 0) + 1
+    phases = {}
+    for key in PHASES:
+        if samples.get(key):
+            phases[key] = summarize(samples[key])
+            phases[key]["calls"] = max(calls[key])
+    return {
+        "vbox_version": get_vbox_version(),
+        "runs": runs,
+        "phases": phases,
+        "failures": failures,
+    }
+
+def compare(report, baseline, threshold, metric="p50"):
+    """Compare the report with the baseline
+
+    Args:
+        report (dict): report of run_benchmark()
+        baseline (dict): stored report
+        threshold (float): allowed slowdown ratio, 0.2 allows 20% slower
+        metric (str): statistic to compare
+
+    Returns:
+        list of regression messages
+    """
+    regressions = []
+    for key, stats in report["phases"].items():
+        base = baseline.get("phases", {}).get(key, {}).get(metric)
+        if not base:
+            continue
+        ratio = stats[metric] / base
+        stats["baseline_ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append("%s %s %.3fs is %.0f%% slower than baseline %.3fs"
+                               % (key, metric, stats[metric], (ratio - 1) * 100, base))
+        base_calls = baseline["phases"][key].get("calls")
+        if base_calls is not None and stats["calls"] > base_calls:
+            regressions.append("%s makes %d VBoxManage calls, baseline %d" % (key, stats["calls"], base_calls))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lifecycle benchmark of webos-emulator")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="number of lifecycles")
+    parser.add_argument("-i", "--image", help="vmdk image, required without --fake")
+    parser.add_argument("--fake", action="store_true", help="use the fake VBoxManage")
+    parser.add_argument("--in-process", action="store_true", help="with --fake, run the fake in process")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake VBoxManage call")
+    parser.add_argument("--ready", action="store_true", help="time the boot until the ssh port is ready")
+    parser.add_argument("--ready-timeout", type=float, default=180, help="seconds to wait for ready")
+    parser.add_argument("-o", "--output", help="write the report to the file")
+    parser.add_argument("--baseline", help="compare with a stored report")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown ratio (default: 0.2)")
+    parser.add_argument("--metric", default="p50", choices=["p%d" % p for p in PERCENTILES] + ["mean"])
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="webos-emulator-bench-") as workdir:
+        image = args.image
+        if args.fake:
+            image = setup_fake(workdir, args.latency, args.in_process)
+        elif not image:
+            parser.error("-i <vmdk> is required without --fake")
+        report = run_benchmark(args.runs, os.path.abspath(image), args.ready, args.ready_timeout)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold, args.metric)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    for message in regressions:
+        print("regression : " + message, file=sys.stderr)
+    return 1 if regressions or report["failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
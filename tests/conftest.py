@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Fixtures for `webos-emulator` tests."""
+
+import pytest
+
+from webos_emulator import runner, webos_emulator
+from webos_emulator.check import invalidate_inventory
+from webos_emulator.fakevbox import FakeBackend, FakeVBoxManage
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    """Run VBoxManage by an in-process FakeVBoxManage with empty VirtualBox, config and cache directories"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setattr(webos_emulator, "_vd_json", None)
+    monkeypatch.setenv("VBOX_USER_HOME", str(tmp_path / "vbox"))
+    backend = runner.get_backend()
+    fake = FakeVBoxManage()
+    runner.set_backend(FakeBackend(fake))
+    invalidate_inventory()
+    yield fake
+    runner.set_backend(backend)
+    invalidate_inventory()
+
+
+@pytest.fixture
+def image(tmp_path):
+    """Empty vmdk image file"""
+    path = tmp_path / "webos-image.vmdk"
+    path.write_bytes(b"")
+    return str(path)
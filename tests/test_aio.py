@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the asyncio API of `webos-emulator`."""
+
+import asyncio
+import threading
+import time
+from unittest.mock import ANY
+
+from webos_emulator import WebosEmulator, aio
+from webos_emulator.aio import AsyncEmulatorManager, stop_vds
+from webos_emulator.ready import run_coroutine
+
+
+def make_vds(count, image):
+    vds = []
+    for i in range(count):
+        vd = WebosEmulator("ose-%d" % i, "ose-%d" % i)
+        vd.image = image
+        vds.append(vd)
+    return vds
+
+
+def test_lifecycle_concurrent(fake, image):
+    """vds are created, started, stopped and deleted concurrently"""
+    fake.latency = {"startvm": 0.2}
+    manager = AsyncEmulatorManager(concurrency=10)
+    vds = make_vds(10, image)
+
+    async def run():
+        assert await manager.share(image)
+        assert await manager.map(manager.create, vds) == [True] * 10
+        started = time.monotonic()
+        assert await manager.map(manager.start, vds) == [True] * 10
+        elapsed = time.monotonic() - started
+        assert sorted(await manager.list()) == sorted(vd.name for vd in vds)
+        assert await manager.map(manager.stop, vds) == [True] * 10
+        assert await manager.map(manager.delete, vds) == [True] * 10
+        return elapsed
+
+    assert run_coroutine(run()) < 1.0  # 10 starts of 0.2 seconds overlap
+    assert fake.state["vms"] == {}
+    assert fake.count("startvm") == 10
+
+
+def test_concurrency_limit(fake, image):
+    """At most 'concurrency' VBoxManage calls run at once"""
+    fake.latency = 0.02
+    manager = AsyncEmulatorManager(concurrency=2)
+    running = []
+    peak = []
+    delay, execute = fake.delay, fake.execute
+
+    def counted_delay(args):
+        # the in-process fake sleeps between delay() and execute()
+        running.append(1)
+        peak.append(len(running))
+        return delay(args)
+
+    def counted_execute(args):
+        running.pop()
+        return execute(args)
+
+    fake.delay, fake.execute = counted_delay, counted_execute
+
+    async def run():
+        await manager.share(image)
+        return await manager.map(manager.create, make_vds(4, image))
+
+    assert run_coroutine(run()) == [True] * 4
+    assert max(peak) == 2
+
+
+def test_inventory_shared(fake, image, monkeypatch):
+    """The inventory is read off the loop once, until a vd is changed"""
+    threads = []
+
+    def get_xml_inventory():
+        threads.append(threading.current_thread())
+    monkeypatch.setattr(aio, "get_xml_inventory", get_xml_inventory)
+    manager = AsyncEmulatorManager()
+    vds = make_vds(4, image)
+
+    async def run():
+        await manager.share(image)
+        await manager.map(manager.create, vds)
+        lists = fake.count("list")
+        assert all(await manager.map(lambda vd: manager.find(vd.name), vds))
+        assert fake.count("list") == lists + 1
+
+    run_coroutine(run())
+    assert threads and threading.main_thread() not in threads
+
+
+def test_cancel(fake, image):
+    """A cancelled operation stops at the running VBoxManage call"""
+    fake.latency = {"startvm": 10}
+    manager = AsyncEmulatorManager()
+    vd = make_vds(1, image)[0]
+
+    async def run():
+        assert await manager.create(vd)
+        task = asyncio.ensure_future(manager.start(vd))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert run_coroutine(run())
+    assert fake.vm(vd.name)["state"] == "poweroff"
+
+
+def test_acpi_shutdown(fake, image):
+    """Guests shut down by the ACPI power button concurrently, or are powered off after the timeout"""
+    manager = AsyncEmulatorManager()
+    vds = make_vds(3, image)
+    names = [vd.name for vd in vds]
+
+    async def start():
+        await manager.share(image)
+        await manager.map(manager.create, vds)
+        return await manager.map(manager.start, vds)
+
+    assert run_coroutine(start()) == [True] * 3
+    fake.acpi = 0.3
+    started = time.monotonic()
+    assert stop_vds(names, acpi=10) == names
+    assert time.monotonic() - started < 2.0  # 3 shutdowns of 0.3 seconds overlap
+    assert fake.calls.count(["controlvm", ANY, "acpipowerbutton"]) == 3 and fake.count("controlvm") == 3
+
+    assert run_coroutine(manager.map(manager.start, vds)) == [True] * 3
+    fake.acpi = None  # the guests ignore the button
+    assert stop_vds(names, acpi=0.2) == names
+    assert all(fake.vm(name)["state"] == "poweroff" for name in names)
+    assert fake.count("controlvm") == 9
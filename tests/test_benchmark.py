@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the lifecycle benchmark of `webos-emulator`."""
+
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIFECYCLE = os.path.join(os.path.dirname(HERE), "benchmarks", "lifecycle.py")
+
+
+def run_lifecycle(*args):
+    """Run the benchmark in a child interpreter, the fake changes PATH and the cache directory"""
+    return subprocess.run([sys.executable, LIFECYCLE, "--fake"] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_lifecycle_fake(tmp_path):
+    """Every phase is timed against the fake VBoxManage"""
+    output = str(tmp_path / "report.json")
+    proc = run_lifecycle("--runs", "2", "-o", output)
+    assert proc.returncode == 0, proc.stderr
+    with open(output) as f:
+        report = json.load(f)
+    assert report["failures"] == {}
+    assert sorted(report["phases"]) == ["create", "delete", "start", "stop"]
+    assert report["phases"]["create"]["n"] == 2
+    assert report["phases"]["create"]["p50"] <= report["phases"]["create"]["p99"]
+
+
+def test_lifecycle_baseline_regression(tmp_path):
+    """A phase slower than the baseline and threshold fails the benchmark"""
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"phases": {"start": {"p50": 1e-6}}}))
+    proc = run_lifecycle("--runs", "1", "--baseline", str(baseline), "--threshold", "0.5")
+    assert proc.returncode == 1
+    assert "regression : start p50" in proc.stderr
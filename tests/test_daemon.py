@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the daemon mode of `webos-emulator`."""
+
+import socket
+import sys
+import threading
+
+import pytest
+
+from webos_emulator import WebosEmulator, cli, daemon, webos_emulator
+
+
+@pytest.fixture
+def server(fake, tmp_path):
+    """Serve the daemon on a socket in tmp_path"""
+    path = str(tmp_path / "d.sock")
+    server = daemon.make_server(path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_daemon_requests(server, fake, image):
+    """vds are created, listed, started and queried by JSON-RPC"""
+    assert daemon.call("create", {"name": "ose", "image": image}, path=server)["result"] is True
+    assert daemon.call("start", {"name": "ose"}, path=server)["result"] is True
+    assert daemon.call("list", path=server)["result"] == [
+        {"name": "ose", "uuid": fake.vm("ose")["uuid"], "state": "running", "running": True}]
+    status = daemon.call("status", {"name": "ose"}, path=server)["result"]
+    assert status["memory"] == "4096" and set(status["ports"]) >= {"ssh"}
+    assert daemon.call("stop", {"name": "ose"}, path=server)["result"] is True
+    assert fake.vm("ose")["state"] == "poweroff"
+
+
+def test_daemon_errors(server, fake):
+    """Unknown methods, params and vds are errors"""
+    assert daemon.call("nope", path=server)["error"]["code"] == daemon.METHOD_NOT_FOUND
+    assert daemon.call("status", {"vd": "ose"}, path=server)["error"]["code"] == daemon.INVALID_PARAMS
+    assert "webos-emulator -l" in daemon.call("start", {"name": "ose"}, path=server)["error"]["message"]
+    response = daemon.call("create", {"name": "ose", "image": "/nonexistent/x.vmdk"}, path=server)
+    assert response["error"]["code"] == daemon.INVALID_PARAMS
+    assert fake.state["vms"] == {}
+
+
+def test_daemon_internal_error(fake, image, monkeypatch):
+    """A TypeError of an operation is an internal error, not an invalid param"""
+    def create_vd(vd):
+        raise TypeError("bug")
+    monkeypatch.setattr(daemon, "create_vd", create_vd)
+    response = daemon.Daemon().handle({"id": 1, "method": "create", "params": {"name": "ose", "image": image}})
+    assert response["error"]["code"] == daemon.INTERNAL_ERROR
+
+
+def test_daemon_no_response(fake, image, tmp_path, monkeypatch):
+    """A request which is sent is not run again locally if the daemon does not respond"""
+    path = str(tmp_path / "d.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def close():
+        for i in range(2):
+            conn, addr = listener.accept()
+            conn.recv(4096)
+            conn.close()
+    thread = threading.Thread(target=close, daemon=True)
+    thread.start()
+    vd = WebosEmulator("ose", "ose")
+    vd.image = image
+    assert webos_emulator.create_vd(vd)
+    assert daemon.call("start", {"name": "ose"}, path=path)["error"]["code"] == daemon.NO_RESPONSE
+
+    call = daemon.call
+    monkeypatch.setattr(daemon, "call", lambda method, params=None, **kwargs: call(method, params, path=path))
+    monkeypatch.setattr(sys, "argv", ["webos-emulator", "-s", "-vd", "ose"])
+    assert cli.main() == 1
+    assert fake.count("startvm") == 0
+    thread.join()
+    listener.close()
+
+
+def test_daemon_not_running(tmp_path):
+    """The client returns None without a daemon"""
+    assert daemon.call("ping", path=str(tmp_path / "none.sock")) is None
+
+
+def test_cli_daemon_failure(fake, monkeypatch):
+    """A failed start by the daemon is a failure of the command"""
+    monkeypatch.setattr(daemon, "call", lambda method, params=None, **kwargs: {"result": False, "output": ""})
+    monkeypatch.setattr(sys, "argv", ["webos-emulator", "-s", "-vd", "ose"])
+    assert cli.main() == 1
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the image registry of `webos-emulator`."""
+
+import hashlib
+import os
+import shutil
+
+from webos_emulator import WebosEmulator, images
+from webos_emulator.webos_emulator import create_vd
+
+
+def test_hash_file(tmp_path, monkeypatch):
+    """The mapped file is hashed in chunks like hashlib over the whole content"""
+    monkeypatch.setattr(images, "HASH_CHUNK", 1000)
+    data = os.urandom(4500)
+    path = tmp_path / "webos-image.vmdk"
+    path.write_bytes(data)
+    assert images.hash_file(str(path)) == hashlib.sha256(data).hexdigest()
+
+
+def test_digest_cache(fake, tmp_path, monkeypatch):
+    """A file is hashed again only if it changed, and is referred to by digest or tag"""
+    path = tmp_path / "webos-image.vmdk"
+    path.write_bytes(b"webos")
+    hashed = []
+    hash_file = images.hash_file
+    monkeypatch.setattr(images, "hash_file", lambda p: hashed.append(p) or hash_file(p))
+    digest = images.get_digest(str(path), "ose-2.24")
+    assert images.get_digest(str(path)) == digest and len(hashed) == 1
+    assert images.resolve_image("ose-2.24") == str(path)
+    assert images.resolve_image("sha256:" + digest[:12]) == str(path)
+    assert images.resolve_image(digest[:4]) is None
+
+    path.write_bytes(b"webos os")
+    os.utime(str(path), ns=(0, 0))
+    assert images.resolve_image("ose-2.24") is None  # the tagged content changed
+    assert images.get_digest(str(path)) != digest and len(hashed) == 2
+
+
+def test_create_vd_copied_image(fake, image, tmp_path):
+    """A copy of a registered image is found before the vd is created"""
+    vd = WebosEmulator("ose", "ose")
+    vd.image = image
+    assert create_vd(vd)
+    copy = str(tmp_path / "copy.vmdk")
+    shutil.copyfile(image, copy)
+    vd = WebosEmulator("ose2", "ose2")
+    vd.image = copy
+    assert not create_vd(vd)
+    assert fake.count("createvm") == 1
+
+
+def test_store_prune(fake, tmp_path):
+    """The least recently used images which are not attached are evicted over the budget"""
+    paths = []
+    for i in range(3):
+        path = tmp_path / ("nightly-%d.vmdk" % i)
+        path.write_bytes(b"%d" % i * 100)
+        paths.append(images.add_image(str(path), "nightly-%d" % i))
+    assert all(os.path.dirname(i) == images.get_store_dir() for i in paths)
+    vd = WebosEmulator("ose", "ose")
+    vd.image = "nightly-0"  # the oldest one is attached
+    assert create_vd(vd) and vd.image == paths[0]
+    images.resolve_image("nightly-1")
+
+    images.set_budget(250)
+    assert images.prune() == [paths[2]]
+    assert images.resolve_image("nightly-2") == str(tmp_path / "nightly-2.vmdk")  # the file which was added
+    assert images.prune(0) == [paths[1]]  # nightly-0 is in use
+    assert os.path.isfile(paths[0])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the warm pool of `webos-emulator`."""
+
+import pytest
+
+from webos_emulator import aio, cli, pool
+
+
+@pytest.fixture
+def ready(monkeypatch):
+    """Every vd is ready right after the start"""
+    async def wait_ready_async(port, timeout, **kwargs):
+        return 0.1
+    monkeypatch.setattr(aio, "wait_ready_async", wait_ready_async)
+
+
+def test_pool(fake, image, ready):
+    """Booted vds are checked out and restored to the booted snapshot on return"""
+    assert pool.fill(image, 2) == ["webos-pool-1", "webos-pool-2"]
+    assert fake.vm("webos-pool-1")["snapshots"] == [{"name": "ready", "live": True}]
+    assert pool.fill(image, 2) == []
+
+    vd = pool.checkout()
+    assert vd["name"] == "webos-pool-1" and "ssh" in vd["ports"]
+    assert pool.checkout()["name"] == "webos-pool-2"
+    assert pool.checkout() is None
+    assert cli.pool_main(["fill", "-i", image]) == 0
+
+    startvm = fake.count("startvm")
+    assert pool.give_back("webos-pool-1")
+    assert fake.count("startvm") == startvm + 1
+    assert fake.vm("webos-pool-1")["state"] == "running"
+    assert pool.status("webos-pool")["members"] == {"webos-pool-1": "free", "webos-pool-2": "busy"}
+
+    assert sorted(pool.drain()) == ["webos-pool-1", "webos-pool-2"]
+    assert fake.state["vms"] == {} and pool.status("webos-pool") is None
+
+
+def test_repair_unbooted(fake, image, monkeypatch):
+    """A member which failed its first boot has no booted snapshot, repair creates it again"""
+    results = [None, 0.1]
+
+    async def wait_ready_async(port, timeout, **kwargs):
+        return results.pop(0) if results else 0.1
+    monkeypatch.setattr(aio, "wait_ready_async", wait_ready_async)
+    pool.fill(image, 1, settings={"ram": "2048"})
+    assert pool.status("webos-pool")["members"] == {"webos-pool-1": "broken"}
+    assert fake.vm("webos-pool-1")["snapshots"] == []
+
+    assert pool.repair() == ["webos-pool-1"]
+    assert fake.count("createvm") == 2
+    assert fake.vm("webos-pool-1")["snapshots"] == [{"name": "ready", "live": True}]
+    assert fake.vm("webos-pool-1")["memory"] == "2048"
+    assert pool.status("webos-pool")["members"] == {"webos-pool-1": "free"}
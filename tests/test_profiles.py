@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the settings profiles."""
+
+import json
+import os
+import sys
+
+from webos_emulator import cli, webos_emulator
+from webos_emulator.profiles import CONFIG_FILE, auto_profile, get_config_dir
+from webos_emulator.webos_emulator import get_settings
+
+
+def write_config(config):
+    os.makedirs(get_config_dir(), exist_ok=True)
+    with open(os.path.join(get_config_dir(), CONFIG_FILE), "w") as f:
+        json.dump(config, f)
+
+
+def test_user_config(fake):
+    """The user config is layered over the packaged settings and profiles"""
+    write_config({"ram": "3072", "profile": "dev", "profiles": {"dev": {"cpus": "3"}, "mine": {"vram": "64"}}})
+    assert get_settings() == {"ram": "4096", "cpus": "3", "vram": "128", "frontend": "gui"}
+    assert get_settings("mine") == {"ram": "3072", "cpus": "2", "vram": "64", "frontend": "gui"}
+    assert get_settings("ci-small")["frontend"] == "headless"
+    assert get_settings("missing") is None
+
+
+def test_auto_profile(capsys):
+    """The host is shared by the planned emulators and kept for itself"""
+    assert auto_profile(1, (16, 65536)) == {"cpus": "4", "ram": "4096"}
+    assert auto_profile(4, (9, 16384)) == {"cpus": "2", "ram": "3584"}
+    assert capsys.readouterr().out == ""
+    assert auto_profile(8, (4, 8192)) == {"cpus": "1", "ram": "1024"}
+    assert "overcommit" in capsys.readouterr().out
+
+
+def test_cli_create_profile(fake, image, monkeypatch):
+    """-p applies the cpus and the ram of the profile to the created vd"""
+    monkeypatch.setattr(sys, "argv", ["webos-emulator", "-c", "-vd", "ose", "-i", image, "-p", "ci-small"])
+    assert cli.main() == 0
+    vm = fake.vm("ose")
+    assert (vm["cpus"], vm["memory"], vm["vram"], vm["monitorcount"]) == ("1", "2048", "64", "1")
+
+
+def test_bad_profiles(fake, capsys, monkeypatch):
+    """A profile which is not a dict is not loaded"""
+    write_config({"profiles": {"small": "cpus=3", "mine": {"vram": "64"}}})
+    assert get_settings("mine")["vram"] == "64"
+    assert get_settings("small") is None
+    assert "profile small of config.json is not loaded" in capsys.readouterr().out
+    write_config({"profiles": ["mine"]})
+    monkeypatch.setattr(webos_emulator, "_vd_json", None)
+    assert get_settings("mine") is None
+    assert "profiles of config.json are not loaded" in capsys.readouterr().out
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the boot readiness of `webos-emulator`."""
+
+import asyncio
+
+from webos_emulator import ready
+
+
+async def serve_banner(banner, delay):
+    """Start a server which sends the banner after delay seconds"""
+    async def handle(reader, writer):
+        await asyncio.sleep(delay)
+        writer.write(banner)
+        await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_wait_ready():
+    """The waiter returns when the SSH banner is read"""
+    async def run():
+        server, port = await serve_banner(b"SSH-2.0-dropbear\r\n", 0.1)
+        try:
+            return await ready.wait_ready_async(port, timeout=5)
+        finally:
+            server.close()
+    elapsed = ready.run_coroutine(run())
+    assert elapsed is not None and elapsed >= 0.1
+
+
+def test_wait_ready_timeout(monkeypatch):
+    """A forwarded port without the guest ssh server is not ready"""
+    monkeypatch.setattr(ready, "PROBE_INTERVAL", 0.05)
+    async def run():
+        server, port = await serve_banner(b"", 0)
+        try:
+            return await ready.wait_ready_async(port, timeout=0.3)
+        finally:
+            server.close()
+    assert ready.run_coroutine(run()) is None
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the command runner of `webos-emulator`."""
+
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+from webos_emulator import runner
+
+
+def test_run_records(tmp_path):
+    """Every invocation is recorded and written as trace events"""
+    runner.clear_records()
+    ret, out, err = runner.run([sys.executable, "-c", "print('x' * 9)"], stdout=subprocess.PIPE)
+    assert ret == 0 and out.strip() == b"x" * 9 and err is None
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.check_call([sys.executable, "-c", "import sys; sys.exit(3)"])
+    records = runner.get_records()
+    assert [r.returncode for r in records] == [0, 3]
+    assert records[0].stdout_size == 10 and records[0].stderr_size is None
+
+    trace = tmp_path / "trace.json"
+    runner.write_profile(str(trace))
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [e["ph"] for e in events] == ["X", "X"]
+    assert events[1]["args"]["returncode"] == 3
+    assert events[0]["ts"] <= events[1]["ts"]
+    runner.clear_records()
+
+
+def test_profile_background_shell(monkeypatch):
+    """A shell command which leaves a background process is not waited for with --profile"""
+    monkeypatch.setattr(runner, "_profiling", True)
+    started = time.monotonic()
+    command = "%s -c 'import time; time.sleep(5)' &" % sys.executable
+    assert runner.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True) == 0
+    assert time.monotonic() - started < 4
+    runner.clear_records()
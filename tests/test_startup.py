@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Startup benchmark for `webos-emulator` package.
+
+Importing the package and printing the version must not spawn any
+process, VBoxManage is resolved on the first real use. The asyncio API
+and the daemon are not imported either.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+STARTUP = """
+import json, subprocess, sys, time
+spawned = []
+class Popen(subprocess.Popen):
+    def __init__(self, args, *a, **kw):
+        spawned.append(args)
+        super().__init__(args, *a, **kw)
+subprocess.Popen = Popen
+started = time.perf_counter()
+import webos_emulator.cli
+imported = time.perf_counter()
+sys.argv = ["webos-emulator"] + sys.argv[1:]
+if len(sys.argv) > 1:
+    try:
+        webos_emulator.cli.main()
+    except SystemExit:
+        pass
+finished = time.perf_counter()
+print(json.dumps({"spawned": [str(i) for i in spawned], "modules": sorted(sys.modules),
+                  "import": imported - started, "run": finished - imported}))
+"""
+
+
+def run_startup(*args):
+    """Run webos-emulator in a new interpreter and return the measurement"""
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(here))
+    out = subprocess.check_output([sys.executable, "-c", STARTUP] + list(args), env=env)
+    return json.loads(out.decode().strip().split("\n")[-1])
+
+
+@pytest.mark.parametrize("args", [[], ["--version"], ["--help"]])
+def test_startup_spawns_no_process(args):
+    """Import, --version and --help do not run VBoxManage"""
+    result = run_startup(*args)
+    print("startup %s : import %.1f ms, run %.1f ms" % (
+        " ".join(args) or "import", result["import"] * 1000, result["run"] * 1000))
+    assert result["spawned"] == []
+    assert not {"asyncio", "webos_emulator.aio", "webos_emulator.daemon"} & set(result["modules"])
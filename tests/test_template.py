@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the golden templates of `webos-emulator`."""
+
+import hashlib
+import io
+import os
+import tarfile
+import threading
+
+from webos_emulator import WebosEmulator
+from webos_emulator.check import TEMPLATE_PREFIX
+from webos_emulator.ports import RegistryLock
+from webos_emulator.template import OVA_LOCK, OVA_PREFIX, create_from_ova, create_from_template, inspect_ova
+
+OVF = b"""<?xml version="1.0"?>
+<Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/1" xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/1">
+  <References><File ovf:id="file1" ovf:href="webos-disk1.vmdk"/></References>
+</Envelope>
+"""
+
+
+def make_ova(path, disk=b"disk", ovf_digest=None):
+    """Write an ova with a manifest of the OVF descriptor and the disk"""
+    manifest = ("SHA256(webos.ovf)= %s\nSHA256(webos-disk1.vmdk)= %s\n"
+                % (ovf_digest or hashlib.sha256(OVF).hexdigest(), hashlib.sha256(disk).hexdigest())).encode()
+    with tarfile.open(path, "w") as tar:
+        for name, data in (("webos.ovf", OVF), ("webos.mf", manifest), ("webos-disk1.vmdk", disk)):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def templates(fake):
+    return [vm["name"] for vm in fake.state["vms"].values() if vm["name"].startswith(TEMPLATE_PREFIX)]
+
+
+def test_template_settings(fake, image):
+    """An image has one template, the settings of a vd are applied to its clones"""
+    vd = WebosEmulator("ose", "ose")
+    vd.image = image
+    assert create_from_template(vd) == ["ose"]
+    vd.ram = "2048"
+    assert create_from_template(vd, ["ose2"]) == ["ose2"]
+    assert len(templates(fake)) == 1
+    assert fake.vm("ose")["memory"] == "4096" and fake.vm("ose2")["memory"] == "2048"
+
+    # a changed image replaces the template
+    st = os.stat(image)
+    os.utime(image, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert create_from_template(vd, ["ose3"]) == ["ose3"]
+    assert len(templates(fake)) == 1 and fake.count("createvm") == 2
+
+
+def test_create_from_ova(fake, tmp_path):
+    """An ova is imported once, the next vds are linked clones of its template"""
+    ova = make_ova(str(tmp_path / "webos.ova"))
+    assert inspect_ova(ova)["files"] == ["webos-disk1.vmdk"]
+    assert create_from_ova(WebosEmulator("ose", "ose"), ova)
+    assert create_from_ova(WebosEmulator("ose2", "ose2"), ova)
+    assert fake.count("import") == 1 and fake.count("clonevm") == 2
+    assert fake.vm("ose2")["controllers"][0][0] == "ose2"
+    assert [vm["name"] for vm in fake.state["vms"].values() if vm["name"].startswith(OVA_PREFIX)]
+    # another disk is another template
+    assert create_from_ova(WebosEmulator("ose3", "ose3"), make_ova(str(tmp_path / "new.ova"), b"new disk"))
+    assert fake.count("import") == 2
+
+
+def test_create_from_ova_image(fake, tmp_path, image):
+    """The image given with -i replaces the disk of the clone, which is deleted"""
+    ova = make_ova(str(tmp_path / "webos.ova"))
+    vd = WebosEmulator("ose", "ose")
+    vd.image = image
+    assert create_from_ova(vd, ova)
+    assert list(fake.vm("ose")["attachments"].values()) == [os.path.abspath(image)]
+    assert not [path for path in fake.state["media"] if path.startswith("/fake/ose/")]
+
+
+def test_ova_manifest_mismatch(fake, tmp_path):
+    """An ova whose OVF descriptor does not match the manifest is not imported"""
+    ova = make_ova(str(tmp_path / "webos.ova"), ovf_digest="00" * 32)
+    assert not create_from_ova(WebosEmulator("ose", "ose"), ova)
+    assert fake.count("import") == 0
+
+
+def test_ova_lock_keeps_ports(fake):
+    """An ova import holding its lock does not block the ports registry"""
+    def take_ports():
+        with RegistryLock():
+            pass
+    with RegistryLock(OVA_LOCK):
+        thread = threading.Thread(target=take_ports)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Tests for the raw image conversion of `webos-emulator`."""
+
+import lzma
+import os
+import struct
+
+import pytest
+
+from webos_emulator import vmdk
+
+
+def read_sparse(path):
+    """Read the raw disk of a monolithicSparse vmdk"""
+    with open(path, "rb") as f:
+        data = f.read()
+    (magic, version, flags, capacity, grain, desc_offset, desc_size, gtes_per_gt,
+     rgd, gd, overhead, unclean, newlines, compress) = vmdk.SPARSE_HEADER.unpack_from(data)
+    assert magic == vmdk.SPARSE_MAGIC and newlines == b"\n \r\n" and compress == 0
+    descriptor = data[desc_offset * 512:(desc_offset + desc_size) * 512].rstrip(b"\0").decode()
+    assert 'RW %d SPARSE "%s"' % (capacity, os.path.basename(path)) in descriptor
+    grains = -(-capacity // grain)
+    tables = struct.unpack_from("<%dI" % -(-grains // gtes_per_gt), data, gd * 512)
+    raw = b""
+    for i in range(grains):
+        sector = struct.unpack_from("<I", data, tables[i // gtes_per_gt] * 512 + i % gtes_per_gt * 4)[0]
+        raw += data[sector * 512:(sector + grain) * 512] if sector else bytes(grain * 512)
+    return raw[:capacity * 512], data
+
+
+@pytest.mark.parametrize("suffix", ["", ".xz"])
+def test_convert(tmp_path, suffix):
+    """Zero grains are skipped and the raw disk is read back from the vmdk"""
+    raw = os.urandom(vmdk.GRAIN) + bytes(40 * vmdk.GRAIN) + os.urandom(3 * 512)
+    source = str(tmp_path / ("webos-image.wic" + suffix))
+    with (lzma.open if suffix else open)(source, "wb") as f:
+        f.write(raw)
+    output = str(tmp_path / vmdk.get_output_name(source))
+    assert output.endswith("webos-image.wic.vmdk")
+    progress = vmdk.convert(source, output)
+    assert progress.read == len(raw) and progress.written == 2 * vmdk.GRAIN
+    disk, data = read_sparse(output)
+    assert disk == raw
+    assert len(data) < 4 * vmdk.GRAIN  # the zero grains take no space
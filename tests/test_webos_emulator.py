@@ -1,29 +1,207 @@
 #!/usr/bin/env python
 
 """
-  Copyright (c) 2022 LG Electronics Inc.
+  Copyright (c) 2022-2024 LG Electronics Inc.
   SPDX-License-Identifier: MIT
 """
 
 """Tests for `webos-emulator` package."""
 
-import pytest
+import os
+import sys
+from unittest.mock import ANY
 
+from webos_emulator import WebosEmulator, cli, ports
+from webos_emulator.check import TEMPLATE_PREFIX, validate_vd_name
+from webos_emulator.plan import CommandPlan
+from webos_emulator.ports import get_ports
+from webos_emulator.template import create_from_template
+from webos_emulator.webos_emulator import create_vd, custom_vd, default_vd, delete_vd, get_vd_json, modify_vd, start_vd, stop_vd
 
-from webos_emulator import webos_emulator
 
+def make_vd(name, image=None):
+    vd = WebosEmulator(name, name)
+    vd.image = image
+    return vd
 
-@pytest.fixture
-def response():
-    """Sample pytest fixture.
 
-    See more at: http://doc.pytest.org/en/latest/fixture.html
-    """
-    # import requests
-    # return requests.get('https://github.com/audreyr/cookiecutter-pypackage')
+def test_create_vd(fake, image):
+    """A vd is created with the settings, image and port forwards"""
+    assert create_vd(make_vd("ose", image))
+    vm = fake.vm("ose")
+    assert vm["memory"] == "4096" and vm["cpus"] == "2"
+    assert list(vm["attachments"].values()) == [os.path.abspath(image)]
+    assert [r.split(",")[0] for r in vm["natrules"]] == ["ssh", "web-inspector", "enact-browser-web-inspector"]
+    assert get_ports("ose")["ssh"] == int(vm["natrules"][0].split(",")[3])
+    assert fake.count("modifyvm") == 1
 
 
-def test_content(response):
-    """Sample pytest test function with the pytest fixture as an argument."""
-    # from bs4 import BeautifulSoup
-    # assert 'GitHub' in BeautifulSoup(response.content).title.string
+def test_create_vd_unregistered_ports(fake, image, monkeypatch):
+    """The rules of vds out of the ports registry are used, the ones of the templates are not"""
+    monkeypatch.setattr(ports, "is_port_free", lambda port: True)
+    for name, rule in (("old", "ssh,tcp,,6622,,22"), (TEMPLATE_PREFIX + "x", "web-inspector,tcp,,9998,,9998")):
+        fake.execute(["createvm", "--name", name, "--register"])
+        fake.execute(["modifyvm", name, "--natpf1", rule])
+    assert create_vd(make_vd("ose", image))
+    assert get_ports("ose")["ssh"] == 6623
+    assert get_ports("ose")["web-inspector"] == 9998
+
+
+def test_create_vd_attached_image(fake, image):
+    """A vd with an image attached to another vd is not created"""
+    assert create_vd(make_vd("ose", image))
+    assert not create_vd(make_vd("ose2", image))
+    assert fake.count("createvm") == 1
+    assert [vm["name"] for vm in fake.state["vms"].values()] == ["ose"]
+    assert get_ports("ose2") is None
+
+
+def test_create_vd_failure(fake, image):
+    """A VBoxManage error fails the creation"""
+    fake.fail("createvm")
+    assert not create_vd(make_vd("ose", image))
+    assert fake.state["vms"] == {}
+
+
+def test_modify_vd(fake, image, capsys):
+    """Settings are changed by one modifyvm call and shown"""
+    create_vd(make_vd("ose", image))
+    modifyvm = fake.count("modifyvm")
+    showvminfo = fake.count("showvminfo")
+    assert modify_vd(make_vd("ose"), "--memory:2048:--cpus:4:", None, "")
+    assert fake.count("modifyvm") == modifyvm + 1
+    assert fake.count("showvminfo") <= showvminfo + 1
+    assert fake.vm("ose")["memory"] == "2048" and fake.vm("ose")["cpus"] == "4"
+    assert "2048" in capsys.readouterr().out
+
+    start_vd(make_vd("ose"))
+    assert not modify_vd(make_vd("ose"), "--memory:1024:", None, "")
+    assert fake.vm("ose")["memory"] == "2048"
+
+
+def test_default_vd_no_changes(fake, image, capsys):
+    """-ds only changes the settings which differ, a second -ds changes nothing"""
+    create_vd(make_vd("ose", image))
+    fake.vm("ose")["natrules"][0] = "ssh,tcp,,2222,,22"
+    fake.vm("ose")["memory"] = "1024"
+    fake.vm("ose")["options"]["nic1"] = "bridged"
+    assert default_vd(make_vd("ose"))
+    out = capsys.readouterr().out
+    assert "NAT rule ssh" in out and "NAT rule web-inspector" not in out
+    assert "nic1" in out and "ioapic" not in out
+    assert fake.vm("ose")["memory"] == "4096" and fake.vm("ose")["options"]["nic1"] == "nat"
+    assert fake.vm("ose")["natrules"][-1].split(",")[3] == str(get_ports("ose")["ssh"])
+
+    calls = len(fake.calls)
+    assert default_vd(make_vd("ose"))
+    assert "no changes" in capsys.readouterr().out
+    assert not [args for args in fake.calls[calls:] if args[0] in ("modifyvm", "setextradata")]
+
+
+def test_delete_vd_keeps_image(fake, image):
+    """The image of the user is kept also in the vd folder, the disk of a linked clone is deleted"""
+    create_vd(make_vd("ose", image))
+    fake.vm("ose")["config"] = os.path.join(os.path.dirname(image), "ose.vbox")
+    delete_vd(make_vd("ose"))
+    assert fake.state["vms"] == {} and os.path.abspath(image) in fake.state["media"]
+
+    assert create_from_template(make_vd("ose", image)) == ["ose"]
+    clone_disk = list(fake.vm("ose")["attachments"].values())[0]
+    delete_vd(make_vd("ose"))
+    assert clone_disk not in fake.state["media"] and os.path.abspath(image) in fake.state["media"]
+
+
+def test_custom_vd(fake, tmp_path):
+    """A vd is imported from an ova and its storage controller is renamed"""
+    ova = str(tmp_path / "webos.ova")
+    assert custom_vd(make_vd("ose"), ova)
+    assert fake.vm("ose")["controllers"][0][0] == "ose"
+    assert not custom_vd(make_vd("ose"), ova)
+
+
+def test_validate_vd_name(fake, image, capsys):
+    """vds are found by name or uuid and listed with the running state"""
+    create_vd(make_vd("ose", image))
+    uuid = fake.vm("ose")["uuid"]
+    assert validate_vd_name("ose", False) == ("ose", uuid, "ose", "")
+    assert validate_vd_name(uuid, False)[0] == "ose"
+    assert validate_vd_name("none", False)[0] == ""
+
+    start_vd(make_vd("ose"))
+    validate_vd_name("__list_images__", True)
+    assert capsys.readouterr().out.splitlines()[-1] == "ose (running)"
+
+
+def run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["webos-emulator"] + list(args))
+    return cli.main()
+
+
+def test_cli_lifecycle(fake, image, monkeypatch, capsys):
+    """create, list, start, kill and delete by the command line"""
+    assert run_cli(monkeypatch, "-c", "-vd", "ose", "-i", image) == 0
+    assert run_cli(monkeypatch, "-l") == 0
+    assert capsys.readouterr().out.splitlines()[-1] == "ose"
+    assert run_cli(monkeypatch, "-s", "-vd", "ose") == 0
+    assert fake.vm("ose")["state"] == "running"
+    assert run_cli(monkeypatch, "-k", "-vd", "ose") == 0
+    assert fake.vm("ose")["state"] == "poweroff"
+    assert run_cli(monkeypatch, "-d", "-vd", "ose") == 0
+    assert fake.state["vms"] == {}
+    # the image given by the user is detached before the vd is deleted
+    assert fake.state["media"][os.path.abspath(image)]["type"] == "normal"
+
+
+def test_cli_kill_all(fake, image, monkeypatch):
+    """-k --all stops every running emulator, -k --acpi shuts them down"""
+    assert run_cli(monkeypatch, "-c", "-vd", "ose", "--count", "3", "-i", image) == 0
+    assert run_cli(monkeypatch, "-s", "-vd", "ose-1") == 0
+    assert run_cli(monkeypatch, "-s", "-vd", "ose-2") == 0
+    assert run_cli(monkeypatch, "-k", "-vd", "ose-1,ose-2", "--acpi", "5") == 0
+    assert fake.calls.count(["controlvm", ANY, "acpipowerbutton"]) == 2 and fake.count("controlvm") == 2
+    assert run_cli(monkeypatch, "-s", "-vd", "ose-3") == 0
+    assert run_cli(monkeypatch, "-k", "--all") == 0
+    assert fake.vm("ose-3")["state"] == "poweroff"
+    assert run_cli(monkeypatch, "-k", "--all") == 0
+
+
+def test_cli_start_headless(fake, image, monkeypatch):
+    """-s --headless starts without the gui, also of many emulators concurrently"""
+    assert run_cli(monkeypatch, "-c", "-vd", "ose", "--count", "3", "-i", image) == 0
+    assert run_cli(monkeypatch, "-s", "-vd", "ose-1") == 0
+    assert fake.vm("ose-1")["frontend"] == "gui"
+    assert run_cli(monkeypatch, "-s", "-vd", "ose-2,ose-3", "--headless") == 0
+    assert fake.vm("ose-2")["frontend"] == fake.vm("ose-3")["frontend"] == "headless"
+    assert run_cli(monkeypatch, "-k", "--all") == 0
+    # the default frontend of webos-emulator.json
+    monkeypatch.setitem(get_vd_json(), "frontend", "separate")
+    assert run_cli(monkeypatch, "-s", "--all") == 0
+    assert all(fake.vm("ose-%d" % i)["frontend"] == "separate" for i in range(1, 4))
+
+
+def test_cli_unknown_vd(fake, monkeypatch, capsys):
+    """A missing vd is reported"""
+    assert run_cli(monkeypatch, "-s", "-vd", "none") == 1
+    assert "webos-emulator -l" in capsys.readouterr().out
+
+
+def test_suspend_resume(fake, image, capsys):
+    """A vd stopped by savestate is resumed by the next start"""
+    create_vd(make_vd("ose", image))
+    start_vd(make_vd("ose"))
+    assert stop_vd(make_vd("ose"), suspend=True)
+    assert fake.vm("ose")["state"] == "saved"
+    assert fake.count("controlvm") == 1
+    assert not modify_vd(make_vd("ose"), "--memory:1024:", None, "")
+    assert start_vd(make_vd("ose"))
+    assert fake.vm("ose")["state"] == "running"
+    out = capsys.readouterr().out
+    assert "ose is saved in" in out and "ose is resumed from the saved state in" in out
+
+
+def test_plan_show_without_vboxmanage(capsys):
+    """--dry-run prints the plan even if VBoxManage is not installed"""
+    plan = CommandPlan("ose")
+    plan.modifyvm("--memory", "2048")
+    plan.show(None)
+    assert capsys.readouterr().out == "VBoxManage modifyvm ose --memory 2048\n"
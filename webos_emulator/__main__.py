@@ -32,10 +32,13 @@ class WebosEmulator:
         self._ram: Optional[str] = '4096'  # vd RAM, MBs
         self._vram: Optional[str] = '128'  # vd video RAM, MBs
         self._hostssh: Optional[str] = '6622' # host to emulator ssh port number
+        self._hostinspector: Optional[str] = '9998' # host to emulator web inspector port number
+        self._hostenactinspector: Optional[str] = '9223' # host to emulator enact browser web inspector port number
         self._image: Optional[str] = None # image name if exists
         self._monitorcount: Optional[str] = '2'  # number of monitors
         self._scalefactor: Optional[str] = '0.7'  # number of scale factor
         self._vmdkfile: Optional[str] = ''  # vmdkfile
+        self._frontend: Optional[str] = None  # startvm type, gui, headless or separate
         
     @property
     def name(self):
@@ -71,6 +74,16 @@ class WebosEmulator:
     def hostssh(self):
         """Return emulator ssh port number"""
         return self._hostssh
+
+    @property
+    def hostinspector(self):
+        """Return emulator web inspector port number"""
+        return self._hostinspector
+
+    @property
+    def hostenactinspector(self):
+        """Return emulator enact browser web inspector port number"""
+        return self._hostenactinspector
     
     @property
     def image(self):
@@ -96,17 +109,52 @@ class WebosEmulator:
     def version(self):
         """Return webOS emulator version """
         return self._version
+
+    @property
+    def frontend(self):
+        """Return webOS emulator frontend, None for the default of webos-emulator.json """
+        return self._frontend
     
+    @name.setter
+    def name(self, value):
+        """Sets the name"""
+        self._name = value
+
+    @hostssh.setter
+    def hostssh(self, value):
+        """Sets the ssh port number"""
+        self._hostssh = value
+
+    @hostinspector.setter
+    def hostinspector(self, value):
+        """Sets the web inspector port number"""
+        self._hostinspector = value
+
+    @hostenactinspector.setter
+    def hostenactinspector(self, value):
+        """Sets the enact browser web inspector port number"""
+        self._hostenactinspector = value
+
     @image.setter
     def image(self, value):
         """Sets the image"""
         self._image = value
 
+    @cpus.setter
+    def cpus(self, value):
+        """Sets the number of CPUs"""
+        self._cpus = value
+
     @ram.setter
     def ram(self, value):
         """Sets the ram"""
         self._ram = value
 
+    @vram.setter
+    def vram(self, value):
+        """Sets the video ram"""
+        self._vram = value
+
     @product.setter
     def product(self, value):
         """Sets the product"""
@@ -132,6 +180,11 @@ class WebosEmulator:
         """Sets the version"""
         self._version = value
 
+    @frontend.setter
+    def frontend(self, value):
+        """Sets the frontend"""
+        self._frontend = value
+
     def create(self):
         """Create a webOS emulator
             
@@ -0,0 +1,397 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Asyncio API to manage many vds concurrently.
+
+AsyncEmulatorManager runs the same VBoxManage commands as create_vd,
+start_vd, stop_vd and delete_vd as asyncio subprocesses, so tens of vds
+are brought up or torn down in parallel without a thread per vd:
+
+    manager = AsyncEmulatorManager(concurrency=8)
+    vds = [WebosEmulator("ose-%d" % i, "ose-%d" % i) for i in range(20)]
+    for vd in vds:
+        vd.image = "webos-image.vmdk"
+    await manager.share("webos-image.vmdk")  # see create_fleet()
+    await manager.map(manager.create, vds)
+    await manager.map(manager.start, vds, wait_ready=180)
+    await manager.map(manager.stop, vds)
+
+At most 'concurrency' VBoxManage processes run at once, and operations
+on the same vd are serialized. A cancelled operation kills its running
+VBoxManage process.
+
+start_vds() and stop_vds() start and stop many vds concurrently for the
+CLI, e.g. headless on a build agent.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from subprocess import DEVNULL, PIPE
+
+from webos_emulator import WebosEmulator, runner
+from webos_emulator.check import (LINUX_GUEST_OS, get_stderr, get_vboxm, get_xml_inventory, hostos_encoding,
+                                  invalidate_inventory, parse_vm_list, set_inventory)
+from webos_emulator.images import has_parent
+from webos_emulator.ports import assign_ports, get_ports, release_ports
+from webos_emulator.ready import run_coroutine, wait_ready_async
+from webos_emulator.vminfo import parse_machinereadable
+from webos_emulator.webos_emulator import ACPI_TIMEOUT, create_plan, startvm_args
+
+DEFAULT_CONCURRENCY = 8
+SHUTDOWN_POLL_INTERVAL = 0.5  # seconds between the state queries of a shutting down vd
+
+class AsyncEmulatorManager:
+    """Coroutines of the vd operations with bounded concurrency"""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        """Construct a :class:`AsyncEmulatorManager <AsyncEmulatorManager>`.
+
+        :param int concurrency:
+            The maximum number of VBoxManage processes at once.
+        """
+        self.concurrency = concurrency
+        self._semaphore = None  # made in the running loop, see _vbox()
+        self._locks = {}
+        self._vms = None  # inventory kept until a vd is changed, see inventory()
+        self._generation = 0  # number of the changes, see _invalidate()
+        self._listing = None  # running read of the inventory, see inventory()
+
+    def lock(self, name):
+        """Get the lock of operations on the vd"""
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    async def _vbox(self, *args, capture=False):
+        """Run VBoxManage
+
+        Returns:
+            tuple of returncode and stdout text if capture else None
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            ret, out, err = await runner.run_async([get_vboxm()] + list(args), stdout=PIPE if capture else DEVNULL,
+                                                   stderr=get_stderr())
+        if ret != 0:
+            logging.debug("VBoxManage %s error : %d" % (args[0], ret))
+        return ret, str(out, hostos_encoding) if capture else None
+
+    async def inventory(self):
+        """Get the registered vms, from VirtualBox.xml or 'list -l vms'
+
+        The inventory is read once and kept until a vd is changed by the
+        manager, concurrent callers share one read. VirtualBox.xml is read
+        in a thread, so the loop is not blocked.
+        """
+        if self._vms is not None:
+            return self._vms
+        if self._listing is None:
+            self._listing = asyncio.ensure_future(self._list())
+            self._listing.add_done_callback(self._listed)
+        return await asyncio.shield(self._listing)
+
+    async def _list(self):
+        generation = self._generation
+        vms = await asyncio.get_running_loop().run_in_executor(None, get_xml_inventory)
+        if vms is None:
+            ret, out = await self._vbox('list', '-l', 'vms', capture=True)
+            vms = parse_vm_list(out)
+        if generation == self._generation:  # not changed while reading
+            self._vms = vms
+            set_inventory(vms)  # shared with the blocking queries, e.g. of assign_ports()
+        return vms
+
+    def _listed(self, future):
+        self._listing = None
+
+    def _invalidate(self):
+        """Drop the inventory after a vd is changed"""
+        self._vms = None
+        self._generation += 1
+        invalidate_inventory()
+
+    async def find(self, name):
+        """Find the vd by name or uuid, None if it does not exist"""
+        for vm in await self.inventory():
+            if vm.name == name or vm.uuid == name:
+                return vm
+        return None
+
+    async def vminfo(self, name):
+        """Get the settings of the vd, None if it does not exist"""
+        ret, out = await self._vbox('showvminfo', name, '--machinereadable', capture=True)
+        return parse_machinereadable(out) if ret == 0 else None
+
+    async def _remove(self, name):
+        """Unregister the vd, the image given by the user is detached to keep it"""
+        vm = await self.vminfo(name)
+        if vm is None:
+            return True
+        location, uuid = vm.medium(vm.storage)
+        # the differencing disk of a linked clone or a multiattach image is deleted with the vd
+        ret, out = await self._vbox('showmediuminfo', 'disk', uuid or location, capture=True) if location else (1, "")
+        if not (ret == 0 and has_parent(out)):
+            await self._vbox('storageattach', name, '--storagectl', vm.storage or name, '--type', 'hdd',
+                             '--medium', 'emptydrive', '--port', '0', '--device', '0')
+        ret, out = await self._vbox('unregistervm', name, '--delete')
+        self._invalidate()
+        return ret == 0
+
+    async def share(self, image):
+        """Set the image to multiattach type, so vds created from it share it
+
+        Args:
+            image (str): vmdk image file
+        """
+        ret, out = await self._vbox('modifymedium', 'disk', image, '--type', 'multiattach')
+        if ret != 0:
+            print("webos-emulator : The vmdk file is attached to a vd. Please delete the vd before sharing it")
+        return ret == 0
+
+    async def create(self, vd: WebosEmulator):
+        """create a vd, see create_vd()
+
+        Args:
+            vd (WebosEmulator): vd object
+        """
+        async with self.lock(vd.name):
+            vm = await self.find(vd.name)
+            # the port registry and the inventory are read in a thread
+            await asyncio.get_running_loop().run_in_executor(None, assign_ports, vd)
+            plan = create_plan(vd)
+            if vm is not None:
+                if vm.running:
+                    print("webos-emulator : %s is running. please stop vd before create" % vd.name)
+                    return False
+                if not await self._remove(vd.name):
+                    print("webos-emulator : %s can not be removed" % vd.name)
+                    return False
+            try:
+                for args, optional in plan.commands():
+                    ret, out = await self._vbox(*args)
+                    if ret == 0 or optional:
+                        continue
+                    if args[0] == 'storageattach':
+                        print("webos-emulator : The vmdk file is already attached. Please use a new vmdk")
+                        await self._remove(vd.name)
+                        release_ports(vd.name)
+                    else:
+                        print("webos-emulator : creation error")
+                    return False
+            finally:
+                self._invalidate()
+            return True
+
+    async def start(self, vd: WebosEmulator, wait_ready=None, ready_command=None):
+        """start a vd, see start_vd()
+
+        Args:
+            vd (WebosEmulator): vd object
+            wait_ready (float): seconds to wait until the vd is ready, not waited if None
+            ready_command (str): command which must succeed in the vd
+        """
+        async with self.lock(vd.name):
+            vm = await self.find(vd.name)
+            if vm is None:
+                print("webos-emulator : vd does not exist!")
+                return False
+            started = time.monotonic()
+            if not vm.running:
+                ret, out = await self._vbox(*startvm_args(vd))
+                self._invalidate()
+                if ret != 0:
+                    print("webos-emulator : start error")
+                    return False
+        if wait_ready is None:
+            return True
+        ports = get_ports(vd.name)
+        port = ports["ssh"] if ports else vd.hostssh
+        return await wait_ready_async(int(port), wait_ready, command=ready_command, started=started) is not None
+
+    async def stop(self, vd: WebosEmulator, suspend=False):
+        """stop a vd, see stop_vd()
+
+        Args:
+            vd (WebosEmulator): vd object
+            suspend (bool): save the state instead of powering off
+        """
+        async with self.lock(vd.name):
+            vm = await self.find(vd.name)
+            if vm is None or not vm.running:
+                print("webos-emulator : vd is not running.")
+                return False
+            try:
+                if suspend:
+                    ret, out = await self._vbox('controlvm', vd.name, 'savestate')
+                else:
+                    await self._vbox('controlvm', vd.name, 'pause')
+                    ret, out = await self._vbox('controlvm', vd.name, 'poweroff')
+            finally:
+                self._invalidate()
+            if ret != 0:
+                print("webos-emulator : stop error")
+            return ret == 0
+
+    async def shutdown(self, vd: WebosEmulator, timeout=ACPI_TIMEOUT):
+        """Shut down a vd by the ACPI power button, so the guest stops cleanly
+
+        The vd is powered off if it is still running after the timeout, or
+        if it is paused and can not handle the button.
+
+        Args:
+            vd (WebosEmulator): vd object
+            timeout (float): seconds to wait for the guest to shut down
+        """
+        async with self.lock(vd.name):
+            vm = await self.find(vd.name)
+            if vm is None or not vm.running:
+                print("webos-emulator : vd is not running.")
+                return False
+            started = time.monotonic()
+            try:
+                if vm.state == "running":
+                    ret, out = await self._vbox('controlvm', vd.name, 'acpipowerbutton')
+                    while ret == 0:
+                        info = await self.vminfo(vd.name)
+                        if info is None or not info.running:
+                            print("webos-emulator : %s is shut down in %.1f seconds"
+                                  % (vd.name, time.monotonic() - started))
+                            return True
+                        remaining = timeout - (time.monotonic() - started)
+                        if remaining <= 0:
+                            break
+                        await asyncio.sleep(min(SHUTDOWN_POLL_INTERVAL, remaining))
+                    print("webos-emulator : %s is not shut down in %d seconds, power off" % (vd.name, timeout))
+                ret, out = await self._vbox('controlvm', vd.name, 'poweroff')
+            finally:
+                self._invalidate()
+            if ret != 0:
+                print("webos-emulator : stop error")
+                return False
+            print("webos-emulator : %s is powered off in %.1f seconds" % (vd.name, time.monotonic() - started))
+            return True
+
+    async def delete(self, vd: WebosEmulator):
+        """delete a vd, see delete_vd()
+
+        Args:
+            vd (WebosEmulator): vd object
+        """
+        async with self.lock(vd.name):
+            vm = await self.find(vd.name)
+            if vm is None:
+                print("webos-emulator : vd does not exist!")
+                return False
+            if vm.running:
+                print("webos-emulator : vd is running. please stop vd before delete")
+                return False
+            if not await self._remove(vd.name):
+                logging.error("webos-emulator error : delete_vd failed")
+                return False
+            release_ports(vd.name)
+            return True
+
+    async def snapshot(self, vd: WebosEmulator, name, live=True):
+        """Take a snapshot of the vd, a snapshot of a running vd has its state
+
+        Args:
+            vd (WebosEmulator): vd object
+            name (str): snapshot name
+            live (bool): do not pause the running vd while the snapshot is taken
+        """
+        async with self.lock(vd.name):
+            ret, out = await self._vbox('snapshot', vd.name, 'take', name, *(['--live'] if live else []))
+            self._invalidate()
+            return ret == 0
+
+    async def restore(self, vd: WebosEmulator, name):
+        """Restore the stopped vd to the snapshot, the next start resumes its state
+
+        Args:
+            vd (WebosEmulator): vd object
+            name (str): snapshot name
+        """
+        async with self.lock(vd.name):
+            ret, out = await self._vbox('snapshot', vd.name, 'restore', name)
+            self._invalidate()
+            return ret == 0
+
+    async def has_snapshot(self, vd: WebosEmulator, name):
+        """Check the vd has the snapshot
+
+        Args:
+            vd (WebosEmulator): vd object
+            name (str): snapshot name
+        """
+        ret, out = await self._vbox('snapshot', vd.name, 'list', '--machinereadable', capture=True)
+        return ret == 0 and any(re.match(r'SnapshotName(-\d+)*="%s"$' % re.escape(name), line)
+                                for line in out.splitlines())
+
+    async def list(self):
+        """Get the names of the vds"""
+        return [vm.name for vm in await self.inventory() if vm.ostype in LINUX_GUEST_OS]
+
+    async def map(self, operation, vds, **kwargs):
+        """Run an operation on the vds concurrently
+
+        Args:
+            operation: coroutine method, e.g. manager.start
+            vds (list): vd objects
+            kwargs: arguments of the operation
+
+        Returns:
+            list of the results, an exception is returned in place of its result
+        """
+        return await asyncio.gather(*[operation(vd, **kwargs) for vd in vds], return_exceptions=True)
+
+def start_vds(names, frontend=None, wait_ready=None, ready_command=None, concurrency=DEFAULT_CONCURRENCY):
+    """Start the vds concurrently
+
+    Args:
+        names (list): vd names
+        frontend (str): gui, headless or separate, the default of webos-emulator.json if None
+        wait_ready (float): seconds to wait until the vds are ready, not waited if None
+        ready_command (str): command which must succeed in the vds
+        concurrency (int): the maximum number of VBoxManage processes at once
+
+    Returns:
+        list of the names of the started vds
+    """
+    manager = AsyncEmulatorManager(concurrency)
+    vds = [WebosEmulator(name, name) for name in names]
+    for vd in vds:
+        vd.frontend = frontend
+    results = run_coroutine(manager.map(manager.start, vds, wait_ready=wait_ready, ready_command=ready_command))
+    for vd, result in zip(vds, results):
+        if isinstance(result, Exception):
+            logging.error("webos-emulator error : %s is not started : %s" % (vd.name, result))
+    return [vd.name for vd, result in zip(vds, results) if result is True]
+
+def stop_vds(names, suspend=False, acpi=None, concurrency=DEFAULT_CONCURRENCY):
+    """Stop the vds concurrently
+
+    Args:
+        names (list): vd names
+        suspend (bool): save the states instead of powering off
+        acpi (float): seconds to wait for the guests to shut down by the ACPI
+            power button before powering off, powered off at once if None
+        concurrency (int): the maximum number of VBoxManage processes at once
+
+    Returns:
+        list of the names of the stopped vds
+    """
+    manager = AsyncEmulatorManager(concurrency)
+    vds = [WebosEmulator(name, name) for name in names]
+    if acpi is not None and not suspend:
+        results = run_coroutine(manager.map(manager.shutdown, vds, timeout=acpi))
+    else:
+        results = run_coroutine(manager.map(manager.stop, vds, suspend=suspend))
+    for vd, result in zip(vds, results):
+        if isinstance(result, Exception):
+            logging.error("webos-emulator error : %s is not stopped : %s" % (vd.name, result))
+    return [vd.name for vd, result in zip(vds, results) if result is True]
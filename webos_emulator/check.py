@@ -4,10 +4,18 @@
 """
 
 import logging
-import subprocess
-from subprocess import DEVNULL   # TODO: check Python 3.3 above
-import re
+from subprocess import DEVNULL, PIPE   # TODO: check Python 3.3 above
 import locale
+import json
+import os, platform
+import functools
+import shutil
+import threading
+import time
+
+from webos_emulator import runner, vboxxml
+from webos_emulator.exceptions import VBoxDriverError, VBoxError, VBoxNotInstalledError
+from webos_emulator.vminfo import VmInfo, parse_extradata, parse_machinereadable
 
 # TODO: set logging level
 STDIN = DEVNULL  # quiet, None for info level
@@ -24,16 +32,414 @@ def get_stderr():
 def get_vboxmanage(command):
     """Get the full path of vboxmanage"""
     try:
-        sp = subprocess.Popen([command, '-version'], stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        version, error = sp.communicate()
+        ret, version, error = runner.run([command, '-version'], stdout=PIPE, stderr=PIPE)
     except:
         return None, None
     else:
         return command, version
 
-VBOXM, VBOXVER = get_vboxmanage("VBoxManage")
-if VBOXVER:
-    VBOXVER = str(VBOXVER, hostos_encoding).split('\n')[0]
+VBOXMANAGE_CACHE = "vboxmanage.json"
+_vboxm = None  # (backend, command, version) of VBoxManage, see get_vboxm()
+
+def find_vboxmanage():
+    """Find the full path of vboxmanage without running it"""
+    path = shutil.which("VBoxManage")
+    if path is None and 'VBOX_MSI_INSTALL_PATH' in os.environ:
+        path = shutil.which("VBoxManage", path=os.environ['VBOX_MSI_INSTALL_PATH'])
+    return path
+
+def load_vboxmanage():
+    """Resolve vboxmanage and its version
+
+    The result is kept in the user cache directory with PATH and the mtime
+    of vboxmanage, VBoxManage -version runs only when one of them changes.
+    """
+    cache = os.path.join(get_cache_dir(), VBOXMANAGE_CACHE)
+    try:
+        with open(cache, encoding='utf-8') as f:
+            data = json.load(f)
+        if data['PATH'] == os.environ.get('PATH', '') and os.stat(data['path']).st_mtime_ns == data['mtime']:
+            return data['path'], data['version']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    path = find_vboxmanage()
+    if path is None:
+        return None, None
+    command, version = get_vboxmanage(path)
+    if command is None:
+        return None, None
+    version = str(version, hostos_encoding).split('\n')[0]
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        with open(cache + ".tmp", "w", encoding='utf-8') as f:
+            json.dump({"PATH": os.environ.get('PATH', ''), "path": path,
+                       "mtime": os.stat(path).st_mtime_ns, "version": version}, f)
+        os.replace(cache + ".tmp", cache)
+    except OSError as e:
+        logging.debug("vboxmanage cache is not saved : %s" % e)
+    return command, version
+
+def get_vboxm():
+    """Get the vboxmanage command, None if it is not installed
+
+    It is resolved on the first use instead of import time.
+    """
+    global _vboxm
+    backend = runner.get_backend()
+    if _vboxm is None or _vboxm[0] is not backend:
+        _vboxm = (backend,) + (backend.resolve() or load_vboxmanage())
+    return _vboxm[1]
+
+def get_vbox_version():
+    """Get the version of vboxmanage"""
+    get_vboxm()
+    return _vboxm[2]
+
+_inventory = None  # snapshot of the registered vms, see get_inventory()
+INVENTORY_CACHE = "inventory.json"
+# "auto" reads VirtualBox.xml and .vbox files for lookups and falls back to
+# VBoxManage if they can not be read, "vboxmanage" always uses VBoxManage
+QUERY_BACKEND = os.environ.get('WEBOS_EMULATOR_QUERY', 'auto')
+
+_vminfo = {}  # VmInfo of vms for this command, see get_vminfo()
+# the daemon handles requests in threads, they share the snapshot and _vminfo
+_inventory_lock = threading.RLock()
+
+def _locked(func):
+    """Run func holding the lock of the inventory"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _inventory_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+LINUX_GUEST_OS = ("Other Linux (64-bit)", "Other Linux (32-bit)")
+TEMPLATE_PREFIX = "webos-golden-"  # golden templates are not listed
+
+def get_cache_dir():
+    """Get the user cache directory of webos-emulator"""
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'webos-emulator', 'Cache')
+    elif platform.system() == 'Darwin':
+        return os.path.expanduser('~/Library/Caches/webos-emulator')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(base, 'webos-emulator')
+
+def get_vbox_home():
+    """Get the VirtualBox settings directory which has VirtualBox.xml
+
+    Returns None if VirtualBox.xml is not found.
+    """
+    if 'VBOX_USER_HOME' in os.environ:
+        candidates = [os.environ['VBOX_USER_HOME']]
+    elif platform.system() == 'Windows':
+        candidates = [os.path.expanduser('~/.VirtualBox')]
+    elif platform.system() == 'Darwin':
+        candidates = [os.path.expanduser('~/Library/VirtualBox')]
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+        candidates = [os.path.join(base, 'VirtualBox'), os.path.expanduser('~/.VirtualBox')]
+    for i in candidates:
+        if os.path.isfile(os.path.join(i, 'VirtualBox.xml')):
+            return i
+    return None
+
+def get_inventory_key(configs):
+    """Get the cache key of the inventory
+
+    The key is made of mtime and size of VirtualBox.xml and the .vbox files,
+    VirtualBox rewrites them on registration, settings and state changes.
+
+    Args:
+        configs (list): .vbox file paths of vms
+    """
+    vbox_home = get_vbox_home()
+    if vbox_home is None:
+        return None
+    key = []
+    for i in [os.path.join(vbox_home, 'VirtualBox.xml')] + sorted(c for c in configs if c):
+        try:
+            st = os.stat(i)
+            key.append([i, st.st_mtime_ns, st.st_size])
+        except OSError:
+            key.append([i, None, None])
+    return key
+
+def load_inventory_cache():
+    """Load the inventory from the cache file if it is still valid"""
+    path = os.path.join(get_cache_dir(), INVENTORY_CACHE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        vms = [VmInfo.from_dict(vm) for vm in data['vms']]
+        key = get_inventory_key([vm.config for vm in vms])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.debug("inventory cache is not used : %s" % e)
+        return None
+    if key is None or key != data.get('key'):
+        return None
+    return vms
+
+def save_inventory_cache(vms, key):
+    """Save the inventory to the cache file
+
+    Args:
+        vms (list): inventory
+        key (list): cache key of the inventory
+    """
+    if key is None:
+        return
+    cache_dir = get_cache_dir()
+    path = os.path.join(cache_dir, INVENTORY_CACHE)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump({"key": key, "vms": [vm.to_dict() for vm in vms]}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.debug("inventory cache is not saved : %s" % e)
+
+def get_product_version(name):
+    """Get the product and version from the given vd name
+
+    Args:
+        name (string): name of vd
+    """
+    product = "ose"
+    version = ""
+    if name.startswith("LG webOS TV Emulator"):
+        product = "tv"
+        version = name.split("LG webOS TV Emulator")[1]
+        if version == "":
+            version = "1.2.0"
+        else:
+            version = version[1:]
+    elif name.startswith("LG webOS SIGNAGE Emulator"):
+        product = "signage"
+        version = name.split("LG webOS SIGNAGE Emulator ")[1]
+    return product, version
+
+def parse_vm_list(text):
+    """Parse the output of 'VBoxManage list -l vms'
+
+    Every vm block starts with a "Name:" line, blank lines can appear
+    inside of a block so they are not used as separator.
+
+    Args:
+        text (string): output of list -l vms
+    """
+    vms = []
+    vm = None
+    for line in text.split('\n'):
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        value = value.strip()
+        if key == "Name" and not value.startswith("'"):  # "Name: 'x', Host path:" is a shared folder
+            vm = VmInfo(value)
+            vms.append(vm)
+        elif vm is None:
+            continue
+        elif key == "UUID" and not vm.uuid:
+            vm.uuid = value
+        elif key == "Guest OS" and not vm.ostype:
+            vm.ostype = value
+        elif key == "Config file" and not vm.config:
+            vm.config = value
+        elif key == "State" and not vm.state:
+            state = value.split(" (since")[0].strip()
+            vm.state = "poweroff" if state == "powered off" else state.replace(" ", "")
+        elif key == "Storage Controller Name (0)" and not vm.controllers:
+            vm.controllers.append([value, ""])
+        elif key == "#0" and not vm.controllers:  # VirtualBox 7
+            vm.controllers.append([value.split(",")[0].strip()[1:-1], ""])
+        elif key.startswith("NIC 1 Rule("):
+            # name = ssh, protocol = tcp, host ip = , host port = 6622, guest ip = , guest port = 22
+            fields = dict(i.strip().partition(" = ")[::2] for i in value.split(","))
+            vm.natrules.append([fields.get(i, "") for i in
+                                ("name", "protocol", "host ip", "host port", "guest ip", "guest port")])
+    return [vm for vm in vms if vm.name != "<inaccessible!>"]
+
+def get_running_vms():
+    """Get the names and uuids of the running vms"""
+    running = vboxxml.get_running_vms()
+    if running is not None:
+        return running
+    command = [get_vboxm()] + ['list', 'runningvms']
+    try:
+        ret, result, error = runner.run(command, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        raise VBoxNotInstalledError()
+    running = set()
+    for i in str(result, hostos_encoding).split('\n'):
+        if i.startswith('"'):
+            name, sep, uuid = i[1:].rpartition('" ')
+            running.add(name)
+            running.add(uuid.strip()[1:-1])
+    return running
+
+def get_xml_inventory():
+    """Get the inventory from VirtualBox.xml and .vbox files
+
+    Returns None if the files can not be read.
+    """
+    if QUERY_BACKEND == 'vboxmanage':
+        return None
+    vbox_home = get_vbox_home()
+    if vbox_home is None:
+        return None
+    vms = vboxxml.read_inventory(vbox_home)
+    if vms is None:
+        return None
+    running = get_running_vms()
+    for vm in vms:
+        if vm.name in running or vm.uuid in running:
+            vm.state = "running"
+    return vms
+
+@_locked
+def get_vminfo(name, extradata=False, options=False):
+    """Get the settings and state of the given vd
+
+    It is parsed once per command from the .vbox file or
+    'showvminfo --machinereadable', and shared by every caller until
+    the inventory is invalidated. Returns None if the vd does not exist.
+
+    Args:
+        name (string): name or uuid of vd
+        extradata (boolean): the extra data is needed
+        options (boolean): the common settings of showvminfo are needed, see VmInfo.options
+    """
+    vm = _vminfo.get(name)
+    if vm is not None and (vm.extradata is not None or not extradata) and (vm.options is not None or not options):
+        return vm
+
+    vm = None
+    vbox_home = get_vbox_home()
+    entry = find_vd(name)
+    if (QUERY_BACKEND != 'vboxmanage' and not options and vbox_home is not None and entry is not None
+            and entry.config):
+        registry = vboxxml.read_registry(vbox_home)
+        if registry is not None:
+            vm = vboxxml.read_machine(entry.config, registry[1])
+        if vm is not None:
+            vm.state = entry.state
+    if vm is None:
+        command = [get_vboxm()] + ['showvminfo', name, '--machinereadable']
+        try:
+            ret, result, error = runner.run(command, stdout=PIPE, stderr=PIPE)
+        except OSError:
+            print("webos-emulator : get_vminfo VBoxManage error")
+            return None
+        if ret != 0:
+            logging.debug("showvminfo error : %s" % str(error, hostos_encoding))
+            return None
+        vm = parse_machinereadable(str(result, hostos_encoding))
+    if extradata and vm.extradata is None:
+        command = [get_vboxm()] + ['getextradata', name, 'enumerate']
+        try:
+            ret, result, error = runner.run(command, stdout=PIPE, stderr=PIPE)
+        except OSError:
+            print("webos-emulator : get_vminfo VBoxManage error")
+            return None
+        vm.extradata = parse_extradata(str(result, hostos_encoding))
+    _vminfo[vm.name] = _vminfo[vm.uuid] = _vminfo[name] = vm
+    return vm
+
+@_locked
+def get_inventory(refresh=False):
+    """Get a snapshot of all the registered vms
+
+    The snapshot is made by one 'list -l vms' call and shared by the
+    query functions below until it is invalidated. It is also kept in
+    the user cache directory, so other processes can use it without
+    running VBoxManage while VirtualBox settings are not changed.
+
+    Args:
+        refresh (boolean): discard the current snapshot and the cache file
+    """
+    global _inventory
+    if _inventory is not None and not refresh:
+        return _inventory
+    if get_vboxm() == None:
+        raise VBoxNotInstalledError()
+    if not refresh:
+        _inventory = load_inventory_cache()
+        if _inventory is not None:
+            logging.debug("inventory from cache")
+            return _inventory
+    _inventory = get_xml_inventory()
+    if _inventory is not None:
+        logging.debug("inventory from VirtualBox.xml")
+        return _inventory
+
+    started = time.time()
+    command = [get_vboxm()] + ['list', '-l', 'vms']
+    try:
+        ret, result, error = runner.run(command, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        raise VBoxNotInstalledError()
+    result = str(result, hostos_encoding)
+    if 'vboxconfig' in result or 'vboxconfig' in str(error, hostos_encoding):
+        raise VBoxDriverError(result + str(error, hostos_encoding))
+    vms = parse_vm_list(result)
+    key = get_inventory_key([vm.config for vm in vms])
+    # a file changed while listing may not be reflected in the result,
+    # 2 seconds covers coarse mtime resolution of some file systems
+    if key is not None and all(k[1] is None or k[1] < (started - 2) * 1e9 for k in key):
+        save_inventory_cache(vms, key)
+    _inventory = vms
+    return _inventory
+
+@_locked
+def set_inventory(vms):
+    """Use the vms listed by the caller as the snapshot
+
+    Args:
+        vms (list): VmInfo of all the registered vms
+    """
+    global _inventory
+    _inventory = vms
+
+@_locked
+def release_inventory():
+    """Drop the snapshot, the cache file is kept and checked on the next use
+
+    A long running process calls it to see the changes made by others.
+    """
+    global _inventory
+    _inventory = None
+    _vminfo.clear()
+
+@_locked
+def invalidate_inventory():
+    """Discard the snapshot and the cache file after the vms are changed"""
+    global _inventory
+    _inventory = None
+    _vminfo.clear()
+    try:
+        os.remove(os.path.join(get_cache_dir(), INVENTORY_CACHE))
+    except OSError:
+        pass
+
+def find_vd(name):
+    """Find the given vd in the inventory
+
+    Args:
+        name (string): name or uuid of vd
+    """
+    try:
+        inventory = get_inventory()
+    except VBoxError as e:
+        logging.debug("find_vd : %s" % e)
+        return None
+    for vm in inventory:
+        if vm.name == name or vm.uuid == name:
+            return vm
+    return None
 
 def is_vd_exists(name):
     """Check the given vd is exists
@@ -41,20 +447,7 @@ def is_vd_exists(name):
     Args:
         name (string): target name of vd
     """
-    vdcmd = VBOXM
-    command = [vdcmd] + ['list', 'vms']
-
-    try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, error = sp.communicate()
-    except:
-        return False
-    result = str(result, hostos_encoding).split('\n')
-    pattern = "^\"" + name + "\""
-    for i in result:
-        if re.search(pattern, i):
-            return True
-    return False
+    return find_vd(name) is not None
 
 def check_linux_guest(name):
     """Check the given vm is Linux guest
@@ -62,24 +455,8 @@ def check_linux_guest(name):
     Args:
         name (string): target name
     """
-    vdcmd = VBOXM
-    command = [vdcmd] + ['showvminfo', name]
-
-    try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, error = sp.communicate()
-    except:
-        return False
-    result = str(result, hostos_encoding).split('\n')
-    for i in result:
-        if i == "":
-            break
-        n = i.split(":")
-        if n[0]=="Guest OS":
-            n1 = n[1].strip()
-            if n1 == "Other Linux (64-bit)" or n1 == "Other Linux (32-bit)":
-                return True
-    return False
+    vm = find_vd(name)
+    return vm is not None and vm.ostype in LINUX_GUEST_OS
 
 def validate_vd_name(name, listing):
     """Validate the given vd name
@@ -88,66 +465,37 @@ def validate_vd_name(name, listing):
         name (string): target name of vd
         listing (boolean): list option
     """
-    vdcmd = VBOXM
-    command = [vdcmd] + ['list', 'vms']
-
     try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, error = sp.communicate()
-        command = [vdcmd] + ['list', 'runningvms']
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result2, error2 = sp.communicate()
-    except:
+        inventory = get_inventory()
+    except VBoxNotInstalledError:
         print("webos-emulator : Please install virtualbox and set the PATH variable in the system envrionment.")
         print("On Windows, please refer to https://www.webosose.org/docs/tools/sdk/emulator/virtualbox-emulator/emulator-user-guide/#setting-the-path-on-windows")
         return ("__VBOX_NOT_INSTALLED__", "", "", "")
+    except VBoxDriverError as e:
+        print("webos-emulator : Please recompile the kernel module and install.")
+        print(e.output)
+        return ("__VBOX_DRV_KERNEL_PROBLEM_", "", "", "")
 
-    dl = []
     product = "ose"
     rname = ""
     ruuid = ""
     version = ""
-    if 'vboxconfig' in str(result, hostos_encoding):
-        print("webos-emulator : Please recompile the kernel module and install.")
-        print(str(result, hostos_encoding))
-        return ("__VBOX_DRV_KERNEL_PROBLEM_", "", "", "")
-    result = str(result, hostos_encoding).split('\n')
-    running_vm = ""
-
-    if result2:
-        result2 = str(result2, hostos_encoding).split('\n')
-        running_vm = result2[0].split("\" ")[0][1:]
-
-    for i in result:
-        if i == "":
-            break
-        vm = n = i.split("\" ")
-        n = vm[0][1:]
-        m = vm[1].strip()[1:-1]
-
-        if check_linux_guest(n):
-            dl.append((n, m))
+    dl = [vm for vm in inventory if vm.ostype in LINUX_GUEST_OS]
     if listing:
-        for i,j in dl:
-            if i == running_vm:
+        for vm in dl:
+            if vm.name.startswith(TEMPLATE_PREFIX):
+                continue
+            i = vm.name
+            if vm.running:
                 i = i + " (running)"
             print(i)
         return ("","","")
     else:
-        for i,j in dl:
-            if i == name or j == name:
-                rname = i
-                ruuid = j
-                if rname.startswith("LG webOS TV Emulator"):
-                    product = "tv"
-                    version = rname.split("LG webOS TV Emulator")[1]
-                    if version == "":
-                        version = "1.2.0"
-                    else:
-                        version = version[1:]
-                elif rname.startswith("LG webOS SIGNAGE Emulator"):
-                    product = "signage"
-                    version = rname.split("LG webOS SIGNAGE Emulator ")[1]
+        for vm in dl:
+            if vm.name == name or vm.uuid == name:
+                rname = vm.name
+                ruuid = vm.uuid
+                product, version = get_product_version(rname)
     return (rname, ruuid, product, version)
 
 def is_vd_running(name):
@@ -156,24 +504,8 @@ def is_vd_running(name):
     Args:
         name (string): target name of vd
     """
-    vdcmd = VBOXM
-    command = [vdcmd] + ['list', 'runningvms']
-
-    try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, error = sp.communicate()
-    except:
-        print("webos-emulator : is_vd_running subprocess.Popen error")
-        return False
-    if error:
-       print("webos-emulator : Popen error %s" % error)
-       return False
-    result = str(result, hostos_encoding).split('\n')
-    pattern = "^\"" + name + "\""
-    for i in result:
-        if re.search(pattern, i):
-            return True
-    return False
+    vm = find_vd(name)
+    return vm is not None and vm.running
 
 def get_storage_name(name):
     """Check the given vd's stroage controller name
@@ -181,27 +513,10 @@ def get_storage_name(name):
     Args:
         name (string): target name of vd
     """
-    vdcmd = VBOXM
-    command = [vdcmd] + ['showvminfo', name]
-
-    try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, error = sp.communicate()
-    except:
-        print("webos-emulator : get_storage_name subprocess.Popen error")
+    vm = find_vd(name)
+    if vm is None:
         return ""
-    if error:
-       print("webos-emulator : Popen error %s" % error)
-       return ""
-    result = str(result, hostos_encoding).split('\n')
-    for i in result:
-        if i.startswith("Storage Controller Name (0):"):
-            found = i.split("Storage Controller Name (0):")
-            return found[1].strip()
-        if i.startswith("#0:"):
-            found = i.split(",")[0].split()[1]
-            return found.strip()[1:-1]
-    return ""
+    return vm.storage
 
 def is_safe_to_create(name): # TODO: need to rename the method name
     """Check if the emulator is running
@@ -210,7 +525,7 @@ def is_safe_to_create(name): # TODO: need to rename the method name
         the name of emulator
     """
     logging.info("is_safe_to_create : %s" % name)
-    if VBOXM == None:
+    if get_vboxm() == None:
         print("webos-emulator : Please install virtualbox.")
         return False
 
@@ -225,12 +540,12 @@ def detach_image(name):
     Args:
         name (string): target name of vd
     """
-    vdcmd = VBOXM
+    vdcmd = get_vboxm()
     command = [vdcmd] + ["storageattach", name, "--storagectl", name,
                          "--type", "hdd", "--medium", "emptydrive",
                          "--port", "0", "--device", "0"]
 
-    if subprocess.call(command, stdin=STDIN, stderr=get_stderr()) != 0:
+    if runner.call(command, stdin=STDIN, stderr=get_stderr()) != 0:
         logging.debug("detach error")
         # TODO: check if storage is attached or not using grep '(UUID: ' in showvminfo
         # return False
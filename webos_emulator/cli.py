@@ -5,24 +5,55 @@
 
 """Console script for webos-emulator."""
 import argparse
+import atexit
 import sys
 from typing import List, Optional
 import logging
 import os
+import json
+import socket
+import time
 
 from webos_emulator import __version__
 from webos_emulator import WebosEmulator
-from webos_emulator.webos_emulator import attach_storage, create_vd, custom_vd, default_vd, delete_vd, hidden_create, modify_vd, set_default, start_vd, stop_vd, VD_JSON
-from webos_emulator.check import VBOXM, validate_vd_name, is_vd_exists, is_vd_running
+# the asyncio API, the daemon, the images, the pools and the templates are
+# imported by the commands which use them, they slow down the startup
+from webos_emulator.webos_emulator import ACPI_TIMEOUT, READY_TIMEOUT, apply_settings, attach_storage, create_fleet, create_vd, custom_vd, default_vd, delete_vd, get_settings, hidden_create, modify_vd, set_default, start_vd, stop_vd
+from webos_emulator.ports import get_ports
+from webos_emulator.runner import enable_profile, write_profile
+from webos_emulator.check import LINUX_GUEST_OS, TEMPLATE_PREFIX, get_inventory, get_vboxm, validate_vd_name, is_vd_exists, is_vd_running
 
 def main():
     """webOS Emulator Launcher"""
     logging.basicConfig(format='[%(levelname)s] %(message)s')
-    parser = argparse.ArgumentParser(description=main.__doc__)
+    argv = sys.argv[1:]
+    if argv and argv[0] in SUBCOMMANDS:
+        return SUBCOMMANDS[argv[0]](argv[1:])
+    parser = argparse.ArgumentParser(description=main.__doc__, epilog=SUBCOMMANDS_HELP,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
     args = _parse_args(parser)
     
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
+    # -i and -x also take the digest or the tag of a registered image
+    if args.image and not os.path.isfile(args.image):
+        from webos_emulator.images import resolve_image
+        args.image = resolve_image(args.image) or args.image
+    if args.express and args.express != "configured" and not os.path.isfile(args.express):
+        from webos_emulator.images import resolve_image
+        args.express = resolve_image(args.express) or args.express
+    # the settings of the profile, auto is sized for the emulators of the command
+    settings = get_settings(args.emulator_profile, args.count or len([i for i in (args.vd or "").split(",") if i]) or 1)
+    if settings is None:
+        return 1
+    args.frontend = args.frontend or settings.get('frontend')
+    if args.profile:
+        enable_profile()
+        atexit.register(write_profile, args.profile)
+    elif not (args.dry_run or args.debug or args.wait_ready):
+        ret = run_by_daemon(args)
+        if ret is not None:
+            return ret
     
     """if args.vd_image:
         vd = WebosEmulator("webos-imagex")
@@ -43,18 +74,20 @@ def main():
             else:
                 print("webos-emulator : Please check %s exists." % args.express)
                 return 1
-            if VD_JSON['ram']:
-                vd.ram = VD_JSON['ram']
+            apply_settings(vd, settings)
             if create_vd(vd) == False:  # TODO: create webos-emulator class and use
                 print("webos-emulator : failed")
                 return 1
 
         vd.product = "ose"
+        vd.frontend = args.frontend
         if is_vd_exists(vd.name):
             if is_vd_running(vd.name):
-                stop_vd(vd)
+                stop_vd(vd, args.suspend)
             else:
-                start_vd(vd)
+                started = time.monotonic()
+                if start_vd(vd) and args.wait_ready:
+                    return wait_vd_ready(vd, args.wait_ready, args.ready_command, started)
         else:
             print("Please specify a vmdk full path to make and launch emulator like below")
             print("   webos-emulator -x  /path/to/abc.vmdk")
@@ -66,6 +99,11 @@ def main():
     if args.list:
         validate_vd_name("__list_images__", True)
         return 0
+
+    if args.start and (args.all or (args.vd and "," in args.vd)):
+        return start_many(args)
+    if args.stop and (args.all or args.acpi is not None or (args.vd and "," in args.vd)):
+        return stop_many(args)
     
     name = ""
     uuid = ""
@@ -97,9 +135,22 @@ def main():
             else:
                 print("webos-emulator : Please check %s exists." % args.image)
                 return 1
-        if VD_JSON['ram']:
-            vd.ram = VD_JSON['ram']
-        create_vd(vd)  # TODO: create webos-emulator class and use
+        apply_settings(vd, settings)
+        if args.count or "," in args.vd or args.template:
+            if args.count:
+                names = ["%s-%d" % (args.vd, i) for i in range(1, args.count + 1)]
+            else:
+                names = [i for i in args.vd.split(",") if i]
+            if args.template:
+                from webos_emulator.template import create_from_template
+                created = create_from_template(vd, names, args.dry_run)
+            else:
+                created = create_fleet(vd, names, args.dry_run)
+            if not args.dry_run:
+                for i in created:
+                    print(i)
+            return 0 if len(created) == len(names) else 1
+        create_vd(vd, args.dry_run)  # TODO: create webos-emulator class and use
         return 0
 
     if args.custom:
@@ -117,9 +168,9 @@ def main():
             else:
                 print("webos-emulator : Please check %s exists." % args.image)
                 return 1
-        if VD_JSON['ram']:
-            vd.ram = VD_JSON['ram']
-        if custom_vd(vd, args.custom) == False:  # TODO: create webos-emulator class and use
+        apply_settings(vd, settings)
+        from webos_emulator.template import create_from_ova
+        if create_from_ova(vd, args.custom) == False:  # TODO: create webos-emulator class and use
             return 1
         return 0
 
@@ -155,6 +206,7 @@ def main():
         modify_vd(vd, mstr, args.name, vmdk)
     elif args.hidden_create:
         vd = WebosEmulator(name, args.vd)
+        apply_settings(vd, settings)
         mstr = ""
         if args.memory:
             vd.ram = str(args.memory)
@@ -176,7 +228,7 @@ def main():
         vmdk = ""
         if args.vmdk:
             vd.vmdkfile = str(args.vmdk.name)
-        hidden_create(vd)
+        hidden_create(vd, args.dry_run)
     elif args.image:
         if not os.path.isfile(args.image):
             print("webos-emulator : Please check %s exists." % args.image)
@@ -186,28 +238,31 @@ def main():
             return 1
         vd = WebosEmulator(name, args.vd)
         vd.image = args.image
-        if VD_JSON['ram']:
-            vd.ram = VD_JSON['ram']
+        apply_settings(vd, settings)
         # create_vd(vd)  # TODO: create webos-emulator class and use
-        attach_storage(VBOXM, vd.name, vd.image)
+        attach_storage(get_vboxm(), vd.name, vd.image)
     elif args.start:
         vd = WebosEmulator(name, args.vd)
+        vd.frontend = args.frontend
         if product == "tv":
             vd.product = "tv"
             vd.version = version
         elif product == "signage":
             vd.product = "signage"
             vd.version = version
-        start_vd(vd)
+        started = time.monotonic()
+        if start_vd(vd) and args.wait_ready and vd.product == "ose":
+            return wait_vd_ready(vd, args.wait_ready, args.ready_command, started)
     elif args.stop:
         vd = WebosEmulator(name, args.vd)
-        stop_vd(vd)
+        stop_vd(vd, args.suspend)
     elif args.delete:
         vd = WebosEmulator(name, args.vd)
         delete_vd(vd)
     elif args.default:
         vd = WebosEmulator(name, args.vd)
-        default_vd(vd)
+        apply_settings(vd, settings)
+        default_vd(vd, args.dry_run)
     elif args.custom:
         vd = WebosEmulator(name, args.vd)
         custom_vd(vd, args.custom)
@@ -216,6 +271,294 @@ def main():
 
     return 0
 
+def wait_vd_ready(vd, timeout, command, started):
+    """Wait until the started emulator is ready and print the boot time
+
+    Args:
+        vd (WebosEmulator): vd object
+        timeout (int): seconds to wait
+        command (str): command which must succeed in the emulator
+        started (float): time.monotonic() when the emulator was started
+    """
+    from webos_emulator.ready import wait_ready
+    ports = get_ports(vd.name)
+    port = ports["ssh"] if ports else vd.hostssh
+    elapsed = wait_ready(port, timeout, command=command, started=started)
+    if elapsed is None:
+        print("webos-emulator : %s is not ready in %d seconds" % (vd.name, timeout))
+        return 1
+    print("webos-emulator : %s is ready in %.1f seconds" % (vd.name, elapsed))
+    return 0
+
+def get_batch(args, running):
+    """Get the emulators of -vd <name>,<name>, or of --all which are running or not
+
+    Args:
+        args: parsed arguments
+        running (bool): running state of the emulators of --all
+
+    Returns:
+        list of the names, None if a name is wrong
+    """
+    if not args.all and not args.vd:
+        print("Please specify a vd name with -vd <name>")
+        return None
+    name = validate_vd_name("" if args.all else args.vd, False)[0]
+    if name.startswith("__VBOX"):
+        return None
+    if args.all:
+        return [vm.name for vm in get_inventory() if vm.running == running and
+                vm.ostype in LINUX_GUEST_OS and not vm.name.startswith(TEMPLATE_PREFIX)]
+    names = []
+    for i in args.vd.split(","):
+        if not i:
+            continue
+        name = validate_vd_name(i, False)[0]
+        if name == "":
+            print("Please check vd list via webos-emulator -l")
+            return None
+        names.append(name)
+    return names
+
+def start_many(args):
+    """Start the emulators of -vd <name>,<name> or --all concurrently"""
+    from webos_emulator.aio import start_vds
+    names = get_batch(args, False)
+    if names is None:
+        return 1
+    started = start_vds(names, args.frontend, args.wait_ready, args.ready_command)
+    for name in names:
+        if name not in started:
+            print("webos-emulator : %s is not %s" % (name, "ready" if args.wait_ready else "started"))
+    return 0 if len(started) == len(names) else 1
+
+def stop_many(args):
+    """Stop the emulators of -vd <name>,<name> or --all concurrently"""
+    from webos_emulator.aio import stop_vds
+    names = get_batch(args, True)
+    if names is None:
+        return 1
+    if not names:
+        print("webos-emulator : no emulator is running")
+        return 0
+    stopped = stop_vds(names, args.suspend, args.acpi)
+    return 0 if len(stopped) == len(names) else 1
+
+def run_by_daemon(args):
+    """Run list, start and kill by the running daemon
+
+    Returns:
+        exit code, None if the daemon is not running or the command is not supported
+    """
+    from webos_emulator import daemon
+    if not daemon.is_enabled():
+        return None
+    if args.list:
+        response = daemon.call("list")
+        if response is None:
+            return None
+        if "error" in response:
+            print("webos-emulator : " + response["error"]["message"])
+            return 1
+        for vm in response["result"]:
+            print(vm["name"] + (" (running)" if vm["running"] else ""))
+        return 0
+    if not args.vd or not (args.start or args.stop) or args.all or args.acpi is not None or "," in args.vd:
+        return None
+    if args.start:
+        response = daemon.call("start", {"name": args.vd, "frontend": args.frontend})
+    else:
+        response = daemon.call("stop", {"name": args.vd, "suspend": args.suspend})
+    if response is None:
+        return None
+    if "error" in response:
+        print(response["error"]["message"])
+        return 1
+    sys.stdout.write(response.get("output", ""))
+    return 0 if response.get("result") is not False else 1
+
+def serve_main(argv):
+    """Serve JSON-RPC requests on a Unix socket for IDEs and scripts"""
+    from webos_emulator import daemon
+    parser = argparse.ArgumentParser(prog="webos-emulator serve", description=serve_main.__doc__)
+    parser.add_argument("--socket", metavar="<path>", help="socket path (default: %s)" % daemon.get_socket_path())
+    parser.add_argument("--stop", action="store_true", help="stop the running daemon")
+    parser.add_argument("--debug", action="store_true", help="Show debug info")
+    args = parser.parse_args(argv)
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.stop:
+        response = daemon.call("shutdown", path=args.socket)
+        if response is None:
+            print("webos-emulator : daemon is not running")
+            return 1
+        if "error" in response:
+            print("webos-emulator : " + response["error"]["message"])
+            return 1
+        return 0
+    if not hasattr(socket, "AF_UNIX"):
+        print("webos-emulator : serve is not supported on this system")
+        return 1
+    return daemon.serve(args.socket)
+
+def image_main(argv):
+    """Manage the registry and the store of the images referred to by digest or tag"""
+    from webos_emulator import images
+    parser = argparse.ArgumentParser(prog="webos-emulator image", description=image_main.__doc__)
+    commands = parser.add_subparsers(dest="command", metavar="<command>")
+    add = commands.add_parser("add", help="copy an image into the store, the least recently used images "
+                                          "over the budget are evicted")
+    add.add_argument("image", metavar="<file>")
+    add.add_argument("-t", "--tag", metavar="<tag>", help="tag of the image, e.g. nightly")
+    add.add_argument("--move", action="store_true", help="move the file into the store instead of copying it")
+    imp = commands.add_parser("import", help="convert a .wic, .wic.gz, .wic.bz2 or .wic.xz image to a sparse vmdk "
+                                             "in a stream, without a decompressed copy")
+    imp.add_argument("image", metavar="<file>")
+    imp.add_argument("-o", "--output", metavar="<file>", help="vmdk file (default: <image>.vmdk in the current directory)")
+    imp.add_argument("-t", "--tag", metavar="<tag>", help="tag of the vmdk, e.g. nightly")
+    imp.add_argument("--store", action="store_true", help="move the vmdk into the store")
+    imp.add_argument("--vboxmanage", action="store_true", help="convert by VBoxManage convertfromraw instead")
+    imp.add_argument("--size", type=int, metavar="<bytes>",
+                     help="with --vboxmanage, bytes of the decompressed image of a compressed one")
+    prune = commands.add_parser("prune", help="evict the least recently used images which no emulator uses "
+                                              "until the store is in the budget")
+    prune.add_argument("--budget", metavar="<size>",
+                       help="bytes of the store, e.g. 20G, which is kept for the next commands "
+                            "(default: %dG)" % (images.DEFAULT_BUDGET // 1024 ** 3))
+    digest = commands.add_parser("digest", help="print the sha256 digests of the images and register them")
+    digest.add_argument("files", nargs="+", metavar="<file>")
+    tag = commands.add_parser("tag", help="tag an image, then -i <tag> refers to it")
+    tag.add_argument("image", metavar="<file|digest|tag>")
+    tag.add_argument("tag", metavar="<tag>")
+    commands.add_parser("list", help="show the registered images as json")
+    args = parser.parse_args(argv)
+
+    if args.command == "add":
+        if not os.path.isfile(args.image):
+            print("webos-emulator : Please check %s exists." % args.image)
+            return 1
+        print(images.add_image(args.image, args.tag, args.move))
+        return 0
+    if args.command == "import":
+        if not os.path.isfile(args.image):
+            print("webos-emulator : Please check %s exists." % args.image)
+            return 1
+        path = images.import_image(args.image, args.output, args.tag, args.store, args.vboxmanage, args.size)
+        if path is None:
+            return 1
+        print(path)
+        return 0
+    if args.command == "prune":
+        if args.budget is not None:
+            try:
+                images.set_budget(images.parse_size(args.budget))
+            except ValueError:
+                print("webos-emulator : Please specify a size like 20G for --budget")
+                return 1
+        for path in images.prune():
+            print(path)
+        return 0
+    if args.command == "digest":
+        for path in args.files:
+            if not os.path.isfile(path):
+                print("webos-emulator : Please check %s exists." % path)
+                return 1
+            print("sha256:%s  %s" % (images.get_digest(path), path))
+        return 0
+    if args.command == "tag":
+        path = images.resolve_image(args.image)
+        if path is None:
+            print("webos-emulator : Please check %s exists." % args.image)
+            return 1
+        print("sha256:%s" % images.get_digest(path, args.tag))
+        return 0
+    if args.command == "list":
+        print(json.dumps(images.list_images(), indent=2, sort_keys=True))
+        return 0
+    parser.print_help()
+    return 1
+
+def pool_main(argv):
+    """Manage a warm pool of booted emulators"""
+    from webos_emulator import images, pool
+    parser = argparse.ArgumentParser(prog="webos-emulator pool", description=pool_main.__doc__)
+    parser.add_argument("--name", default=pool.DEFAULT_POOL, metavar="<pool>",
+                        help="pool name, the prefix of the emulator names (default: %(default)s)")
+    parser.add_argument("--timeout", type=int, default=READY_TIMEOUT, metavar="<seconds>",
+                        help="seconds to wait for an emulator to be ready (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", metavar="<command>")
+    fill = commands.add_parser("fill", help="create and boot emulators until the pool has <number> of them")
+    fill.add_argument("-i", "--image", required=True, metavar="<file>", help="vmdk image shared by the emulators")
+    fill.add_argument("-n", "--size", type=int, default=2, metavar="<number>", help="pool size (default: 2)")
+    fill.add_argument("-p", "--emulator-profile", metavar="<name>", dest="emulator_profile",
+                      help="settings profile of the emulators, auto sizes them for the pool size")
+    commands.add_parser("checkout", help="take a ready emulator, print its name and ports as json")
+    give = commands.add_parser("return", help="restore the emulator to the booted snapshot and put it back")
+    give.add_argument("vd", metavar="<name>")
+    commands.add_parser("repair", help="restore the broken emulators")
+    commands.add_parser("drain", help="delete the emulators of the pool")
+    commands.add_parser("status", help="show the emulators of the pool as json")
+    args = parser.parse_args(argv)
+
+    if args.command == "fill":
+        args.image = images.resolve_image(args.image) or args.image
+        if not os.path.isfile(args.image):
+            print("webos-emulator : Please check %s exists." % args.image)
+            return 1
+        settings = get_settings(args.emulator_profile, args.size)
+        if settings is None:
+            return 1
+        for name in pool.fill(args.image, args.size, args.name, args.timeout, settings):
+            print(name)
+        # checked out members are healthy, only the broken and unfilled ones fail the fill
+        return 0 if all(i in (pool.FREE, pool.BUSY) for i in pool.status(args.name)["members"].values()) else 1
+    if args.command == "checkout":
+        vd = pool.checkout(args.name)
+        if vd is None:
+            print("webos-emulator : no ready emulator in pool %s" % args.name)
+            return 1
+        print(json.dumps(vd, indent=2, sort_keys=True))
+        return 0
+    if args.command == "return":
+        return 0 if pool.give_back(args.vd, args.name, args.timeout) else 1
+    if args.command == "repair":
+        for name in pool.repair(args.name, args.timeout):
+            print(name)
+        return 0
+    if args.command == "drain":
+        for name in pool.drain(args.name):
+            print(name)
+        return 0
+    if args.command == "status":
+        print(json.dumps(pool.status(args.name) or {}, indent=2, sort_keys=True))
+        return 0
+    parser.print_help()
+    return 1
+
+def ports_main(argv):
+    """Show the host ports of webOS emulators as json"""
+    parser = argparse.ArgumentParser(prog="webos-emulator ports", description=ports_main.__doc__)
+    parser.add_argument("vd", nargs="?", metavar="<name>", help="webOS emulator name, all if not given")
+    args = parser.parse_args(argv)
+    ports = get_ports(args.vd)
+    if ports is None:
+        print("webos-emulator : no ports are allocated to %s" % args.vd)
+        return 1
+    print(json.dumps(ports, indent=2, sort_keys=True))
+    return 0
+
+SUBCOMMANDS = {
+    "image": image_main,
+    "pool": pool_main,
+    "ports": ports_main,
+    "serve": serve_main,
+}
+SUBCOMMANDS_HELP = """subcommands:
+  image <command>       import, add, prune, digest, tag or list the images which -i <digest|tag> refers to
+  pool <command>        fill, checkout, return, repair, drain or status of a warm pool of booted emulators
+  ports [<name>]        show the host ports of emulators as json
+  serve [--stop]        serve JSON-RPC requests on a Unix socket, -l, -s and -k use it when running"""
+
 def _parse_args(parser: argparse.ArgumentParser, args: Optional[List] = None) -> argparse.Namespace:
     vd_grp = parser.add_argument_group('Commands')
     vd_grp = vd_grp.add_mutually_exclusive_group()
@@ -229,7 +572,7 @@ def _parse_args(parser: argparse.ArgumentParser, args: Optional[List] = None) ->
     parser.add_argument(
         "-vd",  # change vm option to vd
         metavar='<name> or <uuid>',
-        help="use a webOS emulator name as product_version like ose_475",
+        help="use a webOS emulator name as product_version like ose_475, comma separated names with -c create emulators sharing the image",
     )
     vd_grp.add_argument(
         "-m",
@@ -267,6 +610,61 @@ def _parse_args(parser: argparse.ArgumentParser, args: Optional[List] = None) ->
         dest="create",
         help="Create a webOS emulator",
     )
+    parser.add_argument(
+        "--count",
+        type=int,
+        metavar='<number>',
+        help="with -c, create <number> emulators named <name>-1 .. <name>-N sharing the image",
+    )
+    parser.add_argument(
+        "--template",
+        action="store_true",
+        dest="template",
+        help="with -c, create emulators as linked clones of a golden template of the image",
+    )
+    parser.add_argument(
+        "--suspend",
+        action="store_true",
+        dest="suspend",
+        help="with -k or -x, save the state instead of powering off, the next start resumes it",
+    )
+    parser.add_argument(
+        "--acpi",
+        nargs='?',
+        type=int,
+        const=ACPI_TIMEOUT,
+        metavar='<seconds>',
+        dest="acpi",
+        help="with -k, shut down by the ACPI power button and power off if still running "
+             "after <seconds> (default %d seconds)" % ACPI_TIMEOUT,
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        dest="all",
+        help="with -s or -k, start or stop all emulators concurrently, -vd <name>,<name> the given ones",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_const",
+        const="headless",
+        dest="frontend",
+        help="with -s or -x, start without a window, the default frontend is set in webos-emulator.json",
+    )
+    parser.add_argument(
+        "--separate",
+        action="store_const",
+        const="separate",
+        dest="frontend",
+        help="with -s or -x, start headless with a window which can be closed and reopened",
+    )
+    parser.add_argument(
+        "--gui",
+        action="store_const",
+        const="gui",
+        dest="frontend",
+        help="with -s or -x, start with a window",
+    )
     parser.add_argument(
         "-i",
         "--image",
@@ -319,12 +717,46 @@ def _parse_args(parser: argparse.ArgumentParser, args: Optional[List] = None) ->
         dest="express",
         help='Launch a emulator if vmdk is given, without vmdk option launch or kill the emulator',
     )
+    parser.add_argument(
+        "--wait-ready",
+        nargs='?',
+        type=int,
+        const=READY_TIMEOUT,
+        metavar='<seconds>',
+        dest="wait_ready",
+        help="with -s or -x, wait until the emulator answers on its ssh port (default %d seconds)" % READY_TIMEOUT,
+    )
+    parser.add_argument(
+        "--ready-command",
+        metavar='<command>',
+        dest="ready_command",
+        help="with --wait-ready, also wait until the command succeeds in the emulator by ssh",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        dest="dry_run",
+        help="Print the VBoxManage commands of create or default settings without running them",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
         dest="debug",
         help="Show debug info",
     )
+    parser.add_argument(
+        "-p",
+        "--emulator-profile",
+        metavar='<name>',
+        dest="emulator_profile",
+        help="settings profile of webos-emulator.json or the user config.json, "
+             "auto sizes CPUs and RAM by the host and the number of emulators",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar='<file>',
+        help="write a trace of the VBoxManage calls as Chrome trace-event json and print the summary",
+    )
         
     return parser.parse_args(args)
 
@@ -0,0 +1,330 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Daemon mode of webos-emulator.
+
+'webos-emulator serve' listens on a Unix socket in the user cache
+directory and answers line-delimited JSON-RPC 2.0 requests:
+
+    {"jsonrpc": "2.0", "id": 1, "method": "status", "params": {"name": "ose"}}
+
+The inventory stays warm between requests, so status queries do not run
+VBoxManage, and operations on the same vd are serialized. The CLI uses
+the daemon when it is running, set WEBOS_EMULATOR_DAEMON=0 to disable it.
+"""
+
+import inspect
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from webos_emulator import WebosEmulator
+from webos_emulator.check import (LINUX_GUEST_OS, TEMPLATE_PREFIX, get_cache_dir, get_inventory, get_vminfo,
+                                  release_inventory, validate_vd_name)
+from webos_emulator.exceptions import VBoxError
+from webos_emulator.images import resolve_image
+from webos_emulator.ports import get_ports
+from webos_emulator.webos_emulator import apply_settings, create_vd, get_settings, modify_vd, start_vd, stop_vd
+
+SOCKET_NAME = "daemon.sock"
+INVENTORY_TTL = 2.0  # seconds the inventory is reused without checking the cache file
+CLIENT_TIMEOUT = 600  # seconds to wait for a response, create and start take long
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+VD_ERROR = -32000
+NO_RESPONSE = -32001  # of the client, the request is sent but the daemon did not respond
+
+class RpcError(Exception):
+    """Error response of a request"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+def get_socket_path():
+    """Get the path of the daemon socket"""
+    return os.path.join(get_cache_dir(), SOCKET_NAME)
+
+class _ThreadOutput:
+    """stdout which is captured per thread while a request is handled"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        return (self._stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if getattr(self._local, "buffer", None) is None:
+            self._stream.flush()
+
+    def start(self):
+        self._local.buffer = io.StringIO()
+
+    def stop(self):
+        buffer, self._local.buffer = self._local.buffer, None
+        return buffer.getvalue()
+
+class Daemon:
+    """JSON-RPC methods on the warm inventory"""
+
+    def __init__(self, output=None):
+        """Construct a :class:`Daemon <Daemon>`.
+
+        :param _ThreadOutput output:
+            stdout which captures the messages of a request, not captured if None.
+        """
+        self.output = output
+        self.warmed = 0.0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._inventory_lock = threading.Lock()
+
+    def lock(self, name):
+        """Get the lock of operations on the vd"""
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def warm(self):
+        """Reuse the inventory for INVENTORY_TTL, then revalidate it with the cache file"""
+        with self._inventory_lock:
+            if time.monotonic() - self.warmed > INVENTORY_TTL:
+                release_inventory()
+                self.warmed = time.monotonic()
+
+    def resolve(self, name):
+        """Get (name, product, version) of the vd, raises RpcError if it does not exist"""
+        if not name:
+            raise RpcError(INVALID_PARAMS, "Please specify a vd name with -vd <name>")
+        rname, uuid, product, version = validate_vd_name(name, False)
+        if rname.startswith("__VBOX"):
+            raise RpcError(VD_ERROR, "VirtualBox is not available")
+        if rname == "":
+            raise RpcError(VD_ERROR, "Please check vd list via webos-emulator -l")
+        return rname, product, version
+
+    def rpc_ping(self):
+        return {"pid": os.getpid()}
+
+    def rpc_list(self):
+        try:
+            inventory = get_inventory()
+        except VBoxError as e:
+            raise RpcError(VD_ERROR, "VirtualBox is not available : %s" % type(e).__name__)
+        return [{"name": vm.name, "uuid": vm.uuid, "state": vm.state, "running": vm.running}
+                for vm in inventory if vm.ostype in LINUX_GUEST_OS and not vm.name.startswith(TEMPLATE_PREFIX)]
+
+    def rpc_status(self, name=None):
+        rname, product, version = self.resolve(name)
+        vm = get_vminfo(rname)
+        if vm is None:
+            raise RpcError(VD_ERROR, "vd does not exist!")
+        status = vm.to_dict()
+        status.update(running=vm.running, product=product, ports=get_ports(rname))
+        return status
+
+    def rpc_create(self, name=None, image=None, ram=None, profile=None):
+        if not name:
+            raise RpcError(INVALID_PARAMS, "Please specify a vd name with -vd <name>")
+        settings = get_settings(profile)
+        if settings is None:
+            raise RpcError(INVALID_PARAMS, "unknown profile %s" % profile)
+        resolved = resolve_image(image)
+        if image and resolved is None:
+            raise RpcError(INVALID_PARAMS, "Please check %s exists." % image)
+        vd = WebosEmulator(name, name)
+        vd.image = resolved
+        apply_settings(vd, settings)
+        if ram:
+            vd.ram = str(ram)
+        with self.lock(name):
+            return create_vd(vd)
+
+    def rpc_start(self, name=None, frontend=None):
+        rname, product, version = self.resolve(name)
+        vd = WebosEmulator(rname, name)
+        vd.frontend = frontend
+        if product in ("tv", "signage"):
+            vd.product = product
+            vd.version = version
+        with self.lock(rname):
+            return start_vd(vd)
+
+    def rpc_stop(self, name=None, suspend=False):
+        rname, product, version = self.resolve(name)
+        with self.lock(rname):
+            return stop_vd(WebosEmulator(rname, name), suspend)
+
+    def rpc_modify(self, name=None, memory=None, vram=None, cpus=None, monitorcount=None,
+                   newname=None, ostype=None, vmdk=None):
+        rname, product, version = self.resolve(name)
+        if ostype is not None and ostype not in ("Linux", "Linux_64"):
+            raise RpcError(INVALID_PARAMS, "Please specify a correct ostype name: Linux or Linux_64")
+        mstr = ""
+        for flag, value in (("--memory", memory), ("--vram", vram), ("--cpus", cpus),
+                            ("--monitorcount", monitorcount), ("--name", newname), ("--ostype", ostype)):
+            if value:
+                mstr = mstr + flag + ":" + str(value) + ":"
+        with self.lock(rname):
+            return modify_vd(WebosEmulator(rname, name), mstr, newname, vmdk or "")
+
+    def rpc_shutdown(self):
+        return True
+
+    def handle(self, request):
+        """Handle a request and return the response"""
+        rid = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise RpcError(INVALID_PARAMS, "invalid request")
+            method = getattr(self, "rpc_" + request["method"], None)
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, "method not found : %s" % request["method"])
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, "params must be an object")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise RpcError(INVALID_PARAMS, str(e))
+            self.warm()
+            if self.output is not None:
+                self.output.start()
+            output = ""
+            try:
+                result = method(**params)
+            finally:
+                if self.output is not None:
+                    output = self.output.stop()
+            return {"jsonrpc": "2.0", "id": rid, "result": result, "output": output}
+        except RpcError as e:
+            return {"jsonrpc": "2.0", "id": rid, "error": {"code": e.code, "message": e.message}}
+        except VBoxError as e:
+            return {"jsonrpc": "2.0", "id": rid, "error": {"code": VD_ERROR, "message": str(e)}}
+        except Exception as e:
+            logging.exception("request error")
+            return {"jsonrpc": "2.0", "id": rid, "error": {"code": INTERNAL_ERROR, "message": "internal error : %s" % e}}
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                request = None
+                response = {"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": "parse error"}}
+            else:
+                response = self.server.rpc.handle(request)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+            self.wfile.flush()
+            if isinstance(request, dict) and request.get("method") == "shutdown" and "result" in response:
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(path, output=None):
+    """Bind the socket which only the user can connect to
+
+    Args:
+        path (str): socket path
+        output (_ThreadOutput): stdout which captures the messages of a request
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    umask = os.umask(0o077)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.rpc = Daemon(output)
+    return server
+
+def serve(path=None):
+    """Serve the JSON-RPC requests until the shutdown request
+
+    Args:
+        path (str): socket path, see get_socket_path()
+    """
+    path = path or get_socket_path()
+    if call("ping", path=path) is not None:
+        print("webos-emulator : daemon is already running on %s" % path)
+        return 1
+    try:
+        os.remove(path)  # stale socket of a daemon which is not running
+    except OSError:
+        pass
+    output = _ThreadOutput(sys.stdout)
+    server = make_server(path, output)
+    sys.stdout = output
+    print("webos-emulator : serving on %s" % path)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout = output._stream
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return 0
+
+def call(method, params=None, path=None, timeout=CLIENT_TIMEOUT):
+    """Call a method of the running daemon
+
+    Args:
+        method (str): method name
+        params (dict): parameters of the method
+        path (str): socket path, see get_socket_path()
+        timeout (float): seconds to wait for the response
+
+    Returns:
+        response dict, None if the daemon is not running. The request may
+        have been handled if it is sent, so an error after that is a
+        NO_RESPONSE error response instead of None.
+    """
+    path = path or get_socket_path()
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        try:
+            s.connect(path)
+        except OSError as e:
+            logging.debug("daemon is not available : %s" % e)
+            return None
+        try:
+            s.sendall(json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}).encode('utf-8') + b"\n")
+            with s.makefile("rb") as f:
+                line = f.readline()
+            return json.loads(line.decode('utf-8'))
+        except (OSError, ValueError) as e:
+            logging.debug("daemon did not respond : %s" % e)
+            return {"jsonrpc": "2.0", "id": 1,
+                    "error": {"code": NO_RESPONSE, "message": "daemon did not respond : %s" % e}}
+    finally:
+        s.close()
+
+def is_enabled():
+    """Check the CLI may use the daemon"""
+    return os.environ.get("WEBOS_EMULATOR_DAEMON", "1") != "0"
@@ -24,3 +24,28 @@ class DetachError(VdError):
         """
         super().__init__(f"[{vdname}] could not detach image")
         self.vdname = vdname
+
+class VBoxError(webos_emulatorError):
+    """VirtualBox related exception
+
+    """
+
+class VBoxNotInstalledError(VBoxError):
+    """VBoxManage could not be executed
+
+    """
+    def __init__(self):
+        super().__init__("VBoxManage is not installed or not in PATH")
+
+class VBoxDriverError(VBoxError):
+    """VirtualBox kernel driver problem
+
+    """
+    def __init__(self, output:str):
+        """VirtualBox Driver Error
+
+        Args:
+            output (str): VBoxManage output which reports the problem
+        """
+        super().__init__("VirtualBox kernel driver is not loaded")
+        self.output = output
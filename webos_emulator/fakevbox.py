@@ -0,0 +1,453 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Fake VBoxManage for tests and benchmarks without VirtualBox.
+
+FakeVBoxManage keeps vms, media, NAT rules and the running state in a
+dict and implements the subset of VBoxManage used by webos-emulator.
+Latency and failures can be injected per subcommand.
+
+FakeBackend runs it in process behind webos_emulator.runner:
+
+    fake = FakeVBoxManage()
+    runner.set_backend(FakeBackend(fake))
+
+main() runs it as a VBoxManage executable which keeps the state in the
+json file given by FAKE_VBOXMANAGE_STATE, FAKE_VBOXMANAGE_LATENCY adds
+seconds of latency to every call and FAKE_VBOXMANAGE_ACPI sets the
+seconds the guest takes to shut down after the ACPI power button.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid as uuidlib
+from subprocess import DEVNULL, PIPE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from webos_emulator.runner import VBoxManageBackend
+
+VERSION = "7.0.99r0"
+RUNNING = ("running", "paused")
+# number of values of modifyvm flags which do not take one value
+ARITY = {"--uart1": 2, "--uartmode1": 2}
+# modifyvm flags of the showvminfo fields in "options"
+OPTION_FLAGS = {"--ioapic": "ioapic", "--graphicscontroller": "graphicscontroller", "--accelerate3d": "accelerate3d",
+                "--mouse": "hidpointing", "--audio": "audio", "--audioout": "audio_out", "--audioin": "audio_in",
+                "--nic1": "nic1", "--boot1": "boot1", "--boot2": "boot2", "--boot3": "boot3", "--boot4": "boot4"}
+DEFAULT_OPTIONS = {"ioapic": "off", "graphicscontroller": "vboxvga", "accelerate3d": "off", "hidpointing": "ps2mouse",
+                   "audio": "none", "audio_out": "off", "audio_in": "off", "nic1": "nat", "uart1": "off",
+                   "boot1": "floppy", "boot2": "dvd", "boot3": "disk", "boot4": "none"}
+
+class FakeError(Exception):
+    """VBoxManage error with its message"""
+
+class FakeVBoxManage:
+    """Stateful VBoxManage simulator"""
+
+    def __init__(self, state=None, latency=0.0, acpi=0.0):
+        """Construct a :class:`FakeVBoxManage <FakeVBoxManage>`.
+
+        :param dict state:
+            vms and media of a previous run, empty if not given.
+        :param latency:
+            seconds of every call, or a dict of subcommand to seconds.
+        :param acpi:
+            seconds the guest takes to shut down after the ACPI power
+            button, None if the guest ignores it.
+        """
+        self.state = state or {"vms": {}, "media": {}}
+        self.latency = latency
+        self.acpi = acpi
+        self.failures = {}  # subcommand: [remaining calls, message]
+        self.calls = []  # argv of every call
+        self._lock = threading.Lock()
+
+    def fail(self, subcommand, times=1, message="injected failure"):
+        """Make the next calls of the subcommand fail
+
+        Args:
+            subcommand (str): VBoxManage subcommand, e.g. "storageattach"
+            times (int): number of calls to fail
+            message (str): error message
+        """
+        self.failures[subcommand] = [times, message]
+
+    def count(self, subcommand=None):
+        """Get the number of calls of the subcommand, or of all calls"""
+        return len([a for a in self.calls if subcommand is None or a[:1] == [subcommand]])
+
+    def vm(self, name):
+        """Find a vm by name or uuid"""
+        for vm in self.state["vms"].values():
+            if vm["name"] == name or vm["uuid"] == name:
+                return vm
+        raise FakeError("Could not find a registered machine named '%s'" % name)
+
+    def stopped(self, name):
+        """Find a vm which is not running"""
+        vm = self.vm(name)
+        if vm["state"] in RUNNING:
+            raise FakeError("The machine '%s' is already locked for a session" % vm["name"])
+        return vm
+
+    def attached(self, path):
+        """Names of the vms which have the medium attached"""
+        return [vm["name"] for vm in self.state["vms"].values() if path in vm["attachments"].values()]
+
+    def delay(self, args):
+        """Get the latency of the command in seconds"""
+        subcommand = args[0] if args else ""
+        return self.latency.get(subcommand, 0) if isinstance(self.latency, dict) else self.latency
+
+    def run(self, args):
+        """Run a command and return (returncode, stdout, stderr)"""
+        args = list(args)
+        delay = self.delay(args)
+        if delay:
+            time.sleep(delay)
+        return self.execute(args)
+
+    def execute(self, args):
+        """Run a command without the latency"""
+        args = list(args)
+        subcommand = args[0] if args else ""
+        with self._lock:
+            self.calls.append(args)
+            failure = self.failures.get(subcommand)
+            if failure and failure[0] > 0:
+                failure[0] -= 1
+                return 1, "", "VBoxManage: error: %s\n" % failure[1]
+            return self._run(args)
+
+    def _run(self, args):
+        for vm in self.state["vms"].values():
+            if vm.get("shutdown_at") is not None and vm["shutdown_at"] <= time.time():
+                vm["state"] = "poweroff"
+                vm["shutdown_at"] = None
+        try:
+            if not args:
+                raise FakeError("Syntax error")
+            handler = getattr(self, "cmd_" + args[0].lstrip("-").replace("-", "_"), None)
+            if handler is None:
+                raise FakeError("Invalid command '%s'" % args[0])
+            return 0, handler(args[1:]) or "", ""
+        except (FakeError, IndexError, KeyError, ValueError) as e:
+            return 1, "", "VBoxManage: error: %s\n" % e
+
+    def cmd_version(self, args):
+        return VERSION + "\n"
+
+    def cmd_list(self, args):
+        if args[-1] == "runningvms":
+            return "".join('"%s" {%s}\n' % (vm["name"], vm["uuid"])
+                           for vm in self.state["vms"].values() if vm["state"] in RUNNING)
+        if args[-1] == "hdds":
+            out = []
+            for path in sorted(self.state["media"]):
+                out.append(self.mediuminfo(path) + "\n")
+            return "".join(out)
+        out = []
+        for vm in self.state["vms"].values():
+            if "-l" not in args and "--long" not in args:
+                out.append('"%s" {%s}\n' % (vm["name"], vm["uuid"]))
+                continue
+            state = "powered off" if vm["state"] == "poweroff" else vm["state"]
+            out.append("Name:                        %s\n" % vm["name"])
+            out.append("Guest OS:                    %s\n" % vm["ostype"])
+            out.append("UUID:                        %s\n" % vm["uuid"])
+            out.append("Config file:                 %s\n" % vm["config"])
+            out.append("Memory size:                 %sMB\n" % vm["memory"])
+            out.append("State:                       %s (since 2024-01-01T00:00:00.000000000)\n" % state)
+            for i, (ctl, ctype) in enumerate(vm["controllers"]):
+                out.append("Storage Controller Name (%d):            %s\n" % (i, ctl))
+            for i, rule in enumerate(vm["natrules"]):
+                out.append("NIC 1 Rule(%d):   name = %s, protocol = %s, host ip = %s, host port = %s, "
+                           "guest ip = %s, guest port = %s\n" % ((i,) + tuple(rule.split(","))))
+            out.append("\n")
+        return "".join(out)
+
+    def mediuminfo(self, path):
+        medium = self.state["media"][path]
+        parent = self.state["media"].get(medium.get("parent"))
+        users = ", ".join("%s (UUID: %s)" % (vm["name"], vm["uuid"]) for vm in self.state["vms"].values()
+                          if path in vm["attachments"].values())
+        out = ("UUID:           %s\nParent UUID:    %s\nState:          created\n"
+               "Type:           %s (%s)\nLocation:       %s\nStorage format: VMDK\n"
+               "Capacity:       0 MBytes\nEncryption:     disabled\n"
+               % (medium["uuid"], parent["uuid"] if parent else "base", medium["type"],
+                  "differencing" if parent else "base", path))
+        return out + ("In use by VMs:  %s\n" % users if users else "")
+
+    def cmd_showmediuminfo(self, args):
+        for path, medium in self.state["media"].items():
+            if args[-1] in (path, medium["uuid"]) or os.path.abspath(args[-1]) == path:
+                return self.mediuminfo(path)
+        raise FakeError("Could not find file for the medium '%s'" % args[-1])
+
+    def cmd_showvminfo(self, args):
+        vm = self.vm(args[0])
+        if "--machinereadable" not in args:
+            return "Name:                        %s\nGuest OS:                    %s\n" % (vm["name"], vm["ostype"])
+        out = ['name="%s"' % vm["name"], 'ostype="%s"' % vm["ostype"], 'UUID="%s"' % vm["uuid"],
+               'CfgFile="%s"' % vm["config"], "memory=%s" % vm["memory"], "vram=%s" % vm["vram"],
+               "cpus=%s" % vm["cpus"], 'VMState="%s"' % vm["state"], "monitorcount=%s" % vm["monitorcount"]]
+        for i, (ctl, ctype) in enumerate(vm["controllers"]):
+            out.append('storagecontrollername%d="%s"' % (i, ctl))
+            out.append('storagecontrollertype%d="%s"' % (i, ctype))
+        for key, path in sorted(vm["attachments"].items()):
+            ctl, port, device = key.rsplit("-", 2)
+            out.append('"%s"="%s"' % (key, path))
+            out.append('"%s-ImageUUID-%s-%s"="%s"' % (ctl, port, device, self.state["media"][path]["uuid"]))
+        for i, rule in enumerate(vm["natrules"]):
+            out.append('Forwarding(%d)="%s"' % (i, rule))
+        for key, value in sorted(vm.get("options", DEFAULT_OPTIONS).items()):
+            out.append('%s="%s"' % (key, value))
+        return "\n".join(out) + "\n"
+
+    def cmd_getextradata(self, args):
+        vm = self.vm(args[0])
+        if args[1] == "enumerate":
+            return "".join("Key: %s, Value: %s\n" % i for i in sorted(vm["extradata"].items()))
+        return "Value: %s\n" % vm["extradata"][args[1]] if args[1] in vm["extradata"] else "No value set!\n"
+
+    def cmd_setextradata(self, args):
+        vm = self.vm(args[0])
+        if len(args) > 2:
+            vm["extradata"][args[1]] = args[2]
+        else:
+            vm["extradata"].pop(args[1], None)
+
+    def cmd_createvm(self, args):
+        name = args[args.index("--name") + 1]
+        if any(vm["name"] == name for vm in self.state["vms"].values()):
+            raise FakeError("Machine settings file '%s.vbox' already exists" % name)
+        vmuuid = str(uuidlib.uuid4())
+        ostype = args[args.index("--ostype") + 1] if "--ostype" in args else "Other"
+        self.state["vms"][vmuuid] = {
+            "name": name, "uuid": vmuuid, "config": "/fake/%s/%s.vbox" % (name, name),
+            "ostype": {"Linux_64": "Other Linux (64-bit)", "Linux": "Other Linux (32-bit)"}.get(ostype, ostype),
+            "state": "poweroff", "memory": "128", "cpus": "1", "vram": "8", "monitorcount": "1",
+            "controllers": [], "attachments": {}, "natrules": [], "extradata": {}, "snapshots": [],
+            "options": dict(DEFAULT_OPTIONS)}
+        return "Virtual machine '%s' is created and registered.\nUUID: %s\n" % (name, vmuuid)
+
+    def cmd_storagectl(self, args):
+        vm = self.stopped(args[0])
+        name = args[args.index("--name") + 1]
+        if "--add" in args:
+            vm["controllers"].append([name, "PIIX4"])
+        elif "--rename" in args:
+            new = args[args.index("--rename") + 1]
+            for ctl in vm["controllers"]:
+                if ctl[0] == name:
+                    ctl[0] = new
+            vm["attachments"] = {k.replace(name + "-", new + "-", 1) if k.startswith(name + "-") else k: v
+                                 for k, v in vm["attachments"].items()}
+
+    def cmd_storageattach(self, args):
+        vm = self.stopped(args[0])
+        opt = dict(zip(args[1::2], args[2::2]))
+        key = "%s-%s-%s" % (opt["--storagectl"], opt.get("--port", "0"), opt.get("--device", "0"))
+        if opt["--medium"] in ("emptydrive", "none"):
+            vm["attachments"].pop(key, None)
+            return
+        path = os.path.abspath(opt["--medium"])
+        medium = self.state["media"].setdefault(path, {"uuid": str(uuidlib.uuid4()), "type": "normal"})
+        if medium["type"] == "normal" and self.attached(path):
+            raise FakeError("Medium '%s' is already attached to '%s'" % (path, self.attached(path)[0]))
+        vm["attachments"][key] = path
+
+    def cmd_modifymedium(self, args):
+        path = os.path.abspath(args[1])
+        medium = self.state["media"].setdefault(path, {"uuid": str(uuidlib.uuid4()), "type": "normal"})
+        if "--type" in args:
+            if self.attached(path):
+                raise FakeError("Cannot change the type of medium '%s' because it is attached" % path)
+            medium["type"] = args[args.index("--type") + 1]
+
+    def cmd_closemedium(self, args):
+        path = next((p for p, m in self.state["media"].items() if m["uuid"] == args[1]), os.path.abspath(args[1]))
+        if path not in self.state["media"]:
+            raise FakeError("Could not find file for the medium '%s'" % path)
+        if self.attached(path):
+            raise FakeError("Medium '%s' cannot be closed because it is still attached" % path)
+        del self.state["media"][path]
+
+    def cmd_modifyvm(self, args):
+        vm = self.stopped(args[0])
+        i = 1
+        while i < len(args):
+            flag = args[i]
+            if flag == "--natpf1" and args[i + 1] == "delete":
+                rules = [r for r in vm["natrules"] if r.split(",")[0] != args[i + 2]]
+                if len(rules) == len(vm["natrules"]):
+                    raise FakeError("Code NS_ERROR_INVALID_ARG, no rule named '%s'" % args[i + 2])
+                vm["natrules"] = rules
+                i += 3
+                continue
+            value = args[i + 1]
+            if flag == "--natpf1":
+                if any(r.split(",")[0] == value.split(",")[0] for r in vm["natrules"]):
+                    raise FakeError("A NAT rule of this name already exists")
+                vm["natrules"].append(value)
+            elif flag in ("--memory", "--cpus", "--vram", "--monitorcount"):
+                vm[flag[2:]] = value
+            elif flag in OPTION_FLAGS:
+                vm.setdefault("options", dict(DEFAULT_OPTIONS))[OPTION_FLAGS[flag]] = value
+            elif flag == "--uart1":
+                vm.setdefault("options", dict(DEFAULT_OPTIONS))["uart1"] = "0x%04x,%s" % (int(value, 16), args[i + 2])
+            elif flag == "--uartmode1":
+                vm.setdefault("options", dict(DEFAULT_OPTIONS))["uartmode1"] = "%s,%s" % (value, args[i + 2])
+            elif flag == "--name":
+                vm["name"] = value
+            elif flag == "--ostype":
+                vm["ostype"] = {"Linux_64": "Other Linux (64-bit)", "Linux": "Other Linux (32-bit)"}.get(value, value)
+            i += 1 + ARITY.get(flag, 1)
+
+    def cmd_startvm(self, args):
+        vm = self.stopped(args[0])
+        frontend = args[args.index("--type") + 1] if "--type" in args else "gui"
+        if frontend not in ("gui", "headless", "sdl", "separate"):
+            raise FakeError("Invalid session type '%s'" % frontend)
+        vm["state"] = "running"
+        vm["frontend"] = frontend
+        return 'Waiting for VM "%s" to power on...\nVM "%s" has been successfully started.\n' % (vm["name"], vm["name"])
+
+    def cmd_controlvm(self, args):
+        vm = self.vm(args[0])
+        if vm["state"] not in RUNNING:
+            raise FakeError("Machine '%s' is not currently running" % vm["name"])
+        if args[1] == "pause":
+            vm["state"] = "paused"
+        elif args[1] == "resume":
+            vm["state"] = "running"
+        elif args[1] == "poweroff":
+            vm["state"] = "poweroff"
+            vm["shutdown_at"] = None
+        elif args[1] == "acpipowerbutton":
+            if vm["state"] != "running":
+                raise FakeError("Machine '%s' is not running" % vm["name"])
+            if self.acpi is not None and vm.get("shutdown_at") is None:
+                vm["shutdown_at"] = time.time() + self.acpi  # powered off at a later call
+        elif args[1] == "savestate":
+            vm["state"] = "saved"
+
+    def cmd_unregistervm(self, args):
+        vm = self.stopped(args[0])
+        del self.state["vms"][vm["uuid"]]
+        if "--delete" in args:
+            for path in vm["attachments"].values():
+                if not self.attached(path) and self.state["media"][path]["type"] == "normal":
+                    del self.state["media"][path]
+
+    def cmd_snapshot(self, args):
+        vm = self.vm(args[0])
+        if args[1] == "take":
+            # a snapshot of a running vm has its state, restoring it gives a saved vm
+            vm["snapshots"].append({"name": args[2], "live": vm["state"] in RUNNING})
+        elif args[1] == "restore":
+            vm = self.stopped(args[0])
+            snapshots = [i for i in vm["snapshots"] if i["name"] == args[2]]
+            if not snapshots:
+                raise FakeError("Could not find a snapshot named '%s'" % args[2])
+            vm["state"] = "saved" if snapshots[-1]["live"] else "poweroff"
+        elif args[1] == "list":
+            if not vm["snapshots"]:
+                raise FakeError("This machine does not have any snapshots")
+            return "".join('SnapshotName="%s"\n' % i["name"] for i in vm["snapshots"])
+
+    def cmd_clonevm(self, args):
+        source = self.vm(args[0])
+        name = args[args.index("--name") + 1]
+        clone = json.loads(json.dumps(source))
+        clone.update(name=name, uuid=str(uuidlib.uuid4()), state="poweroff", snapshots=[],
+                     config="/fake/%s/%s.vbox" % (name, name))
+        clone["attachments"] = {k: "/fake/%s/Snapshots/%s.vdi" % (name, k) for k in source["attachments"]}
+        for k, path in clone["attachments"].items():
+            self.state["media"][path] = {"uuid": str(uuidlib.uuid4()), "type": "normal",
+                                         "parent": source["attachments"][k]}
+        self.state["vms"][clone["uuid"]] = clone
+
+    def cmd_import(self, args):
+        name = args[args.index("--vmname") + 1]
+        self.cmd_createvm(["--name", name, "--ostype", "Linux_64"])
+        vm = self.vm(name)
+        vm["controllers"].append(["IDE", "PIIX4"])
+        path = "/fake/%s/disk1.vmdk" % name
+        self.state["media"][path] = {"uuid": str(uuidlib.uuid4()), "type": "normal"}
+        vm["attachments"]["IDE-0-0"] = path
+
+class FakeBackend(VBoxManageBackend):
+    """Run VBoxManage commands in process by a FakeVBoxManage
+
+    Other commands are run as subprocesses.
+    """
+
+    def __init__(self, fake=None):
+        """Construct a :class:`FakeBackend <FakeBackend>`.
+
+        :param FakeVBoxManage fake:
+            A simulator, a new one if not given.
+        """
+        self.fake = fake or FakeVBoxManage()
+
+    def resolve(self):
+        return "VBoxManage", VERSION
+
+    def run(self, command, stdin, stdout, stderr, shell):
+        if shell or os.path.basename(str(command[0])) != "VBoxManage":
+            return super().run(command, stdin, stdout, stderr, shell)
+        ret, out, err = self.fake.run(command[1:])
+        return ret, _output(out, stdout, sys.stdout), _output(err, stderr, sys.stderr)
+
+    async def run_async(self, command, stdout, stderr):
+        if os.path.basename(str(command[0])) != "VBoxManage":
+            return await super().run_async(command, stdout, stderr)
+        import asyncio
+        await asyncio.sleep(self.fake.delay(command[1:]))
+        ret, out, err = self.fake.execute(command[1:])
+        return ret, _output(out, stdout, sys.stdout), _output(err, stderr, sys.stderr)
+
+def _output(text, target, stream):
+    """Return the output as bytes for PIPE, or write it like subprocess"""
+    if target is PIPE:
+        return text.encode()
+    if target is None:
+        stream.write(text)
+    elif target is not DEVNULL:
+        os.write(target if isinstance(target, int) else target.fileno(), text.encode())
+    return None
+
+def main(argv):
+    """Run VBoxManage with the state file of FAKE_VBOXMANAGE_STATE"""
+    path = os.environ.get("FAKE_VBOXMANAGE_STATE", "fake-vboxmanage.json")
+    time.sleep(float(os.environ.get("FAKE_VBOXMANAGE_LATENCY", "0")))
+    with open(path + ".lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        acpi = os.environ.get("FAKE_VBOXMANAGE_ACPI", "0")
+        fake = FakeVBoxManage(state, acpi=None if acpi == "none" else float(acpi))
+        ret, out, err = fake.run(argv)
+        with open(path + ".tmp", "w") as f:
+            json.dump(fake.state, f)
+        os.replace(path + ".tmp", path)
+    sys.stdout.write(out)
+    sys.stderr.write(err)
+    return ret
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,441 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Content-addressed registry of the images.
+
+The sha256 digests of vmdk and wic images are kept in images.json of the
+user cache directory with the size and mtime of the files, so an image
+is read once until it changes. A file is hashed through mmap in chunks,
+without reading it into memory.
+
+An image is referred to by its path, its digest (a prefix of at least
+DIGEST_PREFIX hex digits, with or without 'sha256:') or a tag:
+
+    {"files": {path: {"size": bytes, "mtime_ns": ns, "sha256": hex}},
+     "tags": {tag: hex}}
+
+check_image() finds up front an image which VirtualBox would refuse to
+attach, because it is attached to another vd or a copy of it is
+registered, before a vd is created for it.
+
+'image add' copies an image into the store, the images directory of the
+cache directory, as <digest>.vmdk. The store is kept under a byte budget
+by evicting the least recently used images which no vd uses:
+
+    {"store": {digest: {"path": path, "size": bytes, "used": time}},
+     "budget": bytes}
+
+'image import' converts a raw .wic image, also .gz, .bz2 or .xz, to a
+vmdk in a stream, see webos_emulator.vmdk.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import string
+import time
+from subprocess import DEVNULL, PIPE
+
+from webos_emulator import runner
+from webos_emulator.check import get_cache_dir, get_stderr, get_vboxm, hostos_encoding
+from webos_emulator.ports import RegistryLock
+from webos_emulator.vmdk import DECOMPRESSORS, convert, convert_by_vboxmanage, get_output_name
+
+IMAGE_REGISTRY = "images.json"
+HASH_CHUNK = 16 * 1024 * 1024  # bytes hashed at once
+DIGEST_PREFIX = 8  # shortest digest prefix which refers to an image
+STORE_DIR = "images"
+DEFAULT_BUDGET = 50 * 1024 ** 3  # bytes of the store
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def load_images():
+    """Load the registry as {"files": {path: entry}, "tags": {tag: digest}}"""
+    try:
+        with open(os.path.join(get_cache_dir(), IMAGE_REGISTRY), encoding='utf-8') as f:
+            images = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.debug("image registry is not loaded : %s" % e)
+        images = {}
+    images.setdefault("files", {})
+    images.setdefault("tags", {})
+    images.setdefault("store", {})
+    return images
+
+def save_images(images):
+    """Save the registry"""
+    path = os.path.join(get_cache_dir(), IMAGE_REGISTRY)
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        with open(path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(images, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print("webos-emulator : image registry is not saved")
+        logging.debug("image registry error : %s" % e)
+
+def hash_file(path):
+    """Get the sha256 hex digest of the file
+
+    The file is mapped to memory and hashed in chunks of HASH_CHUNK, it
+    is read in chunks if it can not be mapped.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:  # an empty file can not be mapped
+            return hashlib.sha256().hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, "madvise"):  # Python 3.8+
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                h = hashlib.sha256()
+                view = memoryview(m)
+                try:
+                    for offset in range(0, size, HASH_CHUNK):
+                        h.update(view[offset:offset + HASH_CHUNK])
+                finally:
+                    view.release()
+                return h.hexdigest()
+        except (OSError, ValueError) as e:
+            logging.debug("%s is not mapped : %s" % (path, e))
+        f.seek(0)
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
+def _is_fresh(entry, st):
+    return entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+def get_digest(path, tag=None):
+    """Get the sha256 digest of the image, it is hashed only if the file changed
+
+    Args:
+        path (str): image file
+        tag (str): tag given to the image
+
+    Returns:
+        hex digest
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    entry = load_images()["files"].get(path)
+    if _is_fresh(entry, st) and tag is None:
+        return entry["sha256"]
+    digest = entry["sha256"] if _is_fresh(entry, st) else hash_file(path)
+    with RegistryLock(IMAGE_REGISTRY):
+        images = load_images()
+        images["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        if tag is not None:
+            images["tags"][tag] = digest
+        save_images(images)
+    return digest
+
+def find_files(digest, images=None):
+    """Get the registered files of the digest which did not change since they were hashed"""
+    images = images or load_images()
+    files = []
+    for path, entry in sorted(images["files"].items()):
+        if entry["sha256"] != digest:
+            continue
+        try:
+            if _is_fresh(entry, os.stat(path)):
+                files.append(path)
+        except OSError:
+            continue
+    return files
+
+def resolve_digest(ref, images=None):
+    """Get the digest of a digest prefix or a tag, None if it is not registered or ambiguous"""
+    images = images or load_images()
+    if ref in images["tags"]:
+        return images["tags"][ref]
+    ref = ref[len("sha256:"):] if ref.startswith("sha256:") else ref
+    if len(ref) < DIGEST_PREFIX or not all(c in string.hexdigits for c in ref):
+        return None
+    digests = {entry["sha256"] for entry in images["files"].values() if entry["sha256"].startswith(ref.lower())}
+    if len(digests) > 1:
+        print("webos-emulator : %s refers to %d images, please give more digits" % (ref, len(digests)))
+        return None
+    return digests.pop() if digests else None
+
+def resolve_image(ref):
+    """Get the image file of a path, a digest or a tag
+
+    Returns:
+        path of the image file, None if it is not found
+    """
+    if ref is None or os.path.isfile(ref):
+        return ref
+    images = load_images()
+    digest = resolve_digest(ref, images)
+    files = find_files(digest, images) if digest else []
+    if not files:
+        return None
+    stored = images["store"].get(digest)
+    if stored is not None and stored["path"] in files:
+        touch(digest)
+        return stored["path"]
+    return files[0]
+
+def parse_media(text):
+    """Parse 'VBoxManage list hdds' as a list of dicts of the fields of the media"""
+    media = []
+    medium = {}
+    for line in text.splitlines():
+        if not line.strip():
+            if medium:
+                media.append(medium)
+            medium = {}
+            continue
+        key, sep, value = line.partition(":")
+        if sep:
+            medium[key.strip()] = value.strip()
+    if medium:
+        media.append(medium)
+    return media
+
+def has_parent(text):
+    """Check the medium of 'VBoxManage showmediuminfo' is a differencing disk, which has a parent"""
+    media = parse_media(text)
+    return bool(media) and media[0].get("Parent UUID", "base") not in ("base", "")
+
+def is_differencing(medium):
+    """Check the medium is a differencing disk, e.g. the disk of a linked clone or of a multiattach image
+
+    Args:
+        medium (str): uuid or location of a hard disk
+    """
+    ret, out, err = runner.run([get_vboxm(), 'showmediuminfo', 'disk', medium], stdout=PIPE, stderr=get_stderr())
+    if ret != 0:
+        logging.debug("showmediuminfo error : %d" % ret)
+        return False
+    return has_parent(str(out, hostos_encoding))
+
+def get_media():
+    """Get the registered hard disks with the names of the vds which use them
+
+    A multiattach image is used by the vds of its differencing disks.
+
+    Returns:
+        dict of location to {"type": type, "vms": [name]}
+    """
+    ret, out, err = runner.run([get_vboxm(), 'list', 'hdds'], stdout=PIPE, stderr=get_stderr())
+    if ret != 0:
+        logging.debug("list hdds error : %d" % ret)
+        return {}
+    media = parse_media(str(out, hostos_encoding))
+    by_uuid = {m.get("UUID"): m for m in media}
+    result = {}
+    for m in media:
+        base = m
+        while base.get("Parent UUID", "base") in by_uuid:
+            base = by_uuid[base["Parent UUID"]]
+        entry = result.setdefault(base.get("Location", ""), {"type": base.get("Type", "").split(" ")[0], "vms": []})
+        # e.g. "ose (UUID: 1234...), ose-2 (UUID: 5678...)"
+        for name in re.findall(r"(.+?) \(UUID: [^)]*\)(?: \[[^\]]*\])?(?:, |$)", m.get("In use by VMs", "")):
+            if name not in entry["vms"]:
+                entry["vms"].append(name)
+    return result
+
+def check_image(image, name):
+    """Check the image can be attached to the vd before the vd is created
+
+    Args:
+        image (str): image file
+        name (str): vd name, its own attachment is replaced by create
+
+    Returns:
+        error message, None if the image can be attached
+    """
+    path = os.path.abspath(image)
+    media = get_media()
+    medium = media.get(path)
+    if medium is not None and medium["type"] != "multiattach":
+        others = [vm for vm in medium["vms"] if vm != name]
+        if others:
+            return "The vmdk file is already attached to %s. Please use a new vmdk" % others[0]
+    # a copy of a registered image has the same disk uuid, VirtualBox refuses it
+    size = os.path.getsize(path)
+    copies = [location for location in media if location != path and os.path.isfile(location)
+              and os.path.getsize(location) == size]
+    if copies:
+        digest = get_digest(path)
+        for location in copies:
+            if get_digest(location) == digest:
+                return "The vmdk file is a copy of %s which is registered in VirtualBox. " \
+                       "Please use the registered one or a new vmdk" % location
+    return None
+
+def list_images():
+    """Get the registered images as a list of dicts of digest, path, size and tags"""
+    images = load_images()
+    result = []
+    for path, entry in sorted(images["files"].items()):
+        tags = sorted(tag for tag, digest in images["tags"].items() if digest == entry["sha256"])
+        stored = images["store"].get(entry["sha256"], {})
+        result.append({"sha256": entry["sha256"], "path": path, "size": entry["size"], "tags": tags,
+                       "exists": os.path.isfile(path), "stored": stored.get("path") == path,
+                       "used": stored.get("used") if stored.get("path") == path else None})
+    return result
+
+def parse_size(text):
+    """Parse a size in bytes, or with a K, M, G or T suffix, e.g. 50G"""
+    text = str(text).strip().upper()
+    for suffix in ("IB", "B"):
+        if text.endswith(suffix):
+            text = text[:-len(suffix)]
+            break
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+def get_store_dir():
+    """Get the directory of the stored images"""
+    return os.path.join(get_cache_dir(), STORE_DIR)
+
+def get_budget(images=None):
+    """Get the byte budget of the store"""
+    return (images or load_images()).get("budget", DEFAULT_BUDGET)
+
+def set_budget(budget):
+    """Set the byte budget of the store"""
+    with RegistryLock(IMAGE_REGISTRY):
+        images = load_images()
+        images["budget"] = budget
+        save_images(images)
+
+def touch(digest):
+    """Mark the stored image as used now"""
+    with RegistryLock(IMAGE_REGISTRY):
+        images = load_images()
+        if digest in images["store"]:
+            images["store"][digest]["used"] = time.time()
+            save_images(images)
+
+def add_image(image, tag=None, move=False):
+    """Add an image to the store and evict other images over the budget
+
+    Args:
+        image (str): image file
+        tag (str): tag given to the image
+        move (bool): move the file into the store instead of copying it
+
+    Returns:
+        path of the stored image
+    """
+    digest = get_digest(image, tag)
+    images = load_images()
+    stored = images["store"].get(digest)
+    if stored is not None and stored["path"] in find_files(digest, images):
+        touch(digest)
+        return stored["path"]
+    os.makedirs(get_store_dir(), exist_ok=True)
+    path = os.path.join(get_store_dir(), digest + (os.path.splitext(image)[1] or ".vmdk"))
+    if move:
+        shutil.move(image, path + ".tmp")
+    else:
+        shutil.copyfile(image, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    st = os.stat(path)
+    with RegistryLock(IMAGE_REGISTRY):
+        images = load_images()
+        if move:
+            images["files"].pop(os.path.abspath(image), None)
+        images["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        images["store"][digest] = {"path": path, "size": st.st_size, "used": time.time()}
+        save_images(images)
+    prune(keep=[digest])
+    return path
+
+def prune(budget=None, keep=()):
+    """Evict the least recently used stored images until the store is in the budget
+
+    The images attached to vds are kept, the images which are registered
+    in VirtualBox but not attached are closed before they are removed.
+
+    Args:
+        budget (int): bytes of the store, get_budget() if None
+        keep (list): digests which are not evicted
+
+    Returns:
+        list of the paths of the evicted images
+    """
+    evicted = []
+    with RegistryLock(IMAGE_REGISTRY):
+        images = load_images()
+        budget = get_budget(images) if budget is None else budget
+        # images removed by the user
+        for digest, stored in list(images["store"].items()):
+            if not os.path.isfile(stored["path"]):
+                del images["store"][digest]
+                images["files"].pop(stored["path"], None)
+        total = sum(stored["size"] for stored in images["store"].values())
+        if total > budget:
+            media = get_media()
+            for digest, stored in sorted(images["store"].items(), key=lambda i: i[1]["used"]):
+                if total <= budget:
+                    break
+                medium = media.get(stored["path"])
+                if digest in keep or (medium is not None and medium["vms"]):
+                    continue
+                if medium is not None:
+                    runner.call([get_vboxm(), 'closemedium', 'disk', stored["path"]], stdout=DEVNULL,
+                                stderr=get_stderr())
+                try:
+                    os.remove(stored["path"])
+                except OSError as e:
+                    logging.debug("%s is not removed : %s" % (stored["path"], e))
+                    continue
+                del images["store"][digest]
+                images["files"].pop(stored["path"], None)
+                total -= stored["size"]
+                evicted.append(stored["path"])
+            if total > budget:
+                print("webos-emulator : image store is %d bytes over the budget, the other images are in use"
+                      % (total - budget))
+        save_images(images)
+    return evicted
+
+def import_image(source, output=None, tag=None, store=False, vboxmanage=False, size=None):
+    """Convert a raw image to a vmdk in a stream, without a decompressed copy on the disk
+
+    Args:
+        source (str): .wic image, or .wic.gz, .wic.bz2 or .wic.xz
+        output (str): vmdk file, the name of the source with .vmdk in the current directory if None
+        tag (str): tag given to the vmdk
+        store (bool): move the vmdk into the store
+        vboxmanage (bool): convert by 'VBoxManage convertfromraw stdin' instead of the sparse writer
+        size (int): bytes of the raw image, the size of an uncompressed source if None
+
+    Returns:
+        path of the vmdk, None if it is not converted
+    """
+    output = output or get_output_name(source)
+    if os.path.exists(output):
+        print("webos-emulator : %s exists. Please remove it or give another output" % output)
+        return None
+    if size is None and os.path.splitext(source)[1].lower() not in DECOMPRESSORS:
+        size = os.path.getsize(source)
+    started = time.monotonic()
+    if vboxmanage:
+        if size is None:
+            print("webos-emulator : convertfromraw needs the size of the decompressed image. Please give --size")
+            return None
+        progress = convert_by_vboxmanage(source, output, size)
+        if progress is None:
+            print("webos-emulator : convertfromraw error")
+            return None
+    else:
+        progress = convert(source, output, size)
+    progress.report()
+    print("webos-emulator : %s is converted in %.1f seconds" % (output, time.monotonic() - started))
+    if store:
+        return add_image(output, tag, move=True)
+    if tag is not None:
+        get_digest(output, tag)
+    return output
@@ -0,0 +1,93 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Command plan for VBoxManage.
+
+Every modifyvm call takes the session lock of the vm and rewrites its
+.vbox file, so the settings are collected in a plan and applied by one
+modifyvm call.
+"""
+
+import logging
+import shlex
+from subprocess import DEVNULL
+
+from webos_emulator import runner
+from webos_emulator.check import get_stderr
+
+STDIN = DEVNULL  # quiet, None for info level
+
+class CommandPlan:
+    """VBoxManage commands to set up a vm"""
+
+    def __init__(self, name: str):
+        """Construct a :class:`CommandPlan <CommandPlan>`.
+
+        :param str name:
+            A vm name which the plan is applied to.
+        """
+        self.name = name
+        self._before = []  # (args, optional) run before modifyvm
+        self._modifyvm = []
+        self._extradata = []
+        self._after = []  # (args, optional) run after setextradata
+
+    def command(self, *args, optional=False, after=False):
+        """Add a VBoxManage command
+
+        Args:
+            args: VBoxManage arguments
+            optional (bool): errors of the command are ignored
+            after (bool): run the command after modifyvm and setextradata
+        """
+        if after:
+            self._after.append((list(args), optional))
+        else:
+            self._before.append((list(args), optional))
+
+    def modifyvm(self, *flags):
+        """Add modifyvm flags, all of them are applied by one modifyvm call"""
+        self._modifyvm.extend(flags)
+
+    def setextradata(self, key, value):
+        """Add an extra data, a later value of the same key replaces it"""
+        self._extradata = [(k, v) for k, v in self._extradata if k != key]
+        self._extradata.append((key, value))
+
+    def commands(self):
+        """Return the list of (args, optional) in the order to run"""
+        commands = list(self._before)
+        if self._modifyvm:
+            commands.append((['modifyvm', self.name] + self._modifyvm, False))
+        for key, value in self._extradata:
+            commands.append((['setextradata', self.name, key, value], False))
+        return commands + self._after
+
+    def show(self, vboxm):
+        """Print the commands of the plan
+
+        Args:
+            vboxm (str): VBoxManage command, "VBoxManage" if it is not installed
+        """
+        for args, optional in self.commands():
+            line = " ".join(shlex.quote(i) for i in [vboxm or "VBoxManage"] + args)
+            print(line + ("  # errors are ignored" if optional else ""))
+
+    def run(self, vboxm):
+        """Run the commands of the plan
+
+        Raises subprocess.CalledProcessError if a command which is not
+        optional fails.
+
+        Args:
+            vboxm (str): VBoxManage command
+        """
+        for args, optional in self.commands():
+            command = [vboxm] + args
+            if optional:
+                if runner.call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr()) != 0:
+                    logging.debug("ignored error : %s" % command)
+            else:
+                runner.check_call(command, stdin=STDIN)
@@ -0,0 +1,248 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Warm pool of booted emulators.
+
+'pool fill' creates N vds sharing an image, boots them, waits until they
+are ready and takes a live snapshot of the booted state. A job checks
+out a running vd from the pool without waiting for a boot, and returns
+it when it is done. The returned vd is restored to the booted snapshot
+and resumed, so it is ready again for the next job.
+
+The members of the pools are kept in pool.json of the user cache
+directory as {pool: {"image": path, "settings": {}, "members": {name: state}}}.
+A member which can not be restored is created again with the image and
+the settings of the pool.
+"""
+
+import json
+import logging
+import os
+
+from webos_emulator import WebosEmulator
+from webos_emulator.aio import AsyncEmulatorManager
+from webos_emulator.check import find_vd, get_cache_dir, invalidate_inventory
+from webos_emulator.ports import RegistryLock, get_ports
+from webos_emulator.ready import READY_TIMEOUT, run_coroutine
+from webos_emulator.webos_emulator import apply_settings
+
+POOL_REGISTRY = "pool.json"
+DEFAULT_POOL = "webos-pool"
+READY_SNAPSHOT = "ready"  # live snapshot of the booted state
+# states of a member
+FILLING = "filling"
+FREE = "free"
+BUSY = "busy"
+BROKEN = "broken"
+
+def load_pools():
+    """Load the pools as {pool: {"image": path, "settings": {}, "members": {name: state}}}"""
+    try:
+        with open(os.path.join(get_cache_dir(), POOL_REGISTRY), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.debug("pool registry is not loaded : %s" % e)
+        return {}
+
+def save_pools(pools):
+    """Save the pools"""
+    path = os.path.join(get_cache_dir(), POOL_REGISTRY)
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        with open(path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(pools, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print("webos-emulator : pool registry is not saved")
+        logging.debug("pool registry error : %s" % e)
+
+def set_state(pool, name, state):
+    """Set the state of a member"""
+    with RegistryLock(POOL_REGISTRY):
+        pools = load_pools()
+        if pool in pools and name in pools[pool]["members"]:
+            pools[pool]["members"][name] = state
+            save_pools(pools)
+
+def get_member(pool, name):
+    """Get the vd object of a member with the image and the settings of the pool
+
+    Args:
+        pool (dict): pool entry of load_pools()
+        name (str): member name
+    """
+    vd = WebosEmulator(name, name)
+    vd.image = pool.get("image")
+    apply_settings(vd, pool.get("settings", {}))
+    return vd
+
+async def prepare(manager, vd, timeout, created):
+    """Boot the vd, wait until it is ready and take the booted snapshot
+
+    Args:
+        manager (AsyncEmulatorManager): manager of the pool
+        vd (WebosEmulator): member vd
+        timeout (float): seconds to wait for ready
+        created (bool): the vd is created, otherwise it is restored to the snapshot,
+            or created again if it does not have the snapshot
+    """
+    if not created:
+        vm = await manager.find(vd.name)
+        if vm is not None and vm.running:
+            await manager.stop(vd)
+        # a member which failed its first boot has no booted snapshot, it is created again
+        if vm is None or not await manager.has_snapshot(vd, READY_SNAPSHOT):
+            created = True
+        elif not await manager.restore(vd, READY_SNAPSHOT):
+            return False
+    if created:
+        if not await manager.create(vd):
+            return False
+    if not await manager.start(vd, wait_ready=timeout):
+        print("webos-emulator : %s is not ready in %d seconds" % (vd.name, timeout))
+        return False
+    if created:
+        return await manager.snapshot(vd, READY_SNAPSHOT, live=True)
+    return True
+
+def fill(image, size, pool=DEFAULT_POOL, timeout=READY_TIMEOUT, settings=None):
+    """Fill the pool with ready vds
+
+    Members which are missing are created and booted concurrently.
+
+    Args:
+        image (str): vmdk image shared by the members
+        size (int): number of members
+        pool (str): pool name, also the prefix of the member names
+        timeout (float): seconds to wait for a member to be ready
+        settings (dict): settings of the members, see get_settings()
+
+    Returns:
+        list of the names of the new members
+    """
+    names = ["%s-%d" % (pool, i) for i in range(1, size + 1)]
+    with RegistryLock(POOL_REGISTRY):
+        pools = load_pools()
+        entry = pools.setdefault(pool, {"image": os.path.abspath(image), "members": {}})
+        if entry["image"] != os.path.abspath(image):
+            print("webos-emulator : pool %s has the image %s" % (pool, entry["image"]))
+            return []
+        entry["settings"] = settings or {}
+        members = entry["members"]
+        # members being filled by another command are skipped
+        new = [name for name in names if members.get(name) != FILLING and
+               (name not in members or find_vd(name) is None)]
+        for name in new:
+            members[name] = FILLING
+        save_pools(pools)
+    if not new:
+        return []
+    vds = [get_member(entry, name) for name in new]
+    manager = AsyncEmulatorManager()
+
+    async def run():
+        # the image is already shared if a member is alive
+        if len(new) == len(names) and not await manager.share(image):
+            return [False] * len(vds)
+        return await manager.map(lambda vd: prepare(manager, vd, timeout, True), vds)
+
+    results = run_coroutine(run())
+    filled = [vd.name for vd, ok in zip(vds, results) if ok is True]
+    with RegistryLock(POOL_REGISTRY):
+        pools = load_pools()
+        for vd, ok in zip(vds, results):
+            pools[pool]["members"][vd.name] = FREE if ok is True else BROKEN
+        save_pools(pools)
+    return filled
+
+def checkout(pool=DEFAULT_POOL):
+    """Check out a ready vd from the pool
+
+    Returns:
+        dict of the name and the host ports of the vd, None if no vd is free
+    """
+    with RegistryLock(POOL_REGISTRY):
+        pools = load_pools()
+        members = pools.get(pool, {}).get("members", {})
+        for name in sorted(members):
+            if members[name] != FREE:
+                continue
+            vm = find_vd(name)
+            if vm is None or not vm.running:
+                members[name] = BROKEN
+                continue
+            members[name] = BUSY
+            save_pools(pools)
+            return {"name": name, "ports": get_ports(name)}
+        save_pools(pools)
+    return None
+
+def give_back(name, pool=DEFAULT_POOL, timeout=READY_TIMEOUT):
+    """Return a vd to the pool, it is restored to the booted snapshot
+
+    Args:
+        name (str): vd name
+        pool (str): pool name
+        timeout (float): seconds to wait for the vd to be ready
+    """
+    pools = load_pools()
+    if name not in pools.get(pool, {}).get("members", {}):
+        print("webos-emulator : %s is not a member of pool %s" % (name, pool))
+        return False
+    invalidate_inventory()
+    manager = AsyncEmulatorManager()
+    ok = run_coroutine(prepare(manager, get_member(pools[pool], name), timeout, False))
+    set_state(pool, name, FREE if ok else BROKEN)
+    return ok
+
+def repair(pool=DEFAULT_POOL, timeout=READY_TIMEOUT):
+    """Restore the broken members of the pool concurrently
+
+    Returns:
+        list of the names of the repaired members
+    """
+    entry = load_pools().get(pool, {})
+    vds = [get_member(entry, name) for name, state in sorted(entry.get("members", {}).items()) if state == BROKEN]
+    manager = AsyncEmulatorManager()
+    results = run_coroutine(manager.map(lambda vd: prepare(manager, vd, timeout, False), vds))
+    for vd, ok in zip(vds, results):
+        set_state(pool, vd.name, FREE if ok is True else BROKEN)
+    return [vd.name for vd, ok in zip(vds, results) if ok is True]
+
+def drain(pool=DEFAULT_POOL):
+    """Stop and delete the members of the pool
+
+    Returns:
+        list of the names of the deleted members
+    """
+    members = load_pools().get(pool, {}).get("members", {})
+    vds = [WebosEmulator(name, name) for name in sorted(members)]
+    manager = AsyncEmulatorManager()
+
+    async def remove(vd):
+        vm = await manager.find(vd.name)
+        if vm is None:
+            return True
+        if vm.running:
+            await manager.stop(vd)
+        return await manager.delete(vd)
+
+    results = run_coroutine(manager.map(remove, vds))
+    with RegistryLock(POOL_REGISTRY):
+        pools = load_pools()
+        for vd, ok in zip(vds, results):
+            if ok is True:
+                pools.get(pool, {}).get("members", {}).pop(vd.name, None)
+        if pool in pools and not pools[pool]["members"]:
+            del pools[pool]
+        save_pools(pools)
+    return [vd.name for vd, ok in zip(vds, results) if ok is True]
+
+def status(pool=None):
+    """Get the pools, or the given pool"""
+    pools = load_pools()
+    if pool is None:
+        return pools
+    return pools.get(pool)
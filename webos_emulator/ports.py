@@ -0,0 +1,192 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Host port allocator for the port forwarding rules of vds.
+
+The host ports of every vd are kept in ports.json of the user cache
+directory, so two vds on a host never get the same port. The first vd
+gets the default ports.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from webos_emulator import WebosEmulator
+from webos_emulator.check import TEMPLATE_PREFIX, get_cache_dir, get_inventory
+from webos_emulator.exceptions import VBoxError
+
+PORTS_REGISTRY = "ports.json"
+# (rule name, default host port, guest port) of the port forwarding rules
+PORT_RULES = [
+    ("ssh", 6622, 22),
+    ("web-inspector", 9998, 9998),
+    ("enact-browser-web-inspector", 9223, 9999),
+]
+PORT_SEARCH = 1000  # number of ports tried after the default port
+EXTRADATA_PREFIX = "webos-emulator/ports/"  # extra data key of the host port of a rule
+
+_locks = {}  # thread lock of each registry, see RegistryLock
+_locks_lock = threading.Lock()
+
+class RegistryLock:
+    """Lock a registry file of the cache directory between threads and processes
+
+    Each registry has its own lock, so a long operation holding one
+    registry does not block the others.
+    """
+
+    def __init__(self, registry=PORTS_REGISTRY):
+        self.registry = registry
+        with _locks_lock:
+            self._lock = _locks.setdefault(registry, threading.Lock())
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._file = None
+        if fcntl is not None:
+            try:
+                os.makedirs(get_cache_dir(), exist_ok=True)
+                self._file = open(os.path.join(get_cache_dir(), self.registry + ".lock"), "w")
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except OSError as e:
+                logging.debug("%s lock : %s" % (self.registry, e))
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()
+        self._lock.release()
+
+def load_registry():
+    """Load the host ports of vds as {name: {rule: port}}"""
+    try:
+        with open(os.path.join(get_cache_dir(), PORTS_REGISTRY), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.debug("ports registry is not loaded : %s" % e)
+        return {}
+
+def save_registry(registry):
+    """Save the host ports of vds"""
+    path = os.path.join(get_cache_dir(), PORTS_REGISTRY)
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        with open(path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(registry, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print("webos-emulator : ports registry is not saved")
+        logging.debug("ports registry error : %s" % e)
+
+def is_port_free(port):
+    """Check the host port can be listened
+
+    Args:
+        port (int): host port number
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("", port))
+    except OSError:
+        return False
+    finally:
+        s.close()
+    return True
+
+def used_ports(registry, name):
+    """Get the host ports used by other vds
+
+    The golden templates are never started, their rules are not counted.
+
+    Args:
+        registry (dict): host ports of vds
+        name (str): vd name to exclude
+    """
+    used = set()
+    for vdname, ports in registry.items():
+        if vdname != name and not vdname.startswith(TEMPLATE_PREFIX):
+            used.update(ports.values())
+    try:
+        for vm in get_inventory():
+            if vm.name != name and not vm.name.startswith(TEMPLATE_PREFIX):
+                used.update(int(rule[3]) for rule in vm.natrules if rule[3].isdigit())
+    except VBoxError as e:
+        logging.debug("used_ports : %s" % e)
+    return used
+
+def allocate_ports(name, dry_run=False):
+    """Allocate the host ports of the vd
+
+    The ports already allocated to the vd are kept.
+
+    Args:
+        name (str): vd name
+        dry_run (bool): do not record the allocation
+
+    Returns:
+        dict of rule name to host port
+    """
+    with RegistryLock():
+        registry = load_registry()
+        if name in registry:
+            return registry[name]
+        used = used_ports(registry, name)
+        ports = {}
+        for rule, default, guest in PORT_RULES:
+            for port in range(default, default + PORT_SEARCH):
+                if port not in used and is_port_free(port):
+                    break
+            else:
+                port = default
+                print("webos-emulator : no free port for %s, %d is used" % (rule, port))
+            ports[rule] = port
+            used.add(port)
+        if not dry_run:
+            registry[name] = ports
+            save_registry(registry)
+    return ports
+
+def assign_ports(vd: WebosEmulator, dry_run=False):
+    """Set the allocated host ports to the vd object
+
+    Args:
+        vd (WebosEmulator): vd object
+        dry_run (bool): do not record the allocation
+    """
+    ports = allocate_ports(vd.name, dry_run)
+    vd.hostssh = str(ports["ssh"])
+    vd.hostinspector = str(ports["web-inspector"])
+    vd.hostenactinspector = str(ports["enact-browser-web-inspector"])
+    return ports
+
+def release_ports(name):
+    """Release the host ports of the deleted vd
+
+    Args:
+        name (str): vd name
+    """
+    with RegistryLock():
+        registry = load_registry()
+        if registry.pop(name, None) is not None:
+            save_registry(registry)
+
+def get_ports(name=None):
+    """Get the host ports of the vd, or of all vds if name is not given
+
+    Args:
+        name (str): vd name
+    """
+    registry = load_registry()
+    if name is None:
+        return registry
+    return registry.get(name)
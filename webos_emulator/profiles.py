@@ -0,0 +1,140 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Profiles of the emulator settings.
+
+The settings of webos-emulator.json are the packaged defaults. config.json
+of the user config directory is layered over them, its settings replace
+the defaults and its profiles are added to the packaged ones:
+
+    {
+      "profile": "dev",
+      "profiles": {"ci-small": {"cpus": "1", "ram": "2048", "frontend": "headless"}}
+    }
+
+A profile is a set of settings layered over the defaults, "profile" is
+the one used without -p. The auto profile sizes the CPUs and the RAM of
+an emulator from the cores and the memory of the host and the number of
+emulators planned on it.
+"""
+
+import json
+import logging
+import os
+import platform
+
+CONFIG_FILE = "config.json"
+SETTINGS = ("cpus", "ram", "vram", "monitorcount", "scalefactor", "frontend")
+AUTO_PROFILE = "auto"
+HOST_CPUS = 1  # CPUs left to the host by the auto profile
+HOST_RAM = 2048  # MBs left to the host by the auto profile
+AUTO_MAX_CPUS = 4
+AUTO_MIN_RAM = 1024  # MBs, webOS OSE does not boot well with less
+AUTO_MAX_RAM = 4096
+RAM_STEP = 256  # MBs the RAM of the auto profile is rounded down to
+
+def get_config_dir():
+    """Get the user config directory of webos-emulator"""
+    if platform.system() == 'Windows':
+        base = os.environ.get('APPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'webos-emulator')
+    elif platform.system() == 'Darwin':
+        return os.path.expanduser('~/Library/Application Support/webos-emulator')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+        return os.path.join(base, 'webos-emulator')
+
+def load_config():
+    """Load config.json of the user config directory, {} if it does not exist"""
+    path = os.path.join(get_config_dir(), CONFIG_FILE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print("webos-emulator : %s is not loaded" % path)
+        logging.debug("config error : %s" % e)
+        return {}
+    if not isinstance(config, dict):
+        print("webos-emulator : %s is not loaded" % path)
+        return {}
+    return config
+
+def layer(defaults, config):
+    """Layer the user config over the packaged settings
+
+    Args:
+        defaults (dict): settings of webos-emulator.json
+        config (dict): user config, see load_config()
+    """
+    settings = dict(defaults)
+    profiles = {name: dict(profile) for name, profile in defaults.get("profiles", {}).items()}
+    for key, value in config.items():
+        if key == "profiles":
+            if not isinstance(value, dict):
+                print("webos-emulator : profiles of %s are not loaded" % CONFIG_FILE)
+                continue
+            for name, profile in value.items():
+                if not isinstance(profile, dict):
+                    print("webos-emulator : profile %s of %s is not loaded" % (name, CONFIG_FILE))
+                    continue
+                profiles.setdefault(name, {}).update(profile)
+        else:
+            settings[key] = value
+    settings["profiles"] = profiles
+    return settings
+
+def get_host_resources():
+    """Get (number of CPUs, RAM in MBs) of the host, None if it is not known"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count()
+    ram = None
+    try:
+        with open("/proc/meminfo", encoding='ascii') as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    ram = int(line.split()[1]) // 1024
+                    break
+    except (OSError, ValueError):
+        try:
+            ram = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2 ** 20
+        except (AttributeError, OSError, ValueError):
+            pass
+    return cpus, ram
+
+def auto_profile(count=1, host=None):
+    """Size the CPUs and the RAM of an emulator by the host
+
+    The host keeps HOST_CPUS and HOST_RAM, the rest is shared by the
+    emulators. A host which is too small for them is overcommitted with
+    the minimum sizes.
+
+    Args:
+        count (int): number of emulators planned on the host
+        host (tuple): (CPUs, RAM in MBs) of the host, see get_host_resources()
+
+    Returns:
+        dict of the settings
+    """
+    cpus, ram = host or get_host_resources()
+    count = max(count, 1)
+    settings = {}
+    overcommit = False
+    if cpus:
+        share = (cpus - HOST_CPUS) // count
+        overcommit = share < 1
+        settings["cpus"] = str(min(max(share, 1), AUTO_MAX_CPUS))
+    if ram:
+        share = (ram - HOST_RAM) // count // RAM_STEP * RAM_STEP
+        overcommit = overcommit or share < AUTO_MIN_RAM
+        settings["ram"] = str(min(max(share, AUTO_MIN_RAM), AUTO_MAX_RAM))
+    if overcommit:
+        print("webos-emulator : %d emulators overcommit the host of %s CPUs and %s MB RAM"
+              % (count, cpus or "?", ram or "?"))
+    logging.debug("auto profile of %d emulators on %s CPUs, %s MB : %s" % (count, cpus, ram, settings))
+    return settings
@@ -0,0 +1,104 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Boot readiness of a vd.
+
+The forwarded ssh port of the vd is probed until the guest sends the
+SSH banner, instead of sleeping for the worst case boot time.
+"""
+
+import asyncio
+import logging
+import time
+
+from webos_emulator.webos_emulator import READY_TIMEOUT
+
+PROBE_INTERVAL = 1.0  # seconds between probes
+
+def run_coroutine(coro):
+    """Run a coroutine to completion from synchronous code"""
+    if hasattr(asyncio, 'run'):
+        return asyncio.run(coro)
+    loop = asyncio.new_event_loop()  # Python 3.6
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+async def probe_ssh(port, host="127.0.0.1", timeout=5):
+    """Check the SSH banner is sent from the port
+
+    VirtualBox accepts a connection on the forwarded port before the guest
+    listens, so the connection is only ready when the banner is read.
+
+    Args:
+        port (int): host port of the ssh forward
+        host (str): host address
+        timeout (float): seconds to wait for the connection and the banner
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        banner = await asyncio.wait_for(reader.readline(), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+    return banner.startswith(b"SSH-")
+
+async def run_ssh_command(port, command, host="127.0.0.1", timeout=30):
+    """Run a command in the guest by ssh as root
+
+    Args:
+        port (int): host port of the ssh forward
+        command (str): command to run in the guest
+        host (str): host address
+        timeout (float): seconds to wait for the command
+    """
+    args = ["ssh", "-p", str(port), "-o", "StrictHostKeyChecking=no",
+            "-o", "UserKnownHostsFile=/dev/null", "-o", "BatchMode=yes",
+            "-o", "ConnectTimeout=%d" % timeout, "root@" + host, command]
+    try:
+        proc = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+    except OSError as e:
+        logging.debug("ssh error : %s" % e)
+        return False
+    try:
+        return await asyncio.wait_for(proc.wait(), timeout) == 0
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return False
+
+async def wait_ready_async(port, timeout=READY_TIMEOUT, host="127.0.0.1", command=None, started=None):
+    """Wait until the vd is ready
+
+    Args:
+        port (int): host port of the ssh forward
+        timeout (float): seconds to wait
+        host (str): host address
+        command (str): command which must succeed in the guest, e.g. "true"
+        started (float): time.monotonic() when the vd was started
+
+    Returns:
+        seconds from started (or from the call) to ready, None on timeout
+    """
+    started = time.monotonic() if started is None else started
+    deadline = time.monotonic() + timeout
+    while True:
+        if await probe_ssh(port, host):
+            if command is None or await run_ssh_command(port, command, host):
+                return time.monotonic() - started
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(PROBE_INTERVAL)
+
+def wait_ready(port, timeout=READY_TIMEOUT, host="127.0.0.1", command=None, started=None):
+    """Wait until the vd is ready, see wait_ready_async()"""
+    return run_coroutine(wait_ready_async(int(port), timeout, host, command, started))
@@ -0,0 +1,222 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Runner of the external commands.
+
+Every VBoxManage call goes through this module, which records the argv,
+exit code, wall time and output size of each invocation. The records are
+written as a Chrome trace-event json by --profile, to find which of the
+calls of a command dominate its latency.
+
+The commands are run by a backend, VBoxManageBackend by default. Tests
+and benchmarks set webos_emulator.fakevbox.FakeBackend instead to run
+without VirtualBox.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from subprocess import DEVNULL, PIPE
+
+_epoch = time.perf_counter()
+MAX_RECORDS = 1000  # invocations kept without --profile, e.g. by the daemon
+_records = deque(maxlen=MAX_RECORDS)
+_profiling = False
+
+class VBoxManageBackend:
+    """Run the commands as subprocesses"""
+
+    def resolve(self):
+        """Get (command, version) of VBoxManage, None to find it on PATH"""
+        return None
+
+    def run(self, command, stdin, stdout, stderr, shell):
+        """Run a command, see run()"""
+        proc = subprocess.Popen(command, stdin=stdin, stdout=stdout, stderr=stderr, shell=shell)
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    async def run_async(self, command, stdout, stderr):
+        """Run a command by an asyncio subprocess, see run_async()
+
+        The process is killed when the task is cancelled.
+        """
+        import asyncio  # only the asyncio API needs it, it slows down the startup
+        proc = await asyncio.create_subprocess_exec(*command, stdin=DEVNULL, stdout=stdout, stderr=stderr)
+        try:
+            out, err = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return proc.returncode, out, err
+
+_backend = VBoxManageBackend()
+
+def get_backend():
+    """Return the backend which runs the commands"""
+    return _backend
+
+def set_backend(backend):
+    """Set the backend which runs the commands
+
+    Args:
+        backend (VBoxManageBackend): backend, VBoxManageBackend() for subprocesses
+    """
+    global _backend
+    _backend = backend
+
+class Invocation:
+    """Record of a command run"""
+
+    __slots__ = ("argv", "returncode", "start", "duration", "stdout_size", "stderr_size", "tid")
+
+    def __init__(self, argv, start):
+        self.argv = argv
+        self.start = start  # seconds from the module load
+        self.returncode = None
+        self.duration = 0.0
+        self.stdout_size = None  # None if the output is not read
+        self.stderr_size = None
+        self.tid = threading.get_ident()
+
+    @property
+    def label(self):
+        """Command name and subcommand, e.g. 'VBoxManage modifyvm'"""
+        argv = self.argv.split() if isinstance(self.argv, str) else self.argv
+        label = os.path.basename(str(argv[0])) if argv else ""
+        if len(argv) > 1:
+            label += " " + str(argv[1])
+        return label
+
+def enable_profile():
+    """Keep every invocation and read the outputs discarded to DEVNULL, so their sizes are recorded"""
+    global _profiling, _records
+    _profiling = True
+    _records = deque(_records)
+
+def get_records():
+    """Return the invocations recorded so far"""
+    return list(_records)
+
+def clear_records():
+    """Discard the recorded invocations"""
+    _records.clear()
+
+def run(command, stdin=DEVNULL, stdout=None, stderr=None, shell=False):
+    """Run a command and record it
+
+    Raises OSError if the command can not be run.
+
+    Args:
+        command (list): argv, or a string with shell
+        stdin: stdin of subprocess.Popen
+        stdout: stdout of subprocess.Popen, PIPE to return the output
+        stderr: stderr of subprocess.Popen, PIPE to return the output
+        shell (bool): run the command by the shell
+
+    Returns:
+        tuple of returncode and stdout and stderr bytes, None if not PIPE
+    """
+    record = Invocation(command, time.perf_counter() - _epoch)
+    _records.append(record)
+    # a background process of the shell would keep the pipe open, its output is not read
+    pipe_out = stdout is PIPE or (_profiling and stdout is DEVNULL and not shell)
+    pipe_err = stderr is PIPE or (_profiling and stderr is DEVNULL and not shell)
+    try:
+        ret, out, err = _backend.run(command, stdin, PIPE if pipe_out else stdout,
+                                     PIPE if pipe_err else stderr, shell)
+    finally:
+        record.duration = time.perf_counter() - _epoch - record.start
+    record.returncode = ret
+    record.stdout_size = len(out) if out is not None else None
+    record.stderr_size = len(err) if err is not None else None
+    logging.debug("run %s : %s in %.3fs" % (record.label, ret, record.duration))
+    return ret, out if stdout is PIPE else None, err if stderr is PIPE else None
+
+async def run_async(command, stdout=None, stderr=None):
+    """Run a command without blocking the event loop and record it
+
+    Raises OSError if the command can not be run.
+
+    Args:
+        command (list): argv
+        stdout: PIPE to return the output, DEVNULL or None
+        stderr: PIPE to return the output, DEVNULL or None
+
+    Returns:
+        tuple of returncode and stdout and stderr bytes, None if not PIPE
+    """
+    record = Invocation(command, time.perf_counter() - _epoch)
+    _records.append(record)
+    pipe_out = stdout is PIPE or (_profiling and stdout is DEVNULL)
+    pipe_err = stderr is PIPE or (_profiling and stderr is DEVNULL)
+    try:
+        ret, out, err = await _backend.run_async(command, PIPE if pipe_out else stdout,
+                                                 PIPE if pipe_err else stderr)
+    finally:
+        record.duration = time.perf_counter() - _epoch - record.start
+    record.returncode = ret
+    record.stdout_size = len(out) if out is not None else None
+    record.stderr_size = len(err) if err is not None else None
+    logging.debug("run %s : %s in %.3fs" % (record.label, ret, record.duration))
+    return ret, out if stdout is PIPE else None, err if stderr is PIPE else None
+
+def call(command, stdin=DEVNULL, stdout=None, stderr=None, shell=False):
+    """Run a command like subprocess.call"""
+    return run(command, stdin, stdout, stderr, shell)[0]
+
+def check_call(command, stdin=DEVNULL, stdout=None, stderr=None, shell=False):
+    """Run a command like subprocess.check_call"""
+    ret = run(command, stdin, stdout, stderr, shell)[0]
+    if ret != 0:
+        raise subprocess.CalledProcessError(ret, command)
+    return 0
+
+def trace_events(records):
+    """Convert the records to Chrome trace-event json"""
+    events = []
+    for r in records:
+        events.append({
+            "name": r.label, "cat": "command", "ph": "X", "pid": os.getpid(), "tid": r.tid,
+            "ts": round(r.start * 1e6), "dur": round(r.duration * 1e6),
+            "args": {"argv": r.argv, "returncode": r.returncode,
+                     "stdout_bytes": r.stdout_size, "stderr_bytes": r.stderr_size},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def summary(records):
+    """Make the table of the commands sorted by the total time"""
+    groups = {}
+    for r in records:
+        groups.setdefault(r.label, []).append(r.duration)
+    lines = ["%-32s %6s %10s %10s %10s" % ("command", "calls", "total(s)", "mean(s)", "max(s)")]
+    for label, durations in sorted(groups.items(), key=lambda i: -sum(i[1])):
+        lines.append("%-32s %6d %10.3f %10.3f %10.3f" % (label, len(durations), sum(durations),
+                                                         sum(durations) / len(durations), max(durations)))
+    lines.append("%-32s %6d %10.3f" % ("total", len(records), sum(r.duration for r in records)))
+    return "\n".join(lines)
+
+def write_profile(path):
+    """Write the trace of the recorded invocations and print the summary
+
+    Args:
+        path (str): trace-event json file, open it in chrome://tracing or Perfetto
+    """
+    records = get_records()
+    try:
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump(trace_events(records), f)
+    except OSError as e:
+        print("webos-emulator : profile is not written")
+        logging.debug("profile error : %s" % e)
+        return
+    print(summary(records), file=sys.stderr)
+    print("webos-emulator : profile of %d commands is written to %s" % (len(records), path), file=sys.stderr)
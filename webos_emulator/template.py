@@ -0,0 +1,289 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Golden templates for linked clones.
+
+A golden template is a vd which is created once per image and has a
+snapshot. New vds are linked clones of the snapshot, so only the per-vd
+settings (name, port forwards and the settings which differ from the
+template) are applied on create. A template of an image which has been
+changed since is replaced.
+
+An ova of -cc is imported once as a template too. The ova is a tar, its
+OVF descriptor and manifest are read without extracting the disks, and
+the template is named by their digest, which has the digests of the
+disks. The next -cc of the same ova clones the template.
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import tarfile
+import xml.etree.ElementTree as ET
+
+from webos_emulator import WebosEmulator, runner
+from webos_emulator.check import (TEMPLATE_PREFIX, get_vboxm, get_vminfo, invalidate_inventory, is_safe_to_create,
+                                  is_vd_exists)
+from webos_emulator.exceptions import DetachError
+from webos_emulator.images import get_digest
+from webos_emulator.plan import CommandPlan
+from webos_emulator.ports import RegistryLock, assign_ports
+from webos_emulator.webos_emulator import (add_port_forwards, attach_storage, create_plan, import_ova, remove_vd,
+                                           run_create_plan)
+
+TEMPLATE_SNAPSHOT = "golden"
+TEMPLATE_IMAGE = "wemul/template-image"  # extra data of the image size and modification time
+OVA_PREFIX = TEMPLATE_PREFIX + "ova-"
+OVA_LOCK = "ova"  # lock of the ova imports in the cache directory
+
+def template_name(vd: WebosEmulator):
+    """Get the golden template name for the image of vd
+
+    An image can back only one template, so the name is given by the
+    image path. The settings of vd are applied to each clone.
+
+    Args:
+        vd (WebosEmulator): vd object
+    """
+    return TEMPLATE_PREFIX + hashlib.sha1(os.path.abspath(vd.image).encode()).hexdigest()[:12]
+
+def image_identity(image):
+    """Get the size and the modification time of the image, which are kept in the template"""
+    st = os.stat(image)
+    return "%d:%d" % (st.st_size, st.st_mtime_ns)
+
+def template_plan(vd: WebosEmulator, name):
+    """make the command plan to create the golden template
+
+    Args:
+        vd (WebosEmulator): vd object which has the image and settings
+        name (str): template name
+    """
+    tvd = copy.copy(vd)
+    tvd.name = name
+    plan = create_plan(tvd)
+    plan.setextradata(TEMPLATE_IMAGE, image_identity(vd.image))
+    plan.command('snapshot', name, 'take', TEMPLATE_SNAPSHOT, after=True)
+    return plan
+
+def remove_template(template, image):
+    """Unregister an outdated template, the image is kept
+
+    Args:
+        template (str): template name
+        image (str): image of the template
+    """
+    vm = get_vminfo(template)
+    location, uuid = vm.medium(vm.storage) if vm is not None else ("", "")
+    try:
+        runner.check_call([get_vboxm(), 'unregistervm', template], stdout=subprocess.DEVNULL)
+        # the disk of the current state is a differencing disk of the image
+        if location and location != os.path.abspath(image):
+            runner.call([get_vboxm(), 'closemedium', 'disk', location, '--delete'],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        logging.debug("remove template error : %s" % e)
+        return False
+    finally:
+        invalidate_inventory()
+    return True
+
+def clone_plan(vd: WebosEmulator, template, ports=True, base=None):
+    """make the command plan to create a vd as a linked clone
+
+    Args:
+        vd (WebosEmulator): vd object
+        template (str): template name
+        ports (bool): replace the port forwarding rules of the template by the ports of vd
+        base (VmInfo): settings of the template, the settings of vd which differ are applied
+    """
+    plan = CommandPlan(vd.name)
+    plan.command('clonevm', template, '--snapshot', TEMPLATE_SNAPSHOT, '--options', 'link',
+                 '--name', vd.name, '--register')
+    # detach_image and attach_storage use the vd name as the storage controller name
+    plan.command('storagectl', vd.name, '--name', template, '--rename', vd.name)
+    if base is not None:
+        for flag, current, value in (('--memory', base.memory, vd.ram), ('--vram', base.vram, vd.vram),
+                                     ('--cpus', base.cpus, vd.cpus),
+                                     ('--monitorcount', base.monitorcount, vd.monitorcount)):
+            if current != str(value):
+                plan.modifyvm(flag, value)
+        if (base.extradata or {}).get('GUI/ScaleFactor') != str(vd.scalefactor):
+            plan.setextradata('GUI/ScaleFactor', vd.scalefactor)
+    if ports:
+        add_port_forwards(plan, vd, replace=True)
+    return plan
+
+def create_from_template(vd: WebosEmulator, names=None, dry_run=False):
+    """create vds as linked clones of the golden template
+
+    The template is created on the first use.
+
+    Args:
+        vd (WebosEmulator): vd object which has the image and settings
+        names (list): names of vds, vd.name if not given
+        dry_run (bool): print the commands without running them
+
+    Returns:
+        list of the names of created vds
+    """
+    if not vd.image:
+        print("webos-emulator : Please specify a vmdk for the template with -i <file>")
+        return []
+    names = names or [vd.name]
+    template = template_name(vd)
+    base = get_vminfo(template, extradata=True)
+    if base is not None and base.extradata.get(TEMPLATE_IMAGE) != image_identity(vd.image):
+        if dry_run:
+            print("webos-emulator : template %s is outdated, it is replaced" % template)
+        elif not remove_template(template, vd.image):
+            print("webos-emulator : outdated template %s is not removed" % template)
+            return []
+        base = None
+    exists = base is not None
+    plans = []
+    for name in names:
+        cvd = copy.copy(vd)
+        cvd.name = name
+        assign_ports(cvd, dry_run)
+        plans.append(clone_plan(cvd, template, base=base))
+    if dry_run:
+        if not exists:
+            template_plan(vd, template).show(get_vboxm())
+        for plan in plans:
+            plan.show(get_vboxm())
+        return names
+
+    if not exists:
+        logging.info("creating golden template %s...." % template)
+        if not run_create_plan(template_plan(vd, template)):
+            return []
+
+    created = []
+    for plan in plans:
+        if not is_safe_to_create(plan.name):
+            print("webos-emulator : %s is running. please stop vd before create" % plan.name)
+            continue
+        try:
+            remove_vd(plan.name)
+            plan.run(get_vboxm())
+        except DetachError as e:
+            logging.error("webos-emulator error : %s" % e)
+            continue
+        except subprocess.CalledProcessError as e:
+            print("webos-emulator : clone error")
+            logging.debug("clone error : %s" % e)
+            continue
+        finally:
+            invalidate_inventory()
+        created.append(plan.name)
+    return created
+
+def parse_manifest(text):
+    """Parse the manifest of an ova as {file: (algorithm, hex digest)}, e.g. SHA256(disk1.vmdk)= 12ab..."""
+    manifest = {}
+    for line in text.splitlines():
+        m = re.match(r"\s*(\w+)\s*\((.+)\)\s*=\s*([0-9a-fA-F]+)\s*$", line)
+        if m:
+            manifest[m.group(2)] = (m.group(1).lower(), m.group(3).lower())
+    return manifest
+
+def parse_ovf(data):
+    """Get the files referenced by the OVF descriptor"""
+    files = []
+    for element in ET.fromstring(data).iter():
+        if element.tag.rsplit("}", 1)[-1] == "File":
+            files += [v for k, v in element.attrib.items() if k.rsplit("}", 1)[-1] == "href"]
+    return files
+
+def inspect_ova(ovafile):
+    """Read the OVF descriptor and the manifest of an ova without extracting the disks
+
+    Returns:
+        dict of "digest", "ovf" name, "files" and "manifest", None if it is not a valid ova
+    """
+    try:
+        with tarfile.open(ovafile, "r:") as tar:
+            members = tar.getmembers()
+            ovf = next((m for m in members if m.name.lower().endswith(".ovf")), None)
+            mf = next((m for m in members if m.name.lower().endswith(".mf")), None)
+            if ovf is None:
+                print("webos-emulator : %s has no OVF descriptor" % ovafile)
+                return None
+            ovf_data = tar.extractfile(ovf).read()
+            mf_data = tar.extractfile(mf).read() if mf is not None else b""
+        files = parse_ovf(ovf_data)
+        manifest = parse_manifest(mf_data.decode("utf-8"))
+    except (OSError, tarfile.TarError, ET.ParseError, UnicodeDecodeError) as e:
+        print("webos-emulator : %s is not a valid ova" % ovafile)
+        logging.debug("ova error : %s" % e)
+        return None
+    if ovf.name in manifest:
+        algorithm, digest = manifest[ovf.name]
+        if algorithm in hashlib.algorithms_available and hashlib.new(algorithm, ovf_data).hexdigest() != digest:
+            print("webos-emulator : the OVF descriptor of %s does not match its manifest" % ovafile)
+            return None
+    if all(name in manifest for name in files):
+        # the manifest has the digests of the disks, the ova is not read further
+        digest = hashlib.sha256(ovf_data + b"\0" + mf_data).hexdigest()
+    else:
+        digest = get_digest(ovafile)
+    return {"digest": digest, "ovf": ovf.name, "files": files, "manifest": manifest}
+
+def create_from_ova(vd: WebosEmulator, ovafile):
+    """create a vd as a linked clone of the template of the ova, see custom_vd()
+
+    The template is imported on the first use of the ova.
+
+    Args:
+        vd (WebosEmulator): vd object
+        ovafile: ova format 1.0 file
+    """
+    if is_vd_exists(vd.name):
+        print("webos-emulator : vd is exist. please delete vd before setting custom file")
+        return False
+    ova = inspect_ova(ovafile)
+    if ova is None:
+        return False
+    template = OVA_PREFIX + ova["digest"][:12]
+    # another -cc of the same ova waits until its import is done and uses the template
+    with RegistryLock(OVA_LOCK):
+        invalidate_inventory()
+        if not is_vd_exists(template):
+            logging.info("importing %s as template %s...." % (ovafile, template))
+            try:
+                import_ova(template, ovafile)
+                runner.check_call([get_vboxm(), 'snapshot', template, 'take', TEMPLATE_SNAPSHOT],
+                                  stdout=subprocess.DEVNULL)
+            except subprocess.CalledProcessError as e:
+                print("webos-emulator : custom error")
+                logging.debug("custom error : %s" % e)
+                # the half made template of this import is deleted with the disks it imported
+                runner.call([get_vboxm(), 'unregistervm', template, '--delete'], stderr=subprocess.DEVNULL)
+                return False
+            finally:
+                invalidate_inventory()
+    try:
+        clone_plan(vd, template, ports=False).run(get_vboxm())
+    except subprocess.CalledProcessError as e:
+        print("webos-emulator : clone error")
+        logging.debug("clone error : %s" % e)
+        return False
+    finally:
+        invalidate_inventory()
+    if vd.image:
+        # the differencing disk of the clone is replaced by the image, it is not left behind
+        vm = get_vminfo(vd.name)
+        location, uuid = vm.medium(vm.storage) if vm is not None else ("", "")
+        if not attach_storage(get_vboxm(), vd.name, vd.image):
+            print("webos-emulator : custom error")
+            return False
+        if location:
+            runner.call([get_vboxm(), 'closemedium', 'disk', uuid or location, '--delete'],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return True
@@ -0,0 +1,176 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Read-only queries on VirtualBox.xml and .vbox files.
+
+VirtualBox keeps the machine registry in VirtualBox.xml and the settings
+of each vm in its .vbox file. Reading them directly answers lookups
+without running VBoxManage. Every function returns None when a file can
+not be read, so the caller can fall back to VBoxManage.
+"""
+
+import logging
+import os, platform
+import xml.etree.ElementTree as ET
+
+from webos_emulator.vminfo import VmInfo
+
+# OSType ids of .vbox to the names shown by VBoxManage
+OS_DESCRIPTIONS = {
+    "Linux": "Other Linux (32-bit)",
+    "Linux_64": "Other Linux (64-bit)",
+}
+
+# proto of <Forwarding> to the protocol names of --natpf
+PROTOCOLS = {"0": "udp", "1": "tcp"}
+
+def _tag(elem):
+    """Return the tag name without the VirtualBox namespace"""
+    return elem.tag.rsplit('}', 1)[-1]
+
+def _uuid(value):
+    """Return the uuid without braces"""
+    return value.strip('{}')
+
+def _location(base, location):
+    """Return the absolute path of a location relative to base"""
+    return os.path.normpath(os.path.join(base, os.path.expanduser(location)))
+
+def read_registry(vbox_home):
+    """Read the machine and media registry of VirtualBox.xml
+
+    Args:
+        vbox_home (str): directory of VirtualBox.xml
+
+    Returns:
+        tuple of a list of .vbox paths and a dict of media uuid to location
+    """
+    machines = []
+    media = {}
+    try:
+        for event, elem in ET.iterparse(os.path.join(vbox_home, 'VirtualBox.xml')):
+            tag = _tag(elem)
+            if tag == 'MachineEntry':
+                machines.append(_location(vbox_home, elem.get('src', '')))
+            elif tag == 'HardDisk':
+                media[_uuid(elem.get('uuid', ''))] = _location(vbox_home, elem.get('location', ''))
+    except (OSError, ET.ParseError) as e:
+        logging.debug("read_registry : %s" % e)
+        return None
+    return machines, media
+
+def read_machine(path, media):
+    """Read the settings of a vm from its .vbox file
+
+    Settings of snapshots are skipped, only the current state is read.
+
+    Args:
+        path (str): .vbox file path
+        media (dict): media uuid to location from read_registry()
+    """
+    vm = VmInfo()
+    vm.config = path
+    vm.cpus = "1"
+    vm.vram = "8"
+    vm.monitorcount = "1"
+    vm.extradata = {}
+    media = dict(media)
+    base = os.path.dirname(path)
+    snapshot = 0  # depth of <Snapshot> being skipped
+    adapter = ""
+    attachments = []  # [controller, port, device, type, uuid]
+    try:
+        for event, elem in ET.iterparse(path, events=('start', 'end')):
+            tag = _tag(elem)
+            if tag == 'Snapshot':
+                snapshot += 1 if event == 'start' else -1
+                continue
+            if event == 'end':
+                if tag == 'HardDisk':
+                    media[_uuid(elem.get('uuid', ''))] = _location(base, elem.get('location', ''))
+                continue
+            if tag == 'Machine':
+                vm.name = elem.get('name', '')
+                vm.uuid = _uuid(elem.get('uuid', ''))
+                ostype = elem.get('OSType', '')
+                vm.ostype = OS_DESCRIPTIONS.get(ostype, ostype)
+                if elem.get('stateFile'):
+                    vm.state = "saved"
+                elif elem.get('aborted') == "true":
+                    vm.state = "aborted"
+                else:
+                    vm.state = "poweroff"
+            elif snapshot:
+                continue
+            elif tag == 'Memory':
+                vm.memory = elem.get('RAMSize', '')
+            elif tag == 'CPU':
+                vm.cpus = elem.get('count', '1')
+            elif tag == 'Display':
+                vm.vram = elem.get('VRAMSize', '8')
+                vm.monitorcount = elem.get('monitorCount', '1')
+            elif tag == 'StorageController':
+                vm.controllers.append([elem.get('name', ''), elem.get('type', '')])
+            elif tag == 'AttachedDevice':
+                attachments.append([vm.controllers[-1][0] if vm.controllers else "", elem.get('port', '0'),
+                                    elem.get('device', '0'), elem.get('type', ''), ""])
+            elif tag == 'Image' and attachments:
+                attachments[-1][4] = _uuid(elem.get('uuid', ''))
+            elif tag == 'Adapter':
+                adapter = elem.get('slot', '')
+            elif tag == 'Forwarding' and adapter == '0':
+                vm.natrules.append([elem.get('name', ''), PROTOCOLS.get(elem.get('proto', '1'), ''),
+                                    elem.get('hostip', ''), elem.get('hostport', ''),
+                                    elem.get('guestip', ''), elem.get('guestport', '')])
+            elif tag == 'ExtraDataItem':
+                vm.extradata[elem.get('name', '')] = elem.get('value', '')
+    except (OSError, ET.ParseError) as e:
+        logging.debug("read_machine %s : %s" % (path, e))
+        return None
+    vm.attachments = [[c, p, d, media.get(u, ""), u] for c, p, d, t, u in attachments
+                      if t == "HardDisk"]
+    return vm
+
+def read_inventory(vbox_home):
+    """Read all the registered vms
+
+    Args:
+        vbox_home (str): directory of VirtualBox.xml
+    """
+    registry = read_registry(vbox_home)
+    if registry is None:
+        return None
+    machines, media = registry
+    vms = []
+    for path in machines:
+        vm = read_machine(path, media)
+        if vm is None:
+            return None
+        vms.append(vm)
+    return vms
+
+def get_running_vms():
+    """Get the names and uuids of the running vms from the VM processes
+
+    VirtualBoxVM and VBoxHeadless are started with '--startvm <uuid>'.
+    Only supported on Linux, returns None elsewhere.
+    """
+    if platform.system() != 'Linux' or not os.path.isdir('/proc'):
+        return None
+    running = set()
+    uid = os.getuid()
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            if os.stat('/proc/' + pid).st_uid != uid:
+                continue
+            with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                args = f.read().split(b'\0')
+        except OSError:
+            continue
+        if b'--startvm' in args[:-1]:
+            running.add(args[args.index(b'--startvm') + 1].decode('utf-8', 'replace'))
+    return running
@@ -0,0 +1,257 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Streaming conversion of raw disk images to vmdk.
+
+A webOS OSE build is a raw .wic disk image, often compressed. The image
+is decompressed in a stream and written as a monolithicSparse vmdk
+without a temporary raw file. Grains of zeros are not written, so the
+vmdk only takes the space of the data.
+
+The grains are written from the first grain boundary, the grain tables
+and the grain directory after the last grain and the header with the
+descriptor at last, when the capacity is known. VBoxManage convertfromraw
+can be used instead when the size of the raw image is known up front.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import struct
+import sys
+import threading
+import time
+import uuid as uuidlib
+from subprocess import DEVNULL
+
+from webos_emulator import runner
+from webos_emulator.check import get_stderr, get_vboxm
+
+SECTOR = 512
+GRAIN_SECTORS = 128  # 64 KiB grains
+GRAIN = GRAIN_SECTORS * SECTOR
+ZERO_GRAIN = bytes(GRAIN)
+GTES_PER_GT = 512
+READ_CHUNK = 16 * GRAIN  # bytes read from the decompressor at once
+PROGRESS_INTERVAL = 1.0  # seconds between the progress reports
+
+SPARSE_MAGIC = 0x564d444b  # 'KDMV'
+# magic, version, flags, capacity, grain size, descriptor offset, descriptor size, GTEs per GT,
+# redundant grain directory offset, grain directory offset, overhead, unclean shutdown,
+# newline detection characters, compression, padding
+SPARSE_HEADER = struct.Struct('<IIIQQQQIQQQB4sH433x')
+DESCRIPTOR_OFFSET = 1  # sectors
+DESCRIPTOR_SECTORS = 20
+
+DECOMPRESSORS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def open_image(path):
+    """Open a raw image, a .gz, .bz2 or .xz image is decompressed while it is read"""
+    return DECOMPRESSORS.get(os.path.splitext(path)[1].lower(), open)(path, "rb")
+
+def get_output_name(path):
+    """Get the vmdk name of a raw image, e.g. webos-image.wic.vmdk of webos-image.wic.xz"""
+    name = os.path.basename(path)
+    base, ext = os.path.splitext(name)
+    if ext.lower() in DECOMPRESSORS:
+        name = base
+    return name + ".vmdk"
+
+def make_descriptor(capacity, extent):
+    """Make the descriptor of a monolithicSparse vmdk
+
+    Args:
+        capacity (int): sectors of the disk
+        extent (str): file name of the vmdk
+    """
+    cylinders = min(capacity // (16 * 63), 16383)
+    return ("# Disk DescriptorFile\n"
+            "version=1\n"
+            "CID=%08x\n"
+            "parentCID=ffffffff\n"
+            'createType="monolithicSparse"\n'
+            "\n"
+            "# Extent description\n"
+            'RW %d SPARSE "%s"\n'
+            "\n"
+            "# The disk Data Base\n"
+            "#DDB\n"
+            'ddb.virtualHWVersion = "4"\n'
+            'ddb.adapterType = "ide"\n'
+            'ddb.geometry.cylinders = "%d"\n'
+            'ddb.geometry.heads = "16"\n'
+            'ddb.geometry.sectors = "63"\n'
+            'ddb.uuid.image = "%s"\n'
+            % (uuidlib.uuid4().int & 0xffffffff, capacity, extent, cylinders, uuidlib.uuid4())).encode("ascii")
+
+class Progress:
+    """Report the bytes read and written with the throughput"""
+
+    def __init__(self, total=None, stream=sys.stderr):
+        self.total = total
+        self.stream = stream
+        self.read = 0
+        self.written = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def update(self, read, written):
+        self.read += read
+        self.written += written
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            self.report(end="\r" if self.stream.isatty() else "\n")
+
+    def report(self, end="\n"):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        total = " of %d MiB" % (self.total // 2 ** 20) if self.total else ""
+        self.stream.write("webos-emulator : %d MiB%s read, %d MiB written, %.1f MiB/s%s"
+                          % (self.read // 2 ** 20, total, self.written // 2 ** 20,
+                             self.read / 2 ** 20 / elapsed, end))
+        self.stream.flush()
+
+class SparseVmdkWriter:
+    """Write a raw disk stream as a monolithicSparse vmdk which skips the grains of zeros"""
+
+    def __init__(self, path, name=None):
+        """Construct a :class:`SparseVmdkWriter <SparseVmdkWriter>`.
+
+        :param str path:
+            vmdk file to write.
+        :param str name:
+            file name of the extent in the descriptor, the name of path if None.
+        """
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self._file = open(path, "wb")
+        self._gtes = []  # sector of every grain, 0 if it is not allocated
+        self._next = GRAIN_SECTORS  # sector of the next grain, the first grain has the header
+        self._pending = b""
+        self.written = 0  # bytes of the grains written
+
+    def write(self, data):
+        """Write the next bytes of the raw disk
+
+        Returns:
+            bytes written to the file
+        """
+        data = self._pending + data if self._pending else data
+        full = len(data) - len(data) % GRAIN
+        written = 0
+        for offset in range(0, full, GRAIN):
+            written += self._write_grain(data[offset:offset + GRAIN])
+        self._pending = data[full:]
+        return written
+
+    def _write_grain(self, grain):
+        if grain == ZERO_GRAIN:
+            self._gtes.append(0)
+            return 0
+        self._file.seek(self._next * SECTOR)
+        self._file.write(grain)
+        self._gtes.append(self._next)
+        self._next += GRAIN_SECTORS
+        self.written += GRAIN
+        return GRAIN
+
+    def close(self):
+        """Write the rest of the disk, the grain tables, the grain directory and the header
+
+        Returns:
+            capacity in sectors
+        """
+        capacity = len(self._gtes) * GRAIN_SECTORS
+        if self._pending:
+            capacity += -(-len(self._pending) // SECTOR)
+            self._write_grain(self._pending.ljust(GRAIN, b"\0"))
+            self._pending = b""
+        tables = -(-len(self._gtes) // GTES_PER_GT) or 1
+        gtes = self._gtes + [0] * (tables * GTES_PER_GT - len(self._gtes))
+        gd_sectors = -(-tables * 4 // SECTOR)
+        gd_offset = self._next
+        gt_offset = gd_offset + gd_sectors
+        gt_sectors = GTES_PER_GT * 4 // SECTOR
+        directory = struct.pack("<%dI" % tables, *[gt_offset + i * gt_sectors for i in range(tables)])
+        self._file.seek(gd_offset * SECTOR)
+        self._file.write(directory.ljust(gd_sectors * SECTOR, b"\0"))
+        self._file.write(struct.pack("<%dI" % len(gtes), *gtes))
+        descriptor = make_descriptor(capacity, self.name)
+        header = SPARSE_HEADER.pack(SPARSE_MAGIC, 1, 1, capacity, GRAIN_SECTORS, DESCRIPTOR_OFFSET,
+                                    DESCRIPTOR_SECTORS, GTES_PER_GT, 0, gd_offset, GRAIN_SECTORS, 0,
+                                    b"\n \r\n", 0)
+        self._file.seek(0)
+        self._file.write(header + descriptor.ljust(DESCRIPTOR_SECTORS * SECTOR, b"\0"))
+        self._file.close()
+        return capacity
+
+    def discard(self):
+        """Close and remove the unfinished vmdk"""
+        self._file.close()
+        os.remove(self.path)
+
+def convert(source, output, size=None):
+    """Convert a raw image to a sparse vmdk in a stream
+
+    Args:
+        source (str): .wic image, or .wic.gz, .wic.bz2 or .wic.xz
+        output (str): vmdk file
+        size (int): bytes of the raw image for the progress, None if not known
+
+    Returns:
+        Progress of the conversion
+    """
+    progress = Progress(size)
+    writer = SparseVmdkWriter(output + ".tmp", os.path.basename(output))
+    try:
+        with open_image(source) as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                progress.update(len(chunk), writer.write(chunk))
+        writer.close()
+        progress.written = writer.written
+    except BaseException:
+        writer.discard()
+        raise
+    os.replace(output + ".tmp", output)
+    return progress
+
+def convert_by_vboxmanage(source, output, size):
+    """Convert a raw image to a vmdk by 'VBoxManage convertfromraw stdin' in a stream
+
+    Args:
+        source (str): .wic image, or .wic.gz, .wic.bz2 or .wic.xz
+        output (str): vmdk file
+        size (int): bytes of the raw image, which convertfromraw needs up front
+
+    Returns:
+        Progress of the conversion, None if VBoxManage failed
+    """
+    progress = Progress(size)
+    rfd, wfd = os.pipe()
+    errors = []
+
+    def feed():
+        try:
+            # the pipe is closed first, so VBoxManage ends also if the image can not be read
+            with os.fdopen(wfd, "wb") as pipe, open_image(source) as f:
+                for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                    pipe.write(chunk)
+                    progress.update(len(chunk), 0)
+        except (OSError, EOFError, lzma.LZMAError) as e:  # also a closed pipe if VBoxManage failed
+            errors.append(e)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        ret = runner.call([get_vboxm(), 'convertfromraw', 'stdin', output, str(size), '--format', 'VMDK'],
+                          stdin=rfd, stdout=DEVNULL, stderr=get_stderr())
+    finally:
+        os.close(rfd)
+        feeder.join()
+    if ret != 0 or errors:
+        return None
+    progress.written = os.path.getsize(output)
+    return progress
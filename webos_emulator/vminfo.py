@@ -0,0 +1,163 @@
+"""
+  Copyright (c) 2024 LG Electronics Inc.
+  SPDX-License-Identifier: MIT
+"""
+
+"""Settings and state of a vm.
+
+:class:`VmInfo <VmInfo>` is parsed once from 'showvminfo --machinereadable'
+(or the .vbox file) and shared by every query of a command.
+"""
+
+import re
+
+RUNNING_STATES = ("running", "paused", "stuck")
+# fields of showvminfo which are the same for every vd, see add_common_settings()
+OPTIONS = ("ioapic", "graphicscontroller", "accelerate3d", "hidpointing", "audio", "audio_out", "audio_in",
+           "nic1", "uart1", "uartmode1", "boot1", "boot2", "boot3", "boot4")
+
+class VmInfo:
+    """Settings and state of a vm"""
+
+    __slots__ = ("name", "uuid", "ostype", "state", "config", "memory", "cpus", "vram",
+                 "monitorcount", "controllers", "attachments", "natrules", "extradata", "options")
+
+    def __init__(self, name: str = "", uuid: str = ""):
+        """Construct a :class:`VmInfo <VmInfo>`.
+
+        :param str name:
+            A vm name.
+        :param str uuid:
+            A vm uuid.
+        """
+        self.name = name
+        self.uuid = uuid
+        self.ostype = ""
+        self.state = ""
+        self.config = ""  # .vbox file path
+        self.memory = ""
+        self.cpus = ""
+        self.vram = ""
+        self.monitorcount = ""
+        self.controllers = []  # [name, type]
+        self.attachments = []  # [controller, port, device, location, uuid]
+        self.natrules = []  # [name, protocol, hostip, hostport, guestip, guestport] of nic1
+        self.extradata = None  # dict, None if it is not read
+        self.options = None  # dict of the OPTIONS fields, None if it is not read
+
+    @property
+    def storage(self):
+        """Return the first storage controller name"""
+        return self.controllers[0][0] if self.controllers else ""
+
+    @property
+    def running(self):
+        """Return True if the vm is running"""
+        return self.state in RUNNING_STATES
+
+    def medium(self, controller, port="0", device="0"):
+        """Return (location, uuid) of the medium attached to the given port
+
+        Args:
+            controller (str): storage controller name
+            port (str): port number
+            device (str): device number
+        """
+        for c, p, d, location, uuid in self.attachments:
+            if (c, p, d) == (controller, port, device):
+                return location, uuid
+        return "", ""
+
+    def settings(self):
+        """Return (label, value) of the settings shown by 'webos-emulator -m'"""
+        settings = [("Name", self.name), ("Guest OS", self.ostype),
+                    ("Memory size", self.memory + "MB"), ("Number of CPUs", self.cpus),
+                    ("VRAM size", self.vram + "MB"), ("Monitor count", self.monitorcount)]
+        location, uuid = self.medium(self.storage)
+        if location:
+            settings.append(("%s (0, 0)" % self.storage, "%s (UUID: %s)" % (location, uuid) if uuid else location))
+        return settings
+
+    def to_dict(self):
+        """Return a dict to save as json"""
+        return {i: getattr(self, i) for i in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Make a :class:`VmInfo <VmInfo>` from to_dict()"""
+        vm = cls()
+        for i in cls.__slots__:
+            if i in data:
+                setattr(vm, i, data[i])
+        return vm
+
+def _unquote(value):
+    """Return the value of a machinereadable field without quotes"""
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+def _split(line):
+    """Split a machinereadable line to key and value"""
+    if line.startswith('"'):
+        end = line.find('"=', 1)
+        while end > 0 and line[end - 1] == '\\':
+            end = line.find('"=', end + 1)
+        if end < 0:
+            return None, None
+        return _unquote(line[:end + 1]), _unquote(line[end + 2:])
+    key, sep, value = line.partition("=")
+    if not sep:
+        return None, None
+    return key, _unquote(value)
+
+def parse_machinereadable(text):
+    """Parse the output of 'showvminfo --machinereadable'
+
+    Args:
+        text (str): output of showvminfo
+    """
+    fields = {}
+    order = []
+    for line in text.splitlines():
+        key, value = _split(line)
+        if key is not None:
+            fields[key] = value
+            order.append(key)
+
+    vm = VmInfo(fields.get("name", ""), fields.get("UUID", ""))
+    vm.ostype = fields.get("ostype", "")
+    vm.state = fields.get("VMState", "")
+    vm.config = fields.get("CfgFile", "")
+    vm.memory = fields.get("memory", "")
+    vm.cpus = fields.get("cpus", "")
+    vm.vram = fields.get("vram", "")
+    vm.monitorcount = fields.get("monitorcount", "1")
+    vm.options = {key: fields[key] for key in OPTIONS if key in fields}
+    i = 0
+    while "storagecontrollername%d" % i in fields:
+        vm.controllers.append([fields["storagecontrollername%d" % i],
+                               fields.get("storagecontrollertype%d" % i, "")])
+        i += 1
+    for key in order:
+        for controller, ctype in vm.controllers:
+            m = re.match(re.escape(controller) + r"-(\d+)-(\d+)$", key)
+            if m and fields[key] != "none":
+                uuid = fields.get("%s-ImageUUID-%s-%s" % (controller, m.group(1), m.group(2)), "")
+                vm.attachments.append([controller, m.group(1), m.group(2), fields[key], uuid])
+        if re.match(r"Forwarding\(\d+\)$", key):
+            vm.natrules.append(fields[key].split(","))
+    return vm
+
+def parse_extradata(text):
+    """Parse the output of 'getextradata <vm> enumerate'
+
+    Args:
+        text (str): output of getextradata
+    """
+    extradata = {}
+    for line in text.splitlines():
+        m = re.match(r"Key: (.*), Value: (.*)$", line)
+        if m:
+            extradata[m.group(1)] = m.group(2)
+    return extradata
@@ -10,22 +10,102 @@
 import logging
 import subprocess
 import os, platform
+import copy
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import DEVNULL
 from sys import stderr # TODO: check Python 3.3 above
-from webos_emulator import WebosEmulator
+from webos_emulator import WebosEmulator, runner
 from webos_emulator.exceptions import DetachError
+from webos_emulator.plan import CommandPlan
+from webos_emulator.ports import EXTRADATA_PREFIX, PORT_RULES, assign_ports, release_ports
+from webos_emulator.profiles import AUTO_PROFILE, SETTINGS, auto_profile, layer, load_config
+from webos_emulator.vboxxml import OS_DESCRIPTIONS
 import locale
 
 # TODO: set logging level
 STDIN = DEVNULL  # quiet, None for info level
 hostos_encoding = locale.getpreferredencoding()
 
-from webos_emulator.check import detach_image, get_stderr, get_storage_name, get_vboxmanage, is_safe_to_create, is_vd_exists, is_vd_running
-from webos_emulator.check import VBOXM
+from webos_emulator.check import detach_image, find_vd, get_stderr, get_storage_name, get_vboxmanage, get_vminfo, invalidate_inventory, is_safe_to_create, is_vd_exists, is_vd_running
+from webos_emulator.check import get_vboxm
 
 here = os.path.abspath(os.path.dirname(__file__))
-VD_JSON = json.loads(open(os.path.join(here, "webos-emulator.json"), encoding=hostos_encoding).read())
+_vd_json = None  # webos-emulator.json, see get_vd_json()
+FLEET_WORKERS = 8  # number of vds created at the same time
+ACPI_TIMEOUT = 60  # seconds the guest may take to shut down after the ACPI power button
+READY_TIMEOUT = 180  # seconds the guest may take to answer on its ssh port, see ready.py
+FRONTENDS = ("gui", "headless", "separate")  # types of startvm
+
+def get_vd_json():
+    """Get the settings of webos-emulator.json with the user config layered over them
+
+    They are read on the first use, see profiles.layer().
+    """
+    global _vd_json
+    if _vd_json is None:
+        with open(os.path.join(here, "webos-emulator.json"), encoding=hostos_encoding) as f:
+            _vd_json = layer(json.loads(f.read()), load_config())
+    return _vd_json
+
+def get_settings(profile=None, count=1):
+    """Get the settings of the profile layered over the defaults
+
+    Args:
+        profile (str): profile name, the profile of the config if None
+        count (int): number of emulators planned, for the auto profile
+
+    Returns:
+        dict of the settings, None if the profile does not exist
+    """
+    vd_json = get_vd_json()
+    settings = {key: vd_json[key] for key in SETTINGS if vd_json.get(key)}
+    profile = profile or vd_json.get('profile')
+    if not profile:
+        return settings
+    if profile == AUTO_PROFILE:
+        settings.update(auto_profile(count))
+    elif profile in vd_json['profiles']:
+        settings.update({key: str(value) for key, value in vd_json['profiles'][profile].items() if key in SETTINGS})
+    else:
+        print("webos-emulator : unknown profile %s, please use one of %s"
+              % (profile, ", ".join(sorted(vd_json['profiles']) + [AUTO_PROFILE])))
+        return None
+    return settings
+
+def apply_settings(vd: WebosEmulator, settings):
+    """Set the settings of get_settings() to the vd
+
+    Args:
+        vd (WebosEmulator): vd object
+        settings (dict): settings of a profile
+    """
+    for key in SETTINGS:
+        if settings.get(key):
+            setattr(vd, key, str(settings[key]))
+
+def get_frontend(vd: WebosEmulator):
+    """Get the startvm type of the vd, the frontend of webos-emulator.json by default
+
+    Args:
+        vd (WebosEmulator): vd object
+    """
+    frontend = vd.frontend or get_vd_json().get('frontend') or "gui"
+    if frontend not in FRONTENDS:
+        print("webos-emulator : unknown frontend %s, please use one of %s" % (frontend, ", ".join(FRONTENDS)))
+        return "gui"
+    return frontend
+
+def startvm_args(vd: WebosEmulator):
+    """Get the VBoxManage arguments which start the vd
+
+    Args:
+        vd (WebosEmulator): vd object
+    """
+    frontend = get_frontend(vd)
+    # the gui is the default of VBoxManage
+    return ['startvm', vd.name] + (['--type', frontend] if frontend != "gui" else [])
 
 def detach_storage(name):
     """detach the image from the vd
@@ -34,10 +114,10 @@ def detach_storage(name):
         name (str): vd name
     """
     logging.info("detach_storage : %s" % name)
-    vdcmd = VBOXM
+    vdcmd = get_vboxm()
     command = [vdcmd] + ['storageattach', name, '--storagectl', name, '--type',
                          'hdd', '--medium', 'emptydrive', '--port', '0', '--device', '0']
-    if subprocess.call(command, stdin=STDIN, stderr=get_stderr()) == 0:
+    if runner.call(command, stdin=STDIN, stderr=get_stderr()) == 0:
         return True
     else:
         return False
@@ -55,7 +135,7 @@ def attach_storage(vdcmd, name, vdimage):
             storage_name = name
         command = [vdcmd] + ['storageattach', name, '--storagectl', storage_name, '--type',
                              'hdd', '--port', '0', '--device', '0', '--medium', vdimage]
-        subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+        runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
     except subprocess.CalledProcessError as e:
         print("webos-emulator : attach_stroage error")
         logging.debug("attach_storage error : %s" % e)
@@ -69,14 +149,16 @@ def remove_vd(name):
         name (str): vd name
     """
     logging.info("remove_vd : %s" % name)
-    if VBOXM == None:
+    if get_vboxm() == None:
         print("webos-emulator : Please install virtualbox.")
         return False
     
     if is_vd_exists(name):
         detach_storage(name)
-        command = [VBOXM] + ['unregistervm', name, '--delete']
-        if subprocess.call(command, stdin=STDIN, stderr=get_stderr()) == 0:
+        command = [get_vboxm()] + ['unregistervm', name, '--delete']
+        ret = runner.call(command, stdin=STDIN, stderr=get_stderr())
+        invalidate_inventory()
+        if ret == 0:
             return True
         else:
             raise DetachError(vdname=name)
@@ -93,12 +175,17 @@ def modify_vd(vd: WebosEmulator, mstr, newname, vmdk):
         newname : new name of vm
         vmdk : vmdk file
     """
-    if is_vd_running(vd.name):
+    vminfo = get_vminfo(vd.name)
+    if vminfo is None:
+        print("webos-emulator : modify_vd, vd does not exist")
+        return False
+    if vminfo.running:
         print("webos-emulator : vd is running. please stop vd before modify")
         return False
-    storage_name = get_storage_name(vd.name)
-    storage = storage_name + " (0, 0)"
-    settings = ["Memory size", "Monitor count", "Number of CPUs", "VRAM size", "Name", "Guest OS", storage]
+    if vminfo.state == "saved" and (mstr or vmdk):
+        print("webos-emulator : vd has a saved state. please start and kill it without --suspend before modify")
+        return False
+    storage_name = vminfo.storage
 
     tname = vd.name
     if newname:
@@ -117,35 +204,146 @@ def modify_vd(vd: WebosEmulator, mstr, newname, vmdk):
     else:
         try:
             if mstr:
-                command = [VBOXM] + ['modifyvm', vd.name] + mstr.split(":")[:-1]
-                subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+                command = [get_vboxm()] + ['modifyvm', vd.name] + mstr.split(":")[:-1]
+                runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
             if vmdk != "":
-                command = [VBOXM] + ['storageattach', tname, '--storagectl', storage_name, '--type',
+                command = [get_vboxm()] + ['storageattach', tname, '--storagectl', storage_name, '--type',
                         'hdd', '--port', '0', '--device', '0', '--medium', vmdk]
-                subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+                runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
         except subprocess.CalledProcessError as e:
-            print("webos-emulator : modify_vd, set subprocess.Popen error")
+            print("webos-emulator : modify_vd, set VBoxManage error")
             logging.debug("modify error : %s" % e)
             return False
-    command = [VBOXM] + ['showvminfo', tname]
-    try:
-        sp = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        vdinfo, error = sp.communicate()
-    except:
-        print("webos-emulator : modify_vd, get subprocess.Popen error")
-        return False
-    if error:
-       print("webos-emulator : Popen error %s" % error)
-       return False
-    vdinfo = str(vdinfo, hostos_encoding).split('\n')
+        finally:
+            invalidate_inventory()
+        # the settings are known after the modification, they are not queried again
+        values = mstr.split(":")[:-1]
+        for flag, value in zip(values[::2], values[1::2]):
+            if flag == "--ostype":
+                value = OS_DESCRIPTIONS.get(value, value)
+            setattr(vminfo, flag[2:], value)
+        if vmdk != "":
+            vminfo.attachments = [a for a in vminfo.attachments if a[:3] != [storage_name, "0", "0"]]
+            vminfo.attachments.insert(0, [storage_name, "0", "0", os.path.abspath(vmdk), ""])
 
     print("following is the current settings of vd")
-    for i in vdinfo:
-        if i.split(":")[0] in settings:
-            print(i)
+    for label, value in vminfo.settings():
+        print("%-28s %s" % (label + ":", value))
     return True
 
-def create_vd(vd: WebosEmulator):
+def get_port_forwards(vd: WebosEmulator):
+    """get the port forwarding rules of vd
+
+    Args:
+        vd (WebosEmulator): vd object
+
+    Returns:
+        list of (rule name, host port, natpf1 rule)
+    """
+    hostports = {"ssh": vd.hostssh, "web-inspector": vd.hostinspector,
+                 "enact-browser-web-inspector": vd.hostenactinspector}
+    return [(rule, hostports[rule], '%s,tcp,,%s,,%d' % (rule, hostports[rule], guest))
+            for rule, default, guest in PORT_RULES]
+
+def add_port_forwards(plan: CommandPlan, vd: WebosEmulator, replace=False):
+    """add the port forwarding rules of vd to the plan
+
+    Args:
+        plan (CommandPlan): command plan of vd
+        vd (WebosEmulator): vd object
+        replace (bool): delete the existing rules first
+    """
+    for rule, hostport, spec in get_port_forwards(vd):
+        if replace:
+            plan.modifyvm('--natpf1', 'delete', rule)
+        plan.modifyvm('--natpf1', spec)
+        plan.setextradata(EXTRADATA_PREFIX + rule, hostport)
+
+def get_common_settings(boot=False):
+    """get the settings which are the same for every vd
+
+    Args:
+        boot (bool): also the boot order from the disk
+
+    Returns:
+        list of (showvminfo field, value, modifyvm flags)
+    """
+    if platform.system() == 'Windows':
+        audio, null = 'dsound', 'null'
+    elif platform.system() == 'Darwin':
+        audio, null = 'coreaudio', '/dev/null'
+    else:
+        audio, null = 'pulse', '/dev/null'
+    settings = [('ioapic', 'on', ['--ioapic', 'on']),
+                # graphics stuffs
+                ('graphicscontroller', 'vmsvga', ['--graphicscontroller', 'vmsvga']),
+                ('accelerate3d', 'on', ['--accelerate3d', 'on']),
+                # usb tablet and sound
+                ('hidpointing', 'usbtablet', ['--mouse', 'usbtablet']),
+                ('audio', audio, ['--audio', audio]),
+                ('audio_out', 'on', ['--audioout', 'on']),
+                ('audio_in', 'on', ['--audioin', 'on']),
+                # network
+                ('nic1', 'nat', ['--nic1', 'nat']),
+                # serial to null
+                ('uart1', '0x03f8,4', ['--uart1', '0x3f8', '4']),
+                ('uartmode1', 'file,' + null, ['--uartmode1', 'file', null])]
+    if boot:
+        settings += [('boot%d' % i, device, ['--boot%d' % i, device])
+                     for i, device in enumerate(('disk', 'none', 'none', 'none'), 1)]
+    return settings
+
+def add_common_settings(plan: CommandPlan):
+    """add the settings which are the same for every vd to the plan
+
+    Args:
+        plan (CommandPlan): command plan of vd
+    """
+    for field, value, flags in get_common_settings():
+        plan.modifyvm(*flags)
+
+def add_default_settings(plan: CommandPlan, vd: WebosEmulator, monitorcount=None, scalefactor=None):
+    """add the default settings of vd to the plan
+
+    Args:
+        plan (CommandPlan): command plan of vd
+        vd (WebosEmulator): vd object
+        monitorcount : number of monitors instead of vd.monitorcount
+        scalefactor : scale factor instead of vd.scalefactor
+    """
+    add_common_settings(plan)
+
+    # setting memory, videoram and cpu
+    plan.modifyvm('--memory', vd.ram, '--vram', vd.vram, '--cpus', vd.cpus)
+
+    # setting port forwarding
+    add_port_forwards(plan, vd)
+
+    # monitor and scale factor
+    plan.modifyvm('--monitorcount', monitorcount or vd.monitorcount)
+    plan.setextradata('GUI/ScaleFactor', scalefactor or vd.scalefactor)
+
+    # set signature
+    plan.setextradata('wemul', 'ose')
+
+def create_plan(vd: WebosEmulator):
+    """make the command plan to create a vd
+
+    Args:
+        vd (WebosEmulator): vd object
+    """
+    name = vd.name
+    plan = CommandPlan(name)
+    plan.command('createvm', '--ostype', 'Linux_64', '--register', '--name', name)
+    plan.command('storagectl', name, '--add', 'ide', '--name', name)
+    plan.modifyvm('--boot1', 'disk', '--boot2', 'none', '--boot3', 'none', '--boot4', 'none')
+    add_default_settings(plan, vd)
+    if vd.image: # TODO: just create a vd without an image?
+        plan.command('storageattach', name, '--storagectl', name, '--type',
+                     'hdd', '--port', '0', '--device', '0', '--medium', vd.image, after=True)
+    return plan
+
+def create_vd(vd: WebosEmulator, dry_run=False):
     """create a vd
     
     Temporal method for create vd.
@@ -153,8 +351,24 @@ def create_vd(vd: WebosEmulator):
 
     Args:
         vd (WebosEmulator): vd object
+        dry_run (bool): print the commands without running them
     """
+    from webos_emulator.images import check_image, resolve_image
     name = vd.name
+    if vd.image and not os.path.isfile(vd.image):
+        vd.image = resolve_image(vd.image) or vd.image  # a tag or digest of a stored image
+    if vd.image and not dry_run:
+        # the image is checked before the vd is made, not by the failure of storageattach
+        message = check_image(vd.image, name)
+        if message:
+            print("webos-emulator : " + message)
+            return False
+    assign_ports(vd, dry_run)
+    plan = create_plan(vd)
+    if dry_run:
+        plan.show(get_vboxm())
+        return True
+
     if is_safe_to_create(name):
         logging.info("%s is safe to create." % name)
         try:
@@ -166,73 +380,83 @@ def create_vd(vd: WebosEmulator):
         # TODO: error handling
         return False
     
-    # TODO: error handling
-    try:
-        logging.info("creating vd....")
-        command = [VBOXM] + ['createvm', '--ostype', 'Linux_64', '--register', '--name', name]
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['storagectl', name, '--add', 'ide', '--name', name]
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--boot1', 'disk', '--boot2', 'none', '--boot3', 'none', '--boot4', 'none']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # setting memory, videoram and cpu
-        command = [VBOXM] + ['modifyvm', name, '--memory', vd.ram, '--vram', vd.vram, '--ioapic', 'on', '--cpus', vd.cpus]
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # setting graphics stuffs
-        command = [VBOXM] + ['modifyvm', name, '--graphicscontroller', 'vmsvga']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--accelerate3d', 'on']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # set usb tablet and sound
-        if platform.system() == 'Windows':
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'dsound', '--audioout', 'on', '--audioin', 'on']
-        elif platform.system() == 'Darwin':
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'coreaudio', '--audioout', 'on', '--audioin', 'on']
-        else:
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'pulse', '--audioout', 'on', '--audioin', 'on']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # setting network
-        command = [VBOXM] + ['modifyvm', name, '--nic1', 'nat', '--natpf1', 'ssh,tcp,,'+ vd.hostssh  +',,22']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--natpf1', 'web-inspector,tcp,,9998,,9998']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--natpf1', 'enact-browser-web-inspector,tcp,,9223,,9999']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # serial to null
-        if platform.system() == 'Windows':
-            command = [VBOXM] + ['modifyvm', name, '--uart1', '0x3f8', '4', '--uartmode1', 'file', 'null']
-        else:
-            command = [VBOXM] + ['modifyvm', name, '--uart1', '0x3f8', '4', '--uartmode1', 'file', '/dev/null']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # two display
-        command = [VBOXM] + ['modifyvm', name, '--monitorcount', '2']
-        subprocess.check_call(command, stdin=STDIN)
-        
-        # scale factor to 0.7
-        command = [VBOXM] + ['setextradata', name, 'GUI/ScaleFactor', '0.7']
-        subprocess.check_call(command, stdin=STDIN)
+    logging.info("creating vd....")
+    return run_create_plan(plan)
 
-        # set signature
-        command = [VBOXM] + ['setextradata', name, 'wemul', 'ose']
-        subprocess.check_call(command, stdin=STDIN)
+def run_create_plan(plan: CommandPlan):
+    """run the command plan made by create_plan
 
+    Args:
+        plan (CommandPlan): command plan of vd
+    """
+    try:
+        plan.run(get_vboxm())
     except subprocess.CalledProcessError as e:
+        invalidate_inventory()
+        if e.cmd[1] == 'storageattach':
+            print("webos-emulator : The vmdk file is already attached. Please use a new vmdk")
+            remove_vd(plan.name)
+            release_ports(plan.name)
+            return False
         print("webos-emulator : creation error")
         logging.debug("creation error : %s" % e)
         return False
-    else: # creation success
-        if vd.image: # TODO: just create a vd without an image?
-            if attach_storage(VBOXM, name, vd.image) == False:
-                print("webos-emulator : The vmdk file is already attached. Please use a new vmdk")
-                remove_vd(name)
-                return False
+    invalidate_inventory()
     return True
+
+def create_fleet(vd: WebosEmulator, names, dry_run=False):
+    """create vds which share one image
+
+    The image is set to multiattach type once, then VirtualBox gives each
+    vd its own differencing disk when the image is attached, so the image
+    is neither copied nor changed by the vds. The vds are created
+    concurrently.
+
+    Args:
+        vd (WebosEmulator): vd object which has the settings and the image
+        names (list): names of vds to create
+        dry_run (bool): print the commands without running them
+
+    Returns:
+        list of the names of created vds
+    """
+    if not vd.image:
+        print("webos-emulator : Please specify a vmdk to share with -i <file>")
+        return []
+    vds = []
+    for name in names:
+        fvd = copy.copy(vd)
+        fvd.name = name
+        assign_ports(fvd, dry_run)
+        vds.append(fvd)
+    share = CommandPlan(vd.image)
+    share.command('modifymedium', 'disk', vd.image, '--type', 'multiattach')
+    if dry_run:
+        share.show(get_vboxm())
+        for fvd in vds:
+            create_plan(fvd).show(get_vboxm())
+        return names
+
+    for name in names:
+        if not is_safe_to_create(name):
+            print("webos-emulator : %s is running. please stop vd before create" % name)
+            return []
+        try:
+            remove_vd(name)
+        except DetachError as e:
+            logging.error("webos-emulator error : %s" % e)
+            return []
+    try:
+        share.run(get_vboxm())
+    except subprocess.CalledProcessError as e:
+        print("webos-emulator : The vmdk file is attached to a vd. Please delete the vd before sharing it")
+        logging.debug("modifymedium error : %s" % e)
+        return []
+
+    logging.info("creating %d vds...." % len(vds))
+    with ThreadPoolExecutor(max_workers=min(len(vds), FLEET_WORKERS)) as pool:
+        results = list(pool.map(run_create_plan, [create_plan(fvd) for fvd in vds]))
+    return [name for name, ok in zip(names, results) if ok]
         
 def start_vd(vd: WebosEmulator):
     """start a vd
@@ -263,14 +487,22 @@ def start_vd(vd: WebosEmulator):
                     print("webos-emulator : please check installation of SIGNAGE Emulator")
                     return False
             else:
-                command = [VBOXM] + ['startvm', vd.name]
+                command = [get_vboxm()] + startvm_args(vd)
             
             if vd.product == "ose":
-                if subprocess.call(command, stdin=STDIN , stdout=subprocess.DEVNULL,  stderr=get_stderr()) != 0:
+                # startvm restores the saved state of a vd stopped by savestate
+                vminfo = find_vd(vd.name)
+                resume = vminfo is not None and vminfo.state == "saved"
+                started = time.monotonic()
+                ret = runner.call(command, stdin=STDIN , stdout=subprocess.DEVNULL,  stderr=get_stderr())
+                invalidate_inventory()
+                if ret != 0:
                     print("webos-emulator : TV Emulator is needed")
                     return False
+                print("webos-emulator : %s is %s in %.1f seconds" % (vd.name, "resumed from the saved state" if resume
+                                                                      else "started", time.monotonic() - started))
             else:
-                if subprocess.call(command, stdin=STDIN , stdout=subprocess.DEVNULL,  shell=True, stderr=get_stderr()) != 0:
+                if runner.call(command, stdin=STDIN , stdout=subprocess.DEVNULL,  shell=True, stderr=get_stderr()) != 0:
                     print("webos-emulator : start error")
                     return False
     else:
@@ -278,29 +510,52 @@ def start_vd(vd: WebosEmulator):
         return False
     return True
 
-def stop_vd(vd: WebosEmulator):
+def stop_vd(vd: WebosEmulator, suspend=False):
     """stop a vd
 
     Args:
         vd (WebosEmulator): vd object
+        suspend (bool): save the state instead of powering off, the next start resumes it
     """
     if is_vd_exists(vd.name):
         if is_vd_running(vd.name):
+            started = time.monotonic()
             try:
-                command = [VBOXM] + ['controlvm', vd.name, 'pause']
-                subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
-                command = [VBOXM] + ['controlvm', vd.name, 'poweroff']
-                subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+                if suspend:
+                    command = [get_vboxm()] + ['controlvm', vd.name, 'savestate']
+                    runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+                else:
+                    command = [get_vboxm()] + ['controlvm', vd.name, 'pause']
+                    runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+                    command = [get_vboxm()] + ['controlvm', vd.name, 'poweroff']
+                    runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
             except subprocess.CalledProcessError as e:
                 print("webos-emulator : stop error")
                 logging.debug("power off error : %s" % e)
                 return False
+            finally:
+                invalidate_inventory()
+            print("webos-emulator : %s is %s in %.1f seconds" % (vd.name, "saved" if suspend else "powered off",
+                                                                 time.monotonic() - started))
             return True
         else:
             print("webos-emulator : vd is not running.")
             return False
     return False
 
+def is_own_disk(name):
+    """Check the disk attached to the vd is a differencing disk made for it
+
+    Args:
+        name (str): vd name
+    """
+    vminfo = get_vminfo(name)
+    if vminfo is None:
+        return False
+    from webos_emulator.images import is_differencing
+    location, uuid = vminfo.medium(vminfo.storage)
+    return bool(location) and is_differencing(uuid or location)
+
 def delete_vd(vd: WebosEmulator):
     """delete a vd
 
@@ -309,127 +564,127 @@ def delete_vd(vd: WebosEmulator):
     """
     if is_vd_exists(vd.name):
         if not is_vd_running(vd.name):
-            if detach_image(vd.name):
-                command = [VBOXM] + ['unregistervm', vd.name, '--delete']
-                if subprocess.call(command, stdin=STDIN, stderr=get_stderr()) != 0:
+            # the image given by user is detached to keep it, but the differencing
+            # disk of a linked clone is deleted with the vd
+            if is_own_disk(vd.name) or detach_image(vd.name):
+                command = [get_vboxm()] + ['unregistervm', vd.name, '--delete']
+                ret = runner.call(command, stdin=STDIN, stderr=get_stderr())
+                invalidate_inventory()
+                if ret != 0:
                     logging.error("webos-emulator error : delete_vd failed")
                     logging.debug("reason : unregistervm failed ")
+                else:
+                    release_ports(vd.name)
             else:
                 print("webos-emulator : delete_vd failed")
         else:
             print("webos-emulator : vd is running. please stop vd before delete")
 
-def set_default(vd: WebosEmulator, extended):
-    """set default values
+def default_plan(vd: WebosEmulator, vminfo, extended):
+    """make the command plan which sets only the default values which differ from the vd
 
     Args:
         vd (WebosEmulator): vd object
+        vminfo (VmInfo): current settings of vd with the extra data and the options
         exteneded : function extended for vs code extension integration
+
+    Returns:
+        (plan, changes), changes is a list of (setting, current value, new value)
     """
     name = vd.name
-    try:
-        logging.info("set default....")
-        #command = [VBOXM] + ['modifyvm', name, '--ostype', 'Linux_64']
-        #subprocess.check_call(command, stdin=STDIN)
-
-        if extended:
-            command = [VBOXM] + ['storagectl', name, '--add', 'ide', '--name', name]
-            subprocess.check_call(command, stdin=STDIN)
-            command = [VBOXM] + ['modifyvm', name, '--boot1', 'disk', '--boot2', 'none', '--boot3', 'none', '--boot4', 'none']
-            subprocess.check_call(command, stdin=STDIN)
-            if vd.vmdkfile:
-                command = [VBOXM] + ['storageattach', name, '--storagectl', name, '--type',
-                         'hdd', '--port', '0', '--device', '0', '--medium', vd.vmdkfile]
-                subprocess.check_call(command, stdin=STDIN)
-
-        # setting memory, videoram and cpu
-        command = [VBOXM] + ['modifyvm', name, '--memory', vd.ram, '--vram', vd.vram, '--ioapic', 'on', '--cpus', vd.cpus]
-        subprocess.check_call(command, stdin=STDIN)
-
-        # setting graphics stuffs
-        command = [VBOXM] + ['modifyvm', name, '--graphicscontroller', 'vmsvga']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--accelerate3d', 'on']
-        subprocess.check_call(command, stdin=STDIN)
-
-        # set usb tablet and sound
-        if platform.system() == 'Windows':
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'dsound', '--audioout', 'on', '--audioin', 'on']
-        elif platform.system() == 'Darwin':
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'coreaudio', '--audioout', 'on', '--audioin', 'on']
-        else:
-            command = [VBOXM] + ['modifyvm', name, '--mouse', 'usbtablet', '--audio', 'pulse', '--audioout', 'on', '--audioin', 'on']
-        subprocess.check_call(command, stdin=STDIN)
-
-        # remove network
-        #sp = subprocess.Popen([command, '-version'], stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        #version, error = sp.communicate()
-
-        try:
-            command = [VBOXM] + ['modifyvm', name, '--nic1', 'nat', '--natpf1', 'delete', 'ssh']
-            subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr()) # virtualbox7 needs "stderr=get_stderr()"
-        except:
-            pass
-        try:
-            command = [VBOXM] + ['modifyvm', name, '--nic1', 'nat', '--natpf1', 'delete', 'web-inspector']
-            subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
-        except:
-            pass
-        try:
-            command = [VBOXM] + ['modifyvm', name, '--nic1', 'nat', '--natpf1', 'delete', 'enact-browser-web-inspector']
-            subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
-        except:
-            pass
-
-        # setting network
-        command = [VBOXM] + ['modifyvm', name, '--nic1', 'nat', '--natpf1', 'ssh,tcp,,'+ vd.hostssh  +',,22']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--natpf1', 'web-inspector,tcp,,9998,,9998']
-        subprocess.check_call(command, stdin=STDIN)
-        command = [VBOXM] + ['modifyvm', name, '--natpf1', 'enact-browser-web-inspector,tcp,,9223,,9999']
-        subprocess.check_call(command, stdin=STDIN)
-
-        # serial to null
-        if platform.system() == 'Windows':
-            command = [VBOXM] + ['modifyvm', name, '--uart1', '0x3f8', '4', '--uartmode1', 'file', 'null']
-        else:
-            command = [VBOXM] + ['modifyvm', name, '--uart1', '0x3f8', '4', '--uartmode1', 'file', '/dev/null']
-        subprocess.check_call(command, stdin=STDIN)
-
-        # monitor
-        if extended:
-            command = [VBOXM] + ['modifyvm', name, '--monitorcount', vd.monitorcount]
-        else:
-            command = [VBOXM] + ['modifyvm', name, '--monitorcount', '2']
-        subprocess.check_call(command, stdin=STDIN)
-
-        # scale factor to 0.7
-        if extended:
-            command = [VBOXM] + ['setextradata', name, 'GUI/ScaleFactor', vd.scalefactor]
-        else:
-            command = [VBOXM] + ['setextradata', name, 'GUI/ScaleFactor', '0.7']
-        subprocess.check_call(command, stdin=STDIN)
+    plan = CommandPlan(name)
+    changes = []
+    extradata = vminfo.extradata or {}
+    monitorcount, scalefactor = (vd.monitorcount, vd.scalefactor) if extended else ('2', '0.7')
+    if extended:
+        if not any(controller == name for controller, ctype in vminfo.controllers):
+            plan.command('storagectl', name, '--add', 'ide', '--name', name)
+            changes.append(("Storage controller", "", name))
+        location, uuid = vminfo.medium(name)
+        if vd.vmdkfile and location != os.path.abspath(vd.vmdkfile):
+            plan.command('storageattach', name, '--storagectl', name, '--type',
+                         'hdd', '--port', '0', '--device', '0', '--medium', vd.vmdkfile)
+            changes.append(("%s (0, 0)" % name, location, vd.vmdkfile))
+
+    options = vminfo.options or {}
+    for field, value, flags in get_common_settings(extended):
+        if options.get(field, "") != value:
+            plan.modifyvm(*flags)
+            changes.append((field, options.get(field, ""), value))
+
+    for label, flag, current, value in (("Memory size", '--memory', vminfo.memory, vd.ram),
+                                        ("VRAM size", '--vram', vminfo.vram, vd.vram),
+                                        ("Number of CPUs", '--cpus', vminfo.cpus, vd.cpus),
+                                        ("Monitor count", '--monitorcount', vminfo.monitorcount, monitorcount)):
+        if current != str(value):
+            plan.modifyvm(flag, value)
+            changes.append((label, current, value))
+
+    # a rule of the same name is replaced
+    rules = {rule[0]: ",".join(rule) for rule in vminfo.natrules}
+    forwards = get_port_forwards(vd)
+    for rule, hostport, spec in forwards:
+        if rules.get(rule, "") != spec:
+            if rule in rules:
+                plan.modifyvm('--natpf1', 'delete', rule)
+            plan.modifyvm('--natpf1', spec)
+            changes.append(("NAT rule " + rule, rules.get(rule, ""), spec))
+
+    values = [(EXTRADATA_PREFIX + rule, hostport) for rule, hostport, spec in forwards]
+    values += [('GUI/ScaleFactor', scalefactor), ('wemul', 'ose')]
+    for key, value in values:
+        if extradata.get(key) != str(value):
+            plan.setextradata(key, value)
+            changes.append((key, extradata.get(key, ""), value))
+    return plan, changes
+
+def set_default(vd: WebosEmulator, extended, dry_run=False):
+    """set default values
 
-        # set signature
-        command = [VBOXM] + ['setextradata', name, 'wemul', 'ose']
-        subprocess.check_call(command, stdin=STDIN)
+    Only the settings which differ from the default values are changed,
+    nothing is run if the vd already has them.
 
+    Args:
+        vd (WebosEmulator): vd object
+        exteneded : function extended for vs code extension integration
+        dry_run (bool): print the commands without running them
+    """
+    assign_ports(vd, dry_run)
+    vminfo = get_vminfo(vd.name, extradata=True, options=True)
+    if vminfo is None:
+        print("webos-emulator : get settings error")
+        return False
+    plan, changes = default_plan(vd, vminfo, extended)
+    if not changes:
+        print("webos-emulator : %s has the default settings, no changes" % vd.name)
+        return True
+    for label, current, value in changes:
+        print("%-28s %s -> %s" % (label + ":", current or "-", value))
+    if dry_run:
+        plan.show(get_vboxm())
+        return True
+    try:
+        logging.info("set default....")
+        plan.run(get_vboxm())
     except subprocess.CalledProcessError as e:
         print("webos-emulator : setting error")
         logging.debug("setting error : %s" % e)
         return False
+    finally:
+        invalidate_inventory()
 
     return True
 
-def default_vd(vd: WebosEmulator):
+def default_vd(vd: WebosEmulator, dry_run=False):
     """set to default settings
 
     Args:
         vd (WebosEmulator): vd object
+        dry_run (bool): print the commands without running them
     """
     if is_vd_exists(vd.name):
         if not is_vd_running(vd.name):
-            if set_default(vd, False):
+            if set_default(vd, False, dry_run):
                 return True
             else:
                 print("webos-emulator : default_vd failed")
@@ -437,15 +692,16 @@ def default_vd(vd: WebosEmulator):
             print("webos-emulator : vd is running. please stop vd before setting default")
     return False
 
-def hidden_create(vd: WebosEmulator):
+def hidden_create(vd: WebosEmulator, dry_run=False):
     """hidden create vd
 
     Args:
         vd (WebosEmulator): vd object
+        dry_run (bool): print the commands without running them
     """
     if is_vd_exists(vd.name):
         if not is_vd_running(vd.name):
-            if set_default(vd, True):
+            if set_default(vd, True, dry_run):
                 return True
             else:
                 print("webos-emulator : hidden_create failed")
@@ -453,6 +709,25 @@ def hidden_create(vd: WebosEmulator):
             print("webos-emulator : vd is running. please stop vd before hidden create")
     return False
 
+def import_ova(name, ovafile):
+    """import the ova as a vd which boots from the disk
+
+    Raises subprocess.CalledProcessError if a VBoxManage command fails.
+
+    Args:
+        name (str): vd name
+        ovafile: ova format 1.0 file
+    """
+    command = [get_vboxm()] + ['import', ovafile, '--vsys', '0', '--vmname', name]
+    runner.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
+    invalidate_inventory()
+    command = [get_vboxm()] + ['modifyvm', name, '--boot1', 'disk', '--boot2', 'none', '--boot3', 'none', '--boot4', 'none']
+    runner.check_call(command, stdin=STDIN, stdout=DEVNULL)
+    old_name = get_storage_name(name)
+    if old_name:
+        command = [get_vboxm()] + ['storagectl', name, '--name', old_name, '--rename', name]
+        runner.check_call(command, stdin=STDIN, stdout=DEVNULL)
+
 def custom_vd(vd: WebosEmulator, ovafile):
     """set to default settings
 
@@ -463,21 +738,16 @@ def custom_vd(vd: WebosEmulator, ovafile):
     if not is_vd_exists(vd.name):
         try:
             logging.info("custom vd....")
-            command = [VBOXM] + ['import', ovafile, '--vsys', '0', '--vmname', vd.name]
-            subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL, stderr=get_stderr())
-            command = [VBOXM] + ['modifyvm', vd.name, '--boot1', 'disk', '--boot2', 'none', '--boot3', 'none', '--boot4', 'none']
-            subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL)
-            old_name = get_storage_name(vd.name)
-            if old_name:
-                command = [VBOXM] + ['storagectl', vd.name, '--name', old_name, '--rename', vd.name]
-                subprocess.check_call(command, stdin=STDIN, stdout=DEVNULL)
+            import_ova(vd.name, ovafile)
         except subprocess.CalledProcessError as e:
             print("webos-emulator : custom error")
             logging.debug("custom error : %s" % e)
+            invalidate_inventory()
             return False
         else: # creation success
+            invalidate_inventory()
             if vd.image: # TODO: just create a vd without an image?
-                if attach_storage(VBOXM, vd.name, vd.image): # TODOL check ok
+                if attach_storage(get_vboxm(), vd.name, vd.image): # TODOL check ok
                     print("webos-emulator : custom error")
                     return False
         return True